@@ -0,0 +1,148 @@
+import heapq
+import math
+import os
+import statistics
+import threading
+import time
+
+import agenda
+
+from util import *
+
+"""
+Adaptive stopping for poisson (etg) traffic, enabled by an [adaptive] section in the config:
+
+    [adaptive]
+    min_reqs = 5000          # never stop before this many requests completed (per client)
+    precision = 0.05         # target half-width of each confidence interval, relative to the estimate
+    confidence = 0.95
+    quantiles = [0.5, 0.99]  # median and tail
+    interval = 5             # seconds between checks
+
+While the experiment runs, FctConvergenceMonitor follows every etg client's *_reqs.out on the
+receiver and keeps the normalized FCT (fct / (size / rate + rtt)) of each completed request.
+Once, for every client, the confidence intervals of all quantiles are within the precision, it
+stops the clients (SIGINT), which ends the experiment early. num_reqs stays the upper bound.
+"""
+
+DEFAULTS = {
+    'min_reqs': 5000,
+    'precision': 0.05,
+    'confidence': 0.95,
+    'quantiles': [0.5, 0.99],
+    'interval': 5,
+}
+
+def adaptive_config(config):
+    if 'adaptive' not in config:
+        return None
+    cfg = dict(DEFAULTS)
+    cfg.update(config['adaptive'])
+    return cfg
+
+"""
+Distribution-free confidence interval for the q-quantile of the sorted samples xs, from the
+order statistics around n*q (normal approximation of the binomial distribution of the number of
+samples below the quantile). Returns (lo, hi), or None if there are too few samples.
+"""
+def quantile_ci(xs, q, z):
+    n = len(xs)
+    spread = z * math.sqrt(n * q * (1 - q))
+    lo = math.floor(n * q - spread)
+    hi = math.ceil(n * q + spread)
+    if lo < 0 or hi >= n:
+        return None
+    return (xs[lo], xs[hi])
+
+# fields of a line of an etg reqs file, like "Size:1000, Duration(usec):2500, ..."
+def reqs_fields(line):
+    fields = {}
+    for f in line.split():
+        sp = f.split(":", 1)
+        if len(sp) == 2:
+            fields[sp[0]] = sp[1].rstrip(",")
+    return fields
+
+class FctConvergenceMonitor(threading.Thread):
+    def __init__(self, config, node, exp, cfg):
+        super().__init__(name="adaptive", daemon=True)
+        self.node = node
+        self.cfg = cfg
+        self.pattern = os.path.join(config['iteration_dir'], "*_reqs.out")
+        self.bytes_per_sec = float(exp.rate) * 1e6 / 8
+        self.rtt = float(exp.rtt) / 1000
+        self.z = statistics.NormalDist().inv_cdf((1 + cfg['confidence']) / 2)
+        self.files = {} # path -> [offset, partial line, normalized fcts (sorted)]
+        self.start_time = None
+        self.stop_event = threading.Event()
+        self.stopped = None # set once the clients were stopped early
+
+    def run(self):
+        self.start_time = time.time()
+        while not self.stop_event.wait(self.cfg['interval']):
+            try:
+                self.poll()
+                if self.converged():
+                    self.stop_clients()
+                    return
+            except Exception as e:
+                warn("adaptive stopping disabled for this experiment: {}".format(e), exit=False)
+                return
+
+    # stop following the clients, returns the stopping point if they were stopped early
+    def finish(self):
+        self.stop_event.set()
+        self.join()
+        return self.stopped
+
+    def poll(self):
+        for path in self.node.glob(self.pattern):
+            state = self.files.setdefault(path, [0, '', []])
+            (data, state[0]) = self.node.read_from(path, state[0])
+            lines = (state[1] + data).split("\n")
+            state[1] = lines.pop()
+            new = []
+            for line in lines:
+                f = reqs_fields(line)
+                try:
+                    fct = int(f['Duration(usec)']) / 1e6
+                    ideal = int(f['Size']) / self.bytes_per_sec + self.rtt
+                except (KeyError, ValueError):
+                    continue
+                new.append(fct / ideal)
+            if new:
+                # only the new samples are sorted, then merged in
+                state[2] = list(heapq.merge(state[2], sorted(new)))
+
+    # fcts are sorted
+    def intervals(self, fcts):
+        return {q: quantile_ci(fcts, q, self.z) for q in self.cfg['quantiles']}, fcts
+
+    def converged(self):
+        if not self.files:
+            return False
+        for (_, _, fcts) in self.files.values():
+            if len(fcts) < self.cfg['min_reqs']:
+                return False
+            (cis, xs) = self.intervals(fcts)
+            for (q, ci) in cis.items():
+                if ci is None:
+                    return False
+                estimate = xs[min(int(len(xs) * q), len(xs) - 1)]
+                if (ci[1] - ci[0]) / 2 > self.cfg['precision'] * estimate:
+                    return False
+        return True
+
+    def stop_clients(self):
+        elapsed = time.time() - self.start_time
+        agenda.subtask("FCTs converged after {:.1f} seconds, stopping etg clients".format(elapsed))
+        self.stopped = {
+            'elapsed': elapsed,
+            'reqs': {os.path.basename(p): len(fcts) for (p, (_, _, fcts)) in self.files.items()},
+            'intervals': {
+                os.path.basename(p): {str(q): ci for (q, ci) in self.intervals(fcts)[0].items()}
+                for (p, (_, _, fcts)) in self.files.items()
+            },
+            'time': time.time(),
+        }
+        self.node.kill("etgClient", signal="INT")
@@ -0,0 +1,104 @@
+import os
+import re
+import statistics
+
+from traffic import IperfTraffic, CBRTraffic, PoissonTraffic, create_traffic_config
+
+"""
+Runtime estimates for experiments, for fitting a run into a fixed window (e.g. a cloudlab
+reservation) with --budget.
+
+An experiment lasts as long as its longest traffic source: iperf and cbr traffic run for
+their length, and poisson traffic for num_reqs requests at the configured load (using the mean
+request size from the size distribution). Estimates are calibrated against how long experiments
+actually took, as recorded in the run journal.
+"""
+
+# seconds spent per experiment outside of the traffic itself (killing processes, directories, ...)
+DEFAULT_OVERHEAD = 10
+# start_in_mahimahi sleeps this long before starting the clients
+MAHIMAHI_START_DELAY = 1
+
+def parse_duration(s):
+    m = re.fullmatch(r"\s*(?:(\d+(?:\.\d+)?)h)?\s*(?:(\d+(?:\.\d+)?)m)?\s*(?:(\d+(?:\.\d+)?)s?)?\s*", s)
+    if not m or not any(m.groups()):
+        raise ValueError("invalid duration '{}', expected e.g. 16h, 90m, 1h30m or 3600".format(s))
+    (h, mins, secs) = (float(g) if g else 0 for g in m.groups())
+    return h * 3600 + mins * 60 + secs
+
+def format_duration(secs):
+    secs = int(round(secs))
+    return "{}h{:02d}m{:02d}s".format(secs // 3600, (secs % 3600) // 60, secs % 60)
+
+# mean of a distribution given as "size cdf" lines, interpolating linearly between points like etg
+def mean_request_size(path):
+    points = []
+    with open(path) as f:
+        for line in f:
+            sp = line.split()
+            if len(sp) >= 2:
+                points.append((float(sp[0]), float(sp[1])))
+    return sum((p1 - p0) * (s0 + s1) / 2 for ((s0, p0), (s1, p1)) in zip(points, points[1:]))
+
+class CostModel:
+    def __init__(self, config, journal=None, overhead=DEFAULT_OVERHEAD):
+        self.config = config
+        self.overhead = overhead
+        self.mean_sizes = {}
+        self.scale = 1.0
+        if journal is not None:
+            self.calibrate(journal)
+
+    # the size distributions are read from this repository, the same files are copied to the nodes
+    def mean_size(self, dist):
+        if dist not in self.mean_sizes:
+            self.mean_sizes[dist] = mean_request_size(os.path.join('distributions', dist))
+        return self.mean_sizes[dist]
+
+    def traffic_duration(self, t):
+        if isinstance(t, (IperfTraffic, CBRTraffic)):
+            duration = float(t.length)
+        elif isinstance(t, PoissonTraffic):
+            bytes_per_sec = float(t.load) * 1e6 / 8
+            duration = int(t.num_reqs) * self.mean_size(t.distribution) / bytes_per_sec if bytes_per_sec else 0
+        else:
+            duration = 0
+        return float(t.start_delay) + duration
+
+    # predicted seconds of traffic, comparable to the elapsed time recorded in the journal
+    def estimate(self, exp):
+        traffic = list(create_traffic_config(exp.bundle_traffic, exp)) + list(create_traffic_config(exp.cross_traffic, exp))
+        return MAHIMAHI_START_DELAY + max((self.traffic_duration(t) for t in traffic), default=0)
+
+    # seconds a testbed is busy with exp
+    def cost(self, exp):
+        return self.estimate(exp) * self.scale + self.overhead
+
+    def calibrate(self, journal):
+        ratios = [
+            rec['elapsed'] / rec['estimate']
+            for rec in journal.finished()
+            if rec.get('elapsed') and rec.get('estimate')
+        ]
+        if ratios:
+            self.scale = statistics.median(ratios)
+
+"""
+Choose which of exps to run so that they finish within budget seconds on num_testbeds testbeds.
+
+Experiments are prioritized seed by seed (in the order the seeds are listed in the config), so
+that what fits is the full parameter matrix for as many seeds as possible, rather than a few
+parameter combinations with every seed. Returns the indices of the chosen experiments, in order.
+"""
+def fit_budget(exps, costs, budget, num_testbeds, seeds):
+    seed_rank = {s: i for (i, s) in enumerate(seeds)}
+    by_priority = sorted(range(len(exps)), key=lambda i: seed_rank.get(exps[i].seed, len(seeds)))
+
+    chosen = set()
+    total = 0
+    for i in by_priority:
+        if (total + costs[i]) / num_testbeds > budget:
+            break
+        total += costs[i]
+        chosen.add(i)
+    return sorted(chosen)
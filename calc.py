@@ -2,10 +2,11 @@
 
 import sys
 import os
-import glob
 from tqdm import tqdm
 import re
 
+from logfile import find_logs, open_log
+
 
 # grep "rin" nimbus.out| awk '{print $9,$13,$15,$17,$21,$23}' | tr -d ','
 def parse_ccp_log(f, grps):
@@ -32,10 +33,11 @@ def parse_ccp_log(f, grps):
 
 pattern = re.compile('fifo_(?P<bw>[\d]+)_(?P<delay>[\d]+)/nimbus.bundler_qlen=(?P<qlen>[\d]+).bundler_qlen_alpha=(?P<alpha>[\d]+).bundler_qlen_beta=(?P<beta>[\d]+)/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/ccp.log')
 def post_process_dir(d):
-    g = glob.glob(d + "/**/ccp.log", recursive=True)
+    # bulk collection keeps ccp.log gzipped
+    g = find_logs(d, "**/ccp.log")
     for exp in g:
         exp_root = "/".join(exp.split("/")[:-1])
-        with open(exp) as f:
+        with open_log(exp) as f:
             matches = pattern.search(exp)
             grps = matches.groups()
             parse_ccp_log(f, grps)
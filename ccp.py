@@ -70,13 +70,14 @@ def check_ccp_alg(config, node):
                     "node failed to build {}".format(alg)
                 )
 
-def start_ccp(config, inbox, alg):
+# out_dir: as in start_inbox
+def start_ccp(config, inbox, alg, out_dir=None):
     if config['args'].verbose:
         agenda.subtask("Starting ccp")
 
     ccp_binary = get_ccp_binary_path(config, alg['name'])
     ccp_binary_name = ccp_binary.split('/')[-1]
-    ccp_out = os.path.join(config['iteration_dir'], "ccp.log")
+    ccp_out = os.path.join(out_dir or config['iteration_dir'], "ccp.log")
 
     alg_name = alg['name']
     args = list(config['ccp'][alg_name]['args'].items())
@@ -94,11 +95,10 @@ def start_ccp(config, inbox, alg):
         stderr=ccp_out,
     ), "Failed to start ccp")
 
-    if not config['args'].dry_run:
-        time.sleep(1)
+    inbox.check_file('starting CCP', ccp_out, timeout=10)
     inbox.check_proc(ccp_binary_name, ccp_out)
-    inbox.check_file('starting CCP', ccp_out)
 
-    config['iteration_outputs'].append((inbox, ccp_out))
+    if out_dir is None:
+        config['iteration_outputs'].append((inbox, ccp_out))
 
     return ccp_out
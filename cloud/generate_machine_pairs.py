@@ -2,6 +2,8 @@ import os, sys, json
 from itertools import permutations
 from collections import deque
 
+from results_index import ResultsIndex
+
 ###############################################################################
 # Scheduling algorithm from:
 # https://en.wikipedia.org/wiki/Round-robin_tournament#Scheduling_algorithm
@@ -51,52 +53,52 @@ def name(m):
     else:
         assert False
 
+# the results of each pair are in <name(src)>-<name(dst)> next to the machines file
 def already_done(src, dst):
-    base_dir = os.path.dirname(filename)
-    dirname = base_dir.join(f"{name(src)}-{name(dst)}")
-    if not os.path.exists(dirname):
-        return False
-    fs = [[x, 'udping.log'] for x in ['control', 'iperf']]
-    return all(os.path.exists(os.path.join(dirname, *f)) for f in fs)
+    return index.complete(f"{name(src)}-{name(dst)}")
 
 ###############################################################################
 # Main
 
-if len(sys.argv) != 2:
-    print(f"usage: python3 {sys.argv[0]} [machines.json]")
-filename = sys.argv[1]
-
-with open(filename) as f:
-    machines = json.loads(f.read())
-
-machines = {i+1: m for i,m in zip(range(len(machines)), machines)}
-n = len(machines.keys())
-print(f"==> Found {n} machines in {filename}\n")
-
-sa, sb = schedule(n)
-
-# sanity check that all pairs have been used in the schedule
-flat = set(sum(sa, [])) | set(sum(sb, []))
-all_pairs = set(permutations(machines.keys(), 2))
-assert(flat == all_pairs)
-
-def write_phase(name, pairs):
-    print(f"{name}: {len(pairs)} pairs")
-    with open(name, 'w') as f:
-        objs = []
-        for (src,dst) in pairs:
-            if not already_done(machines[src], machines[dst]):
-                obj = {"from" : machines[src], "to" : machines[dst]}
-                objs.append(obj)
-        if len(objs) == 0:
-            print("> All pairs in Phase {phase} already completed, file will be empty.")
-        f.write(json.dumps(objs))
-
-# write the schedule to phase files
-phase = 1
-for i in range(len(sa)):
-    pairs = sa[i]
-    opp = sb[i]
-    write_phase(f"phase_{phase}a.json", pairs)
-    write_phase(f"phase_{phase}b.json", opp)
-    phase += 1
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(f"usage: python3 {sys.argv[0]} [machines.json]")
+    filename = sys.argv[1]
+
+    with open(filename) as f:
+        machines = json.loads(f.read())
+
+    index = ResultsIndex(os.path.dirname(os.path.abspath(filename)))
+    index.refresh()
+
+    machines = {i+1: m for i,m in zip(range(len(machines)), machines)}
+    n = len(machines.keys())
+    print(f"==> Found {n} machines in {filename}\n")
+
+    sa, sb = schedule(n)
+
+    # sanity check that all pairs have been used in the schedule
+    flat = set(sum(sa, [])) | set(sum(sb, []))
+    all_pairs = set(permutations(machines.keys(), 2))
+    assert(flat == all_pairs)
+
+    def write_phase(name, pairs):
+        print(f"{name}: {len(pairs)} pairs")
+        with open(name, 'w') as f:
+            objs = []
+            for (src,dst) in pairs:
+                if not already_done(machines[src], machines[dst]):
+                    obj = {"from" : machines[src], "to" : machines[dst]}
+                    objs.append(obj)
+            if len(objs) == 0:
+                print("> All pairs in Phase {phase} already completed, file will be empty.")
+            f.write(json.dumps(objs))
+
+    # write the schedule to phase files
+    phase = 1
+    for i in range(len(sa)):
+        pairs = sa[i]
+        opp = sb[i]
+        write_phase(f"phase_{phase}a.json", pairs)
+        write_phase(f"phase_{phase}b.json", opp)
+        phase += 1
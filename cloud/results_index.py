@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from udping_ingest import RUNS
+
+"""
+A persistent index of a cloud results directory, kept in results_index.sqlite in it.
+
+For every pair directory (src-dst or src-dst-iter) it records whether the pair is complete (has
+the control and iperf udping logs), and once parsed, the size, mtime and sha256 of each log it was
+parsed from, the parameters used and the files the results were written to. A finished pair's
+logs never change, so later runs reuse its results, and the scheduler
+(generate_machine_pairs.py) knows which pairs are done without looking into each directory.
+
+Only the process that owns the index writes to it; workers return input_checksums() for it.
+"""
+
+INDEX_NAME = 'results_index.sqlite'
+# a pair is done once these exist
+COMPLETE = [('control', 'udping.log'), ('iperf', 'udping.log')]
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# the logs of a pair directory, relative to it
+def pair_logs(pair_dir):
+    for run in RUNS:
+        for log in ['udping.log.gz', 'bmon.log.gz']:
+            if os.path.isfile(os.path.join(pair_dir, run, log)):
+                yield os.path.join(run, log)
+
+# {log: [size, mtime_ns, sha256]} for the logs of a pair directory
+def input_checksums(pair_dir):
+    out = {}
+    for log in pair_logs(pair_dir):
+        st = os.stat(os.path.join(pair_dir, log))
+        out[log] = [st.st_size, st.st_mtime_ns, file_hash(os.path.join(pair_dir, log))]
+    return out
+
+def is_complete(pair_dir):
+    return all(
+        os.path.exists(os.path.join(pair_dir, run, log)) or os.path.exists(os.path.join(pair_dir, run, log + ".gz"))
+        for (run, log) in COMPLETE
+    )
+
+class ResultsIndex:
+    def __init__(self, results_dir):
+        self.results_dir = results_dir
+        self.db = sqlite3.connect(os.path.join(results_dir, INDEX_NAME))
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pairs (
+                dir TEXT PRIMARY KEY,
+                complete INTEGER NOT NULL DEFAULT 0,
+                inputs TEXT,
+                params TEXT,
+                outputs TEXT,
+                parsed REAL
+            )""")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def row(self, d):
+        return self.db.execute("SELECT complete, inputs, params, outputs FROM pairs WHERE dir = ?", (d,)).fetchone()
+
+    """
+    Record which pair directories are complete, looking only into the ones that were not
+    complete before. Directories are named src-dst or src-dst-iter.
+    """
+    def refresh(self):
+        done = {d for (d,) in self.db.execute("SELECT dir FROM pairs WHERE complete = 1")}
+        for d in os.listdir(self.results_dir):
+            if d in done or len(d.split('-')) not in (2, 3) or 'ssh' in d:
+                continue
+            pair_dir = os.path.join(self.results_dir, d)
+            if os.path.isdir(pair_dir) and is_complete(pair_dir):
+                self.db.execute("INSERT INTO pairs (dir, complete) VALUES (?, 1) ON CONFLICT(dir) DO UPDATE SET complete = 1", (d,))
+        self.db.commit()
+
+    def complete(self, d):
+        row = self.row(d)
+        return row is not None and bool(row[0])
+
+    """
+    Whether pair directory d must be parsed again: it never was with these params, one of its
+    outputs is missing, or its logs changed. Logs whose size and mtime are unchanged are trusted
+    to be, the others are hashed.
+    """
+    def changed(self, d, params):
+        row = self.row(d)
+        if row is None or row[1] is None or json.loads(row[2]) != json.loads(json.dumps(params)):
+            return True
+        if not all(os.path.exists(o) for o in json.loads(row[3])):
+            return True
+        inputs = json.loads(row[1])
+        pair_dir = os.path.join(self.results_dir, d)
+        if sorted(inputs) != sorted(pair_logs(pair_dir)):
+            return True
+        touched = False
+        for (log, (size, mtime_ns, sha256)) in inputs.items():
+            st = os.stat(os.path.join(pair_dir, log))
+            if st.st_size != size:
+                return True
+            if st.st_mtime_ns != mtime_ns:
+                if file_hash(os.path.join(pair_dir, log)) != sha256:
+                    return True
+                # same contents, no need to hash it next time
+                inputs[log][1] = st.st_mtime_ns
+                touched = True
+        if touched:
+            self.db.execute("UPDATE pairs SET inputs = ? WHERE dir = ?", (json.dumps(inputs), d))
+            self.db.commit()
+        return False
+
+    def outputs(self, d):
+        return json.loads(self.row(d)[3])
+
+    # record that d was parsed from inputs (as from input_checksums) with params into outputs
+    def update(self, d, inputs, params, outputs):
+        complete = is_complete(os.path.join(self.results_dir, d))
+        self.db.execute("""
+            INSERT INTO pairs (dir, complete, inputs, params, outputs, parsed) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(dir) DO UPDATE SET complete = excluded.complete, inputs = excluded.inputs,
+                params = excluded.params, outputs = excluded.outputs, parsed = excluded.parsed
+            """, (d, int(complete), json.dumps(inputs), json.dumps(params), json.dumps(outputs), time.time()))
+        self.db.commit()
@@ -0,0 +1,220 @@
+import heapq
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from itertools import permutations
+from statistics import median
+
+from generate_machine_pairs import name, schedule
+from results_index import ResultsIndex, is_complete
+
+"""
+Schedule the machine-pair matrix by how long each pair takes and what its machines cost, instead
+of in the lockstep phases of generate_machine_pairs.py, where the slowest pair of a phase holds
+up (and keeps paying for) every machine of the phase.
+
+Each pair is started as soon as both of its machines are free (a machine is only in one pair at
+a time), as its own matrix run. When several pairs could start, the ones whose machines have the
+most work left go first, then the longest ones (list scheduling); with --max-rate, pairs are only
+started while the machines running cost at most that many $/hour together.
+
+    python3 schedule_pairs.py machines.json --costs costs.json              # plan: schedule.json
+    python3 schedule_pairs.py machines.json --costs costs.json --dispatch   # and run it
+
+Durations are measured: dispatching records how long each pair's matrix run took, spawning the
+machines included, in pair_durations.json next to the machines file. Pairs that never ran are
+assumed to take as long as the median pair (or DEFAULT_SECONDS before any did). costs.json maps
+machine names (as in the results directories, e.g. aws_uswest1) to $/hour, with "default" for
+the others (0 if not given). Pairs already complete (see ResultsIndex) are left out.
+
+The plan is simulated with the estimates, and compared with the phases: a matrix run keeps all
+its machines until its last pair is done, so a phase costs its longest pair times the hourly
+cost of all its machines, while a single-pair run costs its duration times the cost of its two.
+When dispatching, the schedule adapts to the actual durations, not the estimated ones.
+"""
+
+DURATIONS_NAME = 'pair_durations.json'
+# three runs of about 3 minutes each, plus spawning the machines
+DEFAULT_SECONDS = 720
+
+Pair = namedtuple('Pair', ['name', 'src', 'dst', 'spec', 'seconds', 'rate'])
+
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def record_duration(results_dir, pair, seconds):
+    path = os.path.join(results_dir, DURATIONS_NAME)
+    durations = load_json(path, {})
+    durations.setdefault(pair, []).append(round(seconds, 1))
+    with open(path + ".tmp", 'w') as f:
+        json.dump(durations, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+# the estimated seconds of each pair: the median of its runs, or of all pairs if it never ran
+def estimator(durations):
+    measured = {p: median(ds) for (p, ds) in durations.items() if ds}
+    fallback = median(measured.values()) if measured else DEFAULT_SECONDS
+    return lambda pair: measured.get(pair, fallback)
+
+def hourly(costs, machine):
+    return costs.get(machine, costs.get('default', 0))
+
+# the pairs of machines (a list, as in machines.json) that are not complete yet
+def pending_pairs(machines, index, durations, costs):
+    seconds = estimator(durations)
+    pairs = []
+    for (src, dst) in permutations(machines, 2):
+        (s, d) = (name(src), name(dst))
+        pair = f"{s}-{d}"
+        if index.complete(pair):
+            continue
+        pairs.append(Pair(pair, s, d, {"from": src, "to": dst}, seconds(pair), hourly(costs, s) + hourly(costs, d)))
+    return pairs
+
+"""
+The pairs of pending to start now, given the busy machines and the $/hour they cost together.
+Pairs whose machines have the most estimated work left go first, so that no machine ends up
+running its pairs one after the other at the end, then the longest pairs.
+"""
+def ready(pending, busy, rate, max_rate=None):
+    left = {}
+    for p in pending:
+        left[p.src] = left.get(p.src, 0) + p.seconds
+        left[p.dst] = left.get(p.dst, 0) + p.seconds
+    busy = set(busy)
+    start = []
+    for p in sorted(pending, key=lambda p: (-max(left[p.src], left[p.dst]), -p.seconds, p.name)):
+        if p.src in busy or p.dst in busy:
+            continue
+        # a pair above the limit on its own still runs, once nothing else does
+        if max_rate is not None and busy and rate + p.rate > max_rate:
+            continue
+        busy |= {p.src, p.dst}
+        rate += p.rate
+        start.append(p)
+    return start
+
+# simulate dispatching pairs with their estimated durations: [(start, pair)], makespan, $
+def simulate(pairs, max_rate=None):
+    pending = list(pairs)
+    running = []    # heap of (end, name, pair)
+    plan = []
+    t = 0
+    while pending or running:
+        busy = {m for (_, _, p) in running for m in (p.src, p.dst)}
+        for p in ready(pending, busy, sum(p.rate for (_, _, p) in running), max_rate):
+            pending.remove(p)
+            heapq.heappush(running, (t + p.seconds, p.name, p))
+            plan.append((t, p))
+        (t, _, _) = heapq.heappop(running)
+        while running and running[0][0] <= t:
+            heapq.heappop(running)
+    spend = sum(p.seconds * p.rate for (_, p) in plan) / 3600
+    return plan, t, spend
+
+# the makespan and $ of running the same pairs in the phases of generate_machine_pairs.py
+def phases_estimate(machines, pairs):
+    by_ids = {}
+    for p in pairs:
+        by_ids[(p.src, p.dst)] = p
+    ids = {i + 1: name(m) for (i, m) in enumerate(machines)}
+    (sa, sb) = schedule(len(machines))
+    makespan = 0
+    spend = 0
+    for phase in sa + sb:
+        ps = [by_ids[(ids[s], ids[d])] for (s, d) in phase if (ids[s], ids[d]) in by_ids]
+        if not ps:
+            continue
+        longest = max(p.seconds for p in ps)
+        makespan += longest
+        # every machine of the phase is in one of its pairs
+        spend += longest * sum(p.rate for p in ps) / 3600
+    return makespan, spend
+
+def fmt_time(seconds):
+    return f"{seconds / 3600:.1f}h" if seconds >= 3600 else f"{seconds / 60:.0f}m"
+
+"""
+Run the pairs, each as a matrix run of its own (in results_dir, with its output in
+pairs/<pair>.log there), starting pairs as machines free up. Records the duration of the pairs
+that complete.
+"""
+def dispatch(pairs, results_dir, matrix, max_rate=None, poll=5):
+    cfg_dir = os.path.join(results_dir, 'pairs')
+    os.makedirs(cfg_dir, exist_ok=True)
+    pending = list(pairs)
+    running = {}    # proc: (pair, start time, log file)
+    failed = []
+    while pending or running:
+        busy = {m for (p, _, _) in running.values() for m in (p.src, p.dst)}
+        for p in ready(pending, busy, sum(p.rate for (p, _, _) in running.values()), max_rate):
+            pending.remove(p)
+            cfg = os.path.join(cfg_dir, p.name + ".json")
+            with open(cfg, 'w') as f:
+                json.dump([p.spec], f)
+            log = open(os.path.join(cfg_dir, p.name + ".log"), 'w')
+            print(f"==> starting {p.name} (estimated {fmt_time(p.seconds)}, {len(pending)} pairs left)")
+            proc = subprocess.Popen(matrix + ["--cfg", cfg], cwd=results_dir, stdout=log, stderr=subprocess.STDOUT)
+            running[proc] = (p, time.time(), log)
+
+        time.sleep(poll)
+        for proc in [proc for proc in running if proc.poll() is not None]:
+            (p, start, log) = running.pop(proc)
+            log.close()
+            took = time.time() - start
+            if proc.returncode == 0 and is_complete(os.path.join(results_dir, p.name)):
+                record_duration(results_dir, p.name, took)
+                print(f"==> {p.name} done in {fmt_time(took)}")
+            else:
+                print(f"> {p.name} failed after {fmt_time(took)} (exit code {proc.returncode}), see {log.name}")
+                failed.append(p.name)
+    return failed
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Schedule the machine-pair matrix by measured duration and cost")
+    parser.add_argument("machines", help="machines.json; results are in the directory it is in")
+    parser.add_argument("--costs", help="JSON file of {machine name: $/hour}, with an optional \"default\"")
+    parser.add_argument("--max-rate", type=float, help="Most $/hour to spend on running machines at once")
+    parser.add_argument("--out", default="schedule.json", help="Where to write the planned schedule (default: schedule.json)")
+    parser.add_argument("--dispatch", action="store_true", help="Run the pairs, instead of only planning them")
+    parser.add_argument("--matrix", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "target", "release", "matrix"),
+        help="The matrix binary (default: target/release/matrix, from cargo b --release)")
+    args = parser.parse_args()
+
+    with open(args.machines) as f:
+        machines = json.load(f)
+    results_dir = os.path.dirname(os.path.abspath(args.machines))
+    costs = load_json(args.costs, {}) if args.costs else {}
+    durations = load_json(os.path.join(results_dir, DURATIONS_NAME), {})
+
+    index = ResultsIndex(results_dir)
+    index.refresh()
+    pairs = pending_pairs(machines, index, durations, costs)
+    index.close()
+    measured = sum(1 for p in pairs if p.name in durations)
+    print(f"==> {len(pairs)} pairs left of {len(machines) * (len(machines) - 1)}, {measured} with measured durations")
+    if not pairs:
+        sys.exit(0)
+
+    (plan, makespan, spend) = simulate(pairs, args.max_rate)
+    (phase_makespan, phase_spend) = phases_estimate(machines, pairs)
+    print(f"dispatched: {fmt_time(makespan)}, ${spend:.2f}")
+    print(f"in phases:  {fmt_time(phase_makespan)}, ${phase_spend:.2f}")
+    with open(args.out, 'w') as f:
+        json.dump([
+            {"pair": p.name, "start": round(start, 1), "seconds": round(p.seconds, 1), "rate": p.rate, **p.spec}
+            for (start, p) in plan
+        ], f, indent=2)
+
+    if args.dispatch:
+        failed = dispatch(pairs, results_dir, [args.matrix], args.max_rate)
+        if failed:
+            sys.exit(f"{len(failed)} pairs failed: {', '.join(failed)}")
@@ -0,0 +1,132 @@
+import gzip
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+"""
+Fast ingestion of the cloud experiments' udping and bmon logs.
+
+Each src-dst directory of a results directory has a control, iperf and bundler run, each with a
+udping.log.gz and (except control) a bmon.log.gz. The logs are decompressed in large blocks and
+every block is parsed with one regex pass, and the pairs are parsed in parallel processes:
+
+    for (pair, runs) in ingest(results_dir):
+        pings = runs['control']['udping']    # {port: array of (time, rtt) rows}
+        rates = runs['iperf']['bmon']         # array of rx rates in bits/s
+
+udping timestamps (Sep 04 20:55:50.139) have no year or timezone, so they are converted to
+seconds since the start of a non-leap year; only differences matter, as times are relative to the
+first ping of the log.
+"""
+
+RUNS = ['control', 'iperf', 'bundler']
+CHUNK_BYTES = 16 << 20
+
+# expected format
+# Sep 04 20:55:50.139 INFO Ping response, time: [rtt], local: 0.0.0.0:[srcport], from: ...
+ping_rgx = re.compile(rb"^(\w{3}) (\d+) (\d+):(\d+):(\d+(?:\.\d*)?) \S+ Ping response, time: ([0-9.eE+-]+),? local: [^\s,]*:(\d+)", re.M)
+# [iface] [rxrate_bytes]
+bmon_rgx = re.compile(rb"^\S+\s+([0-9.eE+-]+)\s*$", re.M)
+
+MONTHS = [b'Jan', b'Feb', b'Mar', b'Apr', b'May', b'Jun', b'Jul', b'Aug', b'Sep', b'Oct', b'Nov', b'Dec']
+DAYS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+MONTH_START = {m: sum(DAYS[:i]) * 86400 for (i, m) in enumerate(MONTHS)}
+YEAR = 365 * 86400
+
+def read_gzip_chunks(path):
+    with gzip.open(path, 'rb') as f:
+        rest = b''
+        while True:
+            data = f.read(CHUNK_BYTES)
+            if not data:
+                if rest:
+                    yield rest
+                return
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            yield data[:cut]
+
+def as_floats(values):
+    return np.array(values, dtype=np.bytes_).astype(np.float64) if values else np.zeros(0)
+
+# timestamps (the month, day, hour, minute and second fields of the log) to seconds since the start of the year
+def timestamps(months, days, hours, minutes, seconds):
+    t = np.array([MONTH_START[m] for m in months], dtype=np.float64)
+    t += (as_floats(days) - 1) * 86400 + as_floats(hours) * 3600 + as_floats(minutes) * 60 + as_floats(seconds)
+    return t
+
+"""
+Parse a udping.log.gz into {srcport: array of (time, rtt) rows}, times in seconds relative to the
+first ping in the log. Returns None if the log is missing.
+"""
+def parse_udping(fname):
+    if not os.path.isfile(fname):
+        print(f"error: missing {fname}")
+        return None
+    times = []
+    rtts = []
+    ports = []
+    for chunk in read_gzip_chunks(fname):
+        pings = ping_rgx.findall(chunk)
+        if not pings:
+            continue
+        cols = list(zip(*pings))
+        times.append(timestamps(*cols[:5]))
+        rtts.append(as_floats(cols[5]))
+        ports.append(np.array(cols[6], dtype=np.bytes_))
+    if not times:
+        return {}
+    times = np.concatenate(times)
+    rtts = np.concatenate(rtts)
+    ports = np.concatenate(ports)
+    # a log that runs past new year would go back in time: those times get a year added (checked
+    # against the first ping of the whole log, as a chunk can start after new year)
+    times[times < times[0] - YEAR / 2] += YEAR
+    times -= times.min()
+
+    # group by port, keeping the order of the log within each port
+    (uniq, inv) = np.unique(ports, return_inverse=True)
+    order = np.argsort(inv, kind='stable')
+    bounds = np.cumsum(np.bincount(inv, minlength=len(uniq)))[:-1]
+    return {
+        port.decode(): np.column_stack([times[idx], rtts[idx]])
+        for (port, idx) in zip(uniq, np.split(order, bounds))
+    }
+
+# parse a bmon.log.gz into an array of rx rates in bits/s, None if the log is missing
+def parse_bmon(fname):
+    if not os.path.isfile(fname):
+        print(f"error: missing {fname}")
+        return None
+    rates = [as_floats(bmon_rgx.findall(chunk)) for chunk in read_gzip_chunks(fname)]
+    return np.concatenate(rates) * 8 if rates else np.zeros(0)
+
+# the udping and bmon results of each run of a machine pair (run in a worker process)
+def ingest_pair(pair_dir):
+    runs = {}
+    for run in RUNS:
+        runs[run] = {'udping': parse_udping(os.path.join(pair_dir, run, 'udping.log.gz'))}
+        if run != 'control':
+            runs[run]['bmon'] = parse_bmon(os.path.join(pair_dir, run, 'bmon.log.gz'))
+    return runs
+
+# the src-dst directories of a results directory, sorted (src-dst-iter ones with parts=3)
+def pair_dirs(results_dir, parts=2):
+    for path in sorted(os.listdir(results_dir)):
+        sp = path.split('-')
+        if not os.path.isdir(os.path.join(results_dir, path)) or len(sp) != parts or 'ssh' in path:
+            continue
+        yield path
+
+"""
+Parse the logs of all pairs in results_dir, in jobs processes (one per core by default).
+Yields (pair directory name, runs) in sorted order, with runs as returned by ingest_pair.
+"""
+def ingest(results_dir, dirs=None, jobs=None):
+    dirs = list(pair_dirs(results_dir) if dirs is None else dirs)
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(ingest_pair, [os.path.join(results_dir, d) for d in dirs])
+        for (d, runs) in zip(dirs, results):
+            yield (d, runs)
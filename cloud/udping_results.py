@@ -0,0 +1,198 @@
+import os
+import shutil
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from udping_ingest import ingest_pair, pair_dirs
+from results_index import ResultsIndex, input_checksums
+
+"""
+Turn a cloud results directory into the tables the plot scripts read:
+
+    udping_results.out  every ping:          <keys> [time] port Latency rtt
+    bmon_results.out    every bmon sample:   <keys> Throughput bw
+    minrtts.out         high-rtt ports:      <keys> port Latency
+    port_stats.out      rtts per port:       <keys> Latency port n min mean p50 p90 p99
+
+with Latency/Throughput the run (control, iperf or bundler) and <keys> identifying the pair
+directory, as named by the results' layout (see LAYOUTS): src dst, or src dst iter.
+
+Each pair is parsed by a worker process, which writes its rows to part files that are then
+concatenated in sorted order, so memory use depends on the size of a pair, not on how many
+there are. The part files are kept in .udping_cache/ in the results directory, and a pair is
+only parsed again if its logs changed since (see ResultsIndex).
+"""
+
+"""
+How the pair directories of a results directory are named: keys are the dash-separated parts
+of the name, and with timeline the pings are written with their time (otherwise only the rtts).
+"""
+Layout = namedtuple('Layout', ['name', 'keys', 'timeline'])
+
+LAYOUTS = [
+    Layout('pairs', ['src', 'dst'], True),
+    Layout('iterations', ['src', 'dst', 'iter'], False),
+]
+
+RUNS = ['control', 'iperf', 'bundler']
+PERCENTILES = [50, 90, 99]
+# ports whose mean control rtt is above this go in minrtts.out
+HIGH_RTT = 50
+
+TABLES = ['udping_results.out', 'bmon_results.out', 'minrtts.out', 'port_stats.out']
+# part of every pair's parameters in the index: bump when the tables change, to rewrite cached parts
+TABLES_VERSION = 2
+
+def headers(layout):
+    keys = layout.keys
+    return [
+        keys + (['time'] if layout.timeline else []) + ['port', 'Latency', 'rtt'],
+        keys + ['Throughput', 'bw'],
+        keys + ['port', 'Latency'],
+        keys + ['Latency', 'port', 'n', 'min', 'mean'] + ['p{}'.format(p) for p in PERCENTILES],
+    ]
+
+def get_layout(name):
+    for layout in LAYOUTS:
+        if layout.name == name:
+            return layout
+    sys.exit(f"unknown layout {name}, expected one of {', '.join(l.name for l in LAYOUTS)}")
+
+# the layout most of the directories in results_dir are named by
+def detect_layout(results_dir):
+    counts = [(len(list(pair_dirs(results_dir, parts=len(l.keys)))), l) for l in LAYOUTS]
+    (n, layout) = max(counts, key=lambda c: c[0])
+    if n == 0:
+        sys.exit(f"no pair directories in {results_dir}")
+    return layout
+
+"""
+Count, min, mean and percentiles of the rtts of every port, in one pass: the rtts are sorted by
+port and value together, and each statistic is then computed for all ports at once from the
+segment boundaries. ports and rtts are parallel arrays; returns (ports, {stat: array}).
+"""
+def port_stats(ports, rtts):
+    order = np.lexsort((rtts, ports))
+    (ports, rtts) = (ports[order], rtts[order])
+    (uniq, starts, counts) = np.unique(ports, return_index=True, return_counts=True)
+    stats = {
+        'n': counts,
+        'min': rtts[starts],
+        'mean': np.add.reduceat(rtts, starts) / counts,
+    }
+    for p in PERCENTILES:
+        # linear interpolation between the closest ranks, like np.percentile
+        pos = starts + (counts - 1) * (p / 100)
+        (lo, hi) = (np.floor(pos).astype(np.int64), np.ceil(pos).astype(np.int64))
+        stats['p{}'.format(p)] = rtts[lo] + (rtts[hi] - rtts[lo]) * (pos - lo)
+    return uniq, stats
+
+"""
+Write a row per element of the parallel arrays columns with fmt, which has a %s per column. Numbers
+are written as their shortest repr (numpy's str of a float64), which reads back as the same value.
+"""
+def write_rows(f, fmt, *columns):
+    np.savetxt(f, np.column_stack([np.asarray(c).astype(str) for c in columns]), fmt=fmt)
+
+"""
+Parse one pair directory into part files named prefix.<table> (run in a worker process).
+Returns the part files written (none if the pair has no control pings) and the checksums of the
+logs they were parsed from.
+"""
+def write_pair(pair_dir, keys, timeline, prefix):
+    inputs = input_checksums(pair_dir)
+    runs = ingest_pair(pair_dir)
+    control = runs['control']['udping']
+    parts = [prefix + "." + t for t in TABLES]
+    for part in parts:
+        if os.path.exists(part):
+            os.remove(part)
+    if control is None:
+        return [], inputs
+    # (escaped, as it goes in the savetxt formats)
+    key = " ".join(keys).replace("%", "%%")
+
+    with open(parts[0], 'w', buffering=1<<20) as pings, open(parts[3], 'w') as stats:
+        for run in RUNS:
+            run_pings = runs[run]['udping'] or {}
+            ports = [p for p in control if p in run_pings]
+            for port in ports:
+                if timeline:
+                    write_rows(pings, f"{key} %s {port} {run} %s", run_pings[port][:, 0], run_pings[port][:, 1])
+                else:
+                    write_rows(pings, f"{key} {port} {run} %s", run_pings[port][:, 1])
+            if not ports:
+                continue
+            all_ports = np.concatenate([np.full(len(run_pings[p]), int(p)) for p in ports])
+            all_rtts = np.concatenate([run_pings[p][:, 1] for p in ports])
+            (uniq, s) = port_stats(all_ports, all_rtts)
+            cols = [s['n'], s['min'], s['mean']] + [s['p{}'.format(p)] for p in PERCENTILES]
+            np.savetxt(stats, np.column_stack([uniq] + cols), fmt=f"{key} {run} %d %d" + " %.3f" * (len(cols) - 1))
+            if run == 'control':
+                high = s['mean'] > HIGH_RTT
+                with open(parts[2] + ".tmp", 'w') as minrtts:
+                    write_rows(minrtts, f"{key} %s %s", uniq[high], s['mean'][high])
+                os.replace(parts[2] + ".tmp", parts[2])
+
+    with open(parts[1], 'w', buffering=1<<20) as bmon:
+        for run in ['iperf', 'bundler']:
+            if runs[run]['bmon'] is not None:
+                write_rows(bmon, f"{key} {run} %s", runs[run]['bmon'])
+    return [p for p in parts if os.path.exists(p)], inputs
+
+"""
+Write the tables for every pair directory of results_dir to out_dir (default: results_dir),
+with the given layout (by default, the one most directories match), parsing jobs pairs at a
+time (one per core by default). Pairs whose logs did not change since they were last parsed
+are not parsed again.
+"""
+def write_results(results_dir, out_dir=None, layout=None, jobs=None):
+    out_dir = results_dir if out_dir is None else out_dir
+    layout = detect_layout(results_dir) if layout is None else get_layout(layout)
+    dirs = list(pair_dirs(results_dir, parts=len(layout.keys)))
+    print(f"{len(dirs)} pair directories ({layout.name}: {'-'.join(layout.keys)})")
+
+    cache_dir = os.path.join(results_dir, ".udping_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    index = ResultsIndex(results_dir)
+    params = [layout.name, TABLES_VERSION]
+    todo = [d for d in dirs if index.changed(d, params)]
+    print(f"parsing {len(todo)} new or changed pair(s)")
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            d: pool.submit(write_pair, os.path.join(results_dir, d), d.split('-'), layout.timeline, os.path.join(cache_dir, d))
+            for d in todo
+        }
+        outs = [open(os.path.join(out_dir, t), 'w', buffering=1<<20) for t in TABLES]
+        try:
+            for (out, header) in zip(outs, headers(layout)):
+                out.write(" ".join(header) + "\n")
+            for d in dirs:
+                if d in futures:
+                    (parts, inputs) = futures[d].result()
+                    index.update(d, inputs, params, parts)
+                else:
+                    parts = index.outputs(d)
+                for part in parts:
+                    # parts are named <pair directory>.<table>
+                    out = outs[TABLES.index(os.path.basename(part)[len(d) + 1:])]
+                    with open(part) as f:
+                        shutil.copyfileobj(f, out, 1<<20)
+        finally:
+            for out in outs:
+                out.close()
+            index.close()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Parse the udping and bmon logs of a cloud results directory")
+    parser.add_argument("results_dir")
+    parser.add_argument("--out", help="Where to write the tables (default: the results directory)")
+    parser.add_argument("--layout", choices=[l.name for l in LAYOUTS], help="How the pair directories are named (default: detected)")
+    parser.add_argument("--jobs", "-j", type=int, help="Number of pairs to parse in parallel (default: number of cores)")
+    args = parser.parse_args()
+    write_results(args.results_dir, out_dir=args.out, layout=args.layout, jobs=args.jobs)
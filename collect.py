@@ -0,0 +1,209 @@
+import gzip
+import hashlib
+import os
+import shlex
+import shutil
+import subprocess
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from util import *
+from logfile import COMPRESSED_EXT
+
+"""
+Copies an iteration's outputs back to the local machine in the background, so the testbed can
+start the next experiment while the previous one's (possibly large) logs are still downloading.
+
+There is at most one collection in flight per collector: submit() first waits for the previous
+one to finish (the completion barrier), so a slow link never lets results pile up. Each file is
+retried with exponential backoff before giving up on it. Call close() before parsing results.
+
+With bulk=True (eval.py --bulk), each machine's outputs come back as one archive instead of one
+sftp transfer per file: the machine hashes them (sha256sum) and streams them as a tar compressed
+with zstd, or gzip where zstd is missing on either end. Every file is checked against its hash
+as it is unpacked; the large text logs (KEEP_COMPRESSED) are kept gzipped, as <name>.gz, which
+the parsers read directly (see logfile.py). Files that don't make it are fetched one by one.
+"""
+
+# outputs stored compressed when collected in bulk
+KEEP_COMPRESSED = ('ccp.log', 'downlink.log')
+# gzip level they are stored with: they compress well even at the fastest one
+KEEP_LEVEL = 1
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+class ResultCollector:
+    def __init__(self, config, background=True, retries=3, backoff=1, bulk=False):
+        self.config = config
+        self.background = background
+        self.bulk = bulk
+        self.retries = retries
+        self.backoff = backoff
+        self.pending = None
+        self.sftp = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="collect") if background else None
+
+    # on_done(failed) is called from the collector thread with the files that could not be fetched
+    def submit(self, outputs, local_dir, on_done=None):
+        self.wait()
+        outputs = [(m, fname) for (m, fname) in outputs if 'self' not in self.config or m != self.config['self']]
+        if not self.background:
+            self.collect(outputs, local_dir, on_done)
+            return
+
+        self.pending = self.executor.submit(self.collect, outputs, local_dir, on_done)
+
+    def wait(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        self.wait()
+        if self.executor:
+            self.executor.shutdown()
+        for sftp in self.sftp.values():
+            sftp.close()
+        self.sftp = {}
+
+    def collect(self, outputs, local_dir, on_done=None):
+        files = []
+        for (m, fname) in outputs:
+            if fname.startswith("~/"):
+                fname = fname[2:]
+            files.append((m, fname, os.path.join(local_dir, os.path.basename(fname))))
+        if self.bulk:
+            files = self.collect_bulk(files, local_dir)
+
+        failed = []
+        for (m, fname, local) in files:
+            if not self.fetch(m, fname, local):
+                failed.append(fname)
+
+        if failed:
+            warn("could not collect {} file(s) into {}".format(len(failed), local_dir), exit=False)
+        if on_done:
+            on_done(failed)
+        return failed
+
+    # collect files (m, remote, local) one archive per machine, returns the ones that weren't
+    def collect_bulk(self, files, local_dir):
+        missing = []
+        machines = []
+        for (m, _, _) in files:
+            if m not in machines:
+                machines.append(m)
+        for m in machines:
+            wanted = [(fname, local) for (n, fname, local) in files if n is m]
+            try:
+                got = self.fetch_archive(m, wanted, local_dir)
+            except Exception as e:
+                warn("could not collect an archive from {}: {}".format(m.addr, e), exit=False)
+                got = set()
+            missing += [(m, fname, local) for (fname, local) in wanted if fname not in got]
+        return missing
+
+    """
+    Stream the files [(remote, local)] from m as one compressed tar and unpack them, each checked
+    against the sha256 m computed for it. Returns the remote names of the files unpacked.
+    """
+    def fetch_archive(self, m, wanted, local_dir):
+        names = " ".join(shlex.quote(fname) for (fname, _) in wanted)
+        compress = "gzip -1 -c"
+        if shutil.which("zstd"):
+            compress = 'if command -v zstd >/dev/null 2>&1; then zstd -q -c; else {}; fi'.format(compress)
+        cmd = "sha256sum -- {names} >&2; tar -cf - -- {names} 2>/dev/null | {compress}".format(names=names, compress=compress)
+        archive = os.path.join(local_dir, ".collect.{}.tmp".format(m.addr))
+        with open(archive, 'wb') as f:
+            (_, stderr) = m.stream(cmd, f)
+        if m.dry:
+            os.remove(archive)
+            return {fname for (fname, _) in wanted}
+
+        try:
+            sums = {}
+            for line in stderr.splitlines():
+                # <sha256>  <path>
+                if len(line) > 66 and line[64:66] == "  ":
+                    sums[os.path.normpath(line[66:])] = line[:64]
+            # tar drops the leading / of absolute paths
+            locals_by_member = {os.path.normpath(fname).lstrip("/"): (fname, local) for (fname, local) in wanted}
+            return self.unpack(archive, locals_by_member, sums)
+        finally:
+            os.remove(archive)
+
+    def unpack(self, archive, locals_by_member, sums):
+        with open(archive, 'rb') as f:
+            zstd = f.read(4) == ZSTD_MAGIC
+        proc = None
+        if zstd:
+            proc = subprocess.Popen(["zstd", "-q", "-d", "-c", archive], stdout=subprocess.PIPE)
+            tar = tarfile.open(fileobj=proc.stdout, mode='r|')
+        else:
+            tar = tarfile.open(archive, mode='r|gz')
+        got = set()
+        try:
+            for member in tar:
+                if not member.isfile() or member.name not in locals_by_member:
+                    continue
+                (fname, local) = locals_by_member[member.name]
+                expected = sums.get(os.path.normpath(fname))
+                if expected is None:
+                    continue
+                if self.extract(tar.extractfile(member), local, expected):
+                    got.add(fname)
+                else:
+                    warn("{} does not match its checksum, fetching it again".format(fname), exit=False)
+        finally:
+            tar.close()
+            if proc is not None:
+                proc.stdout.close()
+                proc.wait()
+        return got
+
+    # write src to local (gzipped if it is kept compressed), returns whether its sha256 matches
+    def extract(self, src, local, expected):
+        compressed = os.path.basename(local) in KEEP_COMPRESSED
+        dest = local + COMPRESSED_EXT if compressed else local
+        h = hashlib.sha256()
+        with (gzip.open(dest + ".tmp", 'wb', compresslevel=KEEP_LEVEL) if compressed else open(dest + ".tmp", 'wb')) as out:
+            for data in iter(lambda: src.read(1 << 20), b''):
+                h.update(data)
+                out.write(data)
+        if h.hexdigest() != expected:
+            os.remove(dest + ".tmp")
+            return False
+        os.replace(dest + ".tmp", dest)
+        # an uncompressed copy from an earlier attempt would be read instead
+        other = local if compressed else local + COMPRESSED_EXT
+        if os.path.exists(other):
+            os.remove(other)
+        return True
+
+    def fetch(self, m, fname, local):
+        for attempt in range(self.retries):
+            try:
+                m.get(fname, local=local, sftp=self.session(m))
+                return True
+            except Exception as e:
+                if attempt + 1 == self.retries:
+                    warn("could not get file {}: {}".format(fname, e), exit=False)
+                    return False
+                # the session may be what broke, so start a fresh one for the retry
+                self.drop_session(m)
+                time.sleep(self.backoff * (2 ** attempt))
+
+    # a dedicated sftp session per connection, only used from the collector thread
+    def session(self, m):
+        if not self.background or m.dry:
+            return None
+        if m not in self.sftp:
+            self.sftp[m] = m.open_sftp()
+        return self.sftp[m]
+
+    def drop_session(self, m):
+        sftp = self.sftp.pop(m, None)
+        if sftp is not None:
+            try:
+                sftp.close()
+            except Exception:
+                pass
@@ -0,0 +1,215 @@
+import json
+import os
+import shutil
+import numpy as np
+
+"""
+Typed, columnar copies of the parsed tables (ccp.parsed, mm-graph.tmp, fcts.data).
+
+A table is stored as a directory next to the text file (e.g. ccp.parsed.cols/) with one .npy
+file per column and a schema.json describing them, so that a single column can be
+memory-mapped without tokenizing the whole text file:
+
+    cols, categories = read_columnar("experiments/fig7/ccp.parsed.cols")
+    rin = cols['rin']                                   # float64, memory-mapped
+    algs = categories['alg'][cols['alg']]               # decode a categorical
+
+Numeric columns are float64 (missing values are NaN). The experiment dimensions and any column
+with a value anywhere in the table that is not numeric are dictionary-encoded: an int32 code per
+row, and the distinct values in schema.json.
+"""
+
+DIMENSIONS = {'sch', 'alg', 'rate', 'rtt', 'bw', 'bundle', 'cross', 'seed', 'traffic', 'during', 'Category'}
+NA_VALUES = {'', 'none', 'NA', 'None'}
+CHUNK_ROWS = 1 << 16
+
+def columnar_path(path):
+    return path + ".cols"
+
+# like R's read.csv: repeated column names (e.g. rtt in ccp.parsed) get a .1, .2, ... suffix
+def unique_names(names):
+    seen = {}
+    out = []
+    for name in names:
+        if name in seen:
+            seen[name] += 1
+            out.append("{}.{}".format(name, seen[name]))
+        else:
+            seen[name] = 0
+            out.append(name)
+    return out
+
+def to_float(v):
+    if v in NA_VALUES:
+        return np.nan
+    try:
+        return float(v)
+    except ValueError:
+        return None
+
+# raised when columns written as numeric turn out to have non-numeric values further down
+class NotNumeric(Exception):
+    def __init__(self, names):
+        super().__init__(", ".join(sorted(names)))
+        self.names = names
+
+class ColumnWriter:
+    def __init__(self, path, categorical):
+        self.path = path
+        self.categorical = categorical
+        self.categories = {}
+        self.rows = 0
+        self.data = open(path + ".bin", 'wb')
+
+    def append(self, values):
+        if self.categorical:
+            codes = np.fromiter((self.categories.setdefault(v, len(self.categories)) for v in values), dtype=np.int32, count=len(values))
+            self.data.write(codes.tobytes())
+        else:
+            self.data.write(np.array(values, dtype=np.float64).tobytes())
+        self.rows += len(values)
+
+    # the float values of a numeric column's values, or None if one of them is not numeric
+    def numeric(self, values):
+        floats = [to_float(v) for v in values]
+        return None if any(f is None for f in floats) else floats
+
+    # turn the raw data into a .npy file, now that the number of rows is known
+    def close(self):
+        self.data.close()
+        dtype = np.dtype(np.int32 if self.categorical else np.float64)
+        with open(self.path, 'wb') as out, open(self.path + ".bin", 'rb') as raw:
+            np.lib.format.write_array_header_1_0(out, {
+                'descr': np.lib.format.dtype_to_descr(dtype),
+                'fortran_order': False,
+                'shape': (self.rows,),
+            })
+            shutil.copyfileobj(raw, out, 1 << 20)
+        os.remove(self.path + ".bin")
+
+    def schema(self, name):
+        col = {'name': name, 'file': os.path.basename(self.path)}
+        if self.categorical:
+            col['type'] = 'category'
+            col['categories'] = list(self.categories)
+        else:
+            col['type'] = 'float64'
+        return col
+
+"""
+Write the columnar copy of the text table at path (with a header line, fields separated by sep)
+to columnar_path(path). The table is streamed in chunks, so it can be larger than memory. A
+column starts out numeric if all of its values in the first chunk are; if a later chunk has a
+value that is not, the table is written again with that column categorical, so no value is lost.
+"""
+def write_columnar(path, sep=",", categorical=DIMENSIONS):
+    out_dir = columnar_path(path)
+    tmp_dir = out_dir + ".tmp"
+    categorical = set(categorical)
+    while True:
+        try:
+            (names, writers) = write_columns(path, sep, tmp_dir, categorical)
+            break
+        except NotNumeric as e:
+            categorical |= e.names
+    if writers is None:
+        shutil.rmtree(tmp_dir)
+        return None
+
+    for w in writers:
+        w.close()
+    st = os.stat(path)
+    schema = {
+        'source': os.path.basename(path),
+        'source_size': st.st_size,
+        'source_mtime': st.st_mtime,
+        'rows': writers[0].rows if writers else 0,
+        'columns': [w.schema(name) for (name, w) in zip(names, writers)],
+    }
+    with open(os.path.join(tmp_dir, 'schema.json'), 'w') as f:
+        json.dump(schema, f, indent=1)
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return out_dir
+
+# stream the rows of path into ColumnWriters in tmp_dir: (column names, writers), or (None, None) if empty
+def write_columns(path, sep, tmp_dir, categorical):
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    writers = None
+    try:
+        with open(path) as f:
+            header = f.readline()
+            if not header:
+                return (None, None)
+            names = unique_names(header.rstrip("\n").split(sep))
+            chunk = []
+            for line in f:
+                fields = line.rstrip("\n").split(sep)
+                if len(fields) != len(names):
+                    continue
+                chunk.append(fields)
+                if len(chunk) >= CHUNK_ROWS:
+                    writers = write_chunk(tmp_dir, names, writers, chunk, categorical)
+                    chunk = []
+            writers = write_chunk(tmp_dir, names, writers, chunk, categorical)
+    except NotNumeric:
+        for w in writers or []:
+            w.data.close()
+        raise
+    return (names, writers)
+
+def write_chunk(out_dir, names, writers, chunk, categorical):
+    columns = list(zip(*chunk)) if chunk else [()] * len(names)
+    if writers is None:
+        writers = [
+            ColumnWriter(
+                os.path.join(out_dir, "{:03d}.npy".format(i)),
+                name in categorical or any(to_float(v) is None for v in values),
+            )
+            for (i, (name, values)) in enumerate(zip(names, columns))
+        ]
+    # check the whole chunk first, so that every column that needs it turns categorical at once
+    converted = [values if w.categorical else w.numeric(values) for (w, values) in zip(writers, columns)]
+    not_numeric = {name for (name, values) in zip(names, converted) if values is None}
+    if not_numeric:
+        raise NotNumeric(not_numeric)
+    for (w, values) in zip(writers, converted):
+        w.append(values)
+    return writers
+
+# the columnar copy of path is missing or older than path
+def columnar_stale(path):
+    schema = os.path.join(columnar_path(path), 'schema.json')
+    if not os.path.exists(schema):
+        return True
+    with open(schema) as f:
+        s = json.load(f)
+    st = os.stat(path)
+    return s['source_size'] != st.st_size or s['source_mtime'] != st.st_mtime
+
+# (re)write the columnar copy of a parsed table if it is missing or out of date
+def update_columnar(path, sep):
+    if os.path.isfile(path) and columnar_stale(path):
+        write_columnar(path, sep=sep)
+
+"""
+Read a table written by write_columnar. Returns ({name: array}, {name: categories}) where the
+arrays are memory-mapped (unless mmap=False) and categorical columns hold codes into a numpy
+array of their categories.
+"""
+def read_columnar(path, mmap=True):
+    if not path.endswith(".cols"):
+        path = columnar_path(path)
+    with open(os.path.join(path, 'schema.json')) as f:
+        schema = json.load(f)
+    cols = {}
+    categories = {}
+    for col in schema['columns']:
+        # an empty file can't be memory-mapped
+        mode = 'r' if mmap and schema['rows'] > 0 else None
+        cols[col['name']] = np.load(os.path.join(path, col['file']), mmap_mode=mode)
+        if col['type'] == 'category':
+            categories[col['name']] = np.array(col['categories'])
+    return cols, categories
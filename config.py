@@ -1,5 +1,6 @@
 from collections import namedtuple
 import agenda
+import copy
 import itertools
 import random
 import toml
@@ -29,9 +30,21 @@ def read_config(args):
     config['ccp_dir'] = os.path.join(bundler_root, 'ccp')
     return config
 
-def check_config(config):
-    agenda.task("Checking config file")
-    topology = config['topology']
+# one config per testbed, each with a single topology and its own per-iteration state
+def split_testbeds(config):
+    if type(config['topology']) != list:
+        config['testbed'] = None
+        return [config]
+
+    testbeds = []
+    for (i, topology) in enumerate(config['topology']):
+        tb_config = dict(config)
+        tb_config['topology'] = copy.deepcopy(topology)
+        tb_config['testbed'] = f"tb{i}"
+        testbeds.append(tb_config)
+    return testbeds
+
+def check_topology(topology, pool=False):
     if 'cloudlab' not in topology:
         nodes = ['sender', 'inbox', 'outbox', 'receiver']
         for node in nodes:
@@ -50,14 +63,25 @@ def check_config(config):
         for node in topology:
             if 'self' in topology[node] and topology[node]['self']:
                 num_self += 1
-        assert num_self > 0, "One node in topology section must be labeled with \"self = true\""
-        assert num_self == 1, "Only one node in topology section can be labeled self"
+        # in a testbed pool, at most one testbed can contain the machine running this script
+        assert pool or num_self > 0, "One node in topology section must be labeled with \"self = true\""
+        assert num_self <= 1, "Only one node in topology section can be labeled self"
     else:
         assert 'listen_port' in topology['inbox'], "topology.inbox must define listen_port"
         nodes = ['sender', 'outbox', 'receiver']
         for node in nodes:
             assert node not in topology, "Don't use key topology.{} with cloudlab; it will be auto-populated".format(node)
 
+def check_config(config):
+    agenda.task("Checking config file")
+    # a list of [[topology]] tables describes a pool of independent testbeds
+    if type(config['topology']) == list:
+        assert len(config['topology']) > 0, "must specify at least one [[topology]]"
+        for topology in config['topology']:
+            check_topology(topology, pool=True)
+    else:
+        check_topology(config['topology'])
+
     for k in config['sysctl']:
         v = config['sysctl'][k]
         assert type(v) == str, "key names with dots must be enclosed in quotes (sysctl)"
@@ -130,7 +154,8 @@ def flatten(exps, dim):
             n[dim] = a
             yield n
 
-def enumerate_experiments(config):
+# seed makes the (shuffled) order reproducible, e.g. when resuming a run from its journal
+def enumerate_experiments(config, seed=None):
     agenda.section("Starting experiments")
     exp_args = config['experiment']
     axes = list(exp_args.values())
@@ -143,7 +168,7 @@ def enumerate_experiments(config):
             (_exp.alg['name'] == 'nimbus' and _exp.sch == 'fifo') or\
             (_exp.alg['name'] == 'nobundler' and _exp.sch != 'fifo')
     #filtered_exps = [e for e in exps if not skip_condition(e)]
-    random.shuffle(exps)
+    random.Random(seed).shuffle(exps)
     return exps
     #random.shuffle(filtered_exps)
     #return filtered_exps
@@ -0,0 +1,148 @@
+import glob
+import os
+import re
+import numpy as np
+import toml
+
+from logfile import open_log
+
+"""
+Throughput and queueing delay over time from a mahimahi downlink.log, replacing mm-graph.
+
+The log has one event per line, after a few "# ..." header lines:
+
+    <ms> + <bytes>                          packet arrived at the link
+    <ms> # <bytes>                          delivery opportunity
+    <ms> - <bytes> <delay ms> [<port> ...]  packet left the link after <delay ms> in the queue
+    <ms> d <packets> [<bytes>]              packets dropped
+
+Departures are binned into buckets of one rtt, and aggregated both in total and per group of
+ports (e.g. the bundle and the cross traffic). Each line of the output is
+
+    t total delay <group>... drops
+
+with t the start of the bucket in seconds, throughputs in Mbps, the mean queueing delay in ms of
+the packets that departed in the bucket, and the number of packets dropped in it.
+"""
+
+departure_rgx = re.compile(rb"^(\d+) - (\d+) (\d+)(?: (\d+))?", re.M)
+drop_rgx = re.compile(rb"^(\d+) d (\d+)", re.M)
+base_rgx = re.compile(rb"^# base timestamp: (\d+)", re.M)
+
+CHUNK_BYTES = 64 << 20
+
+# what mm-graph was called with before the groups were derived from the config
+DEFAULT_GROUPS = [("bundle", 5000, 6000), ("cross", 8000, 9000)]
+
+# (lo, hi) port ranges used by a list of traffic configs
+def traffic_ports(traffic):
+    for t in traffic:
+        if t['source'] == 'poisson':
+            yield (int(t['start_port']), int(t['start_port']) + int(t['conns']) - 1)
+        elif 'port' in t:
+            yield (int(t['port']), int(t['port']))
+
+"""
+Port groups [(name, lo, hi)] from the experiment's config (the .toml in the experiment
+directory): the ports used by the bundle traffic and by the cross traffic of any experiment in
+the run. Bundle traffic defaults to everything the outbox captures (parameters.bg_port_start/end).
+"""
+def port_groups(experiment_root):
+    tomls = glob.glob(os.path.join(experiment_root, '*.toml'))
+    if len(tomls) != 1:
+        return DEFAULT_GROUPS
+    with open(tomls[0]) as f:
+        config = toml.load(f)
+
+    groups = []
+    for (name, key) in [("bundle", 'bundle_traffic'), ("cross", 'cross_traffic')]:
+        ports = [p for traffic in config['experiment'].get(key, []) for p in traffic_ports(traffic)]
+        if ports:
+            groups.append((name, min(lo for (lo, _) in ports), max(hi for (_, hi) in ports)))
+        elif name == "bundle":
+            groups.append((name, int(config['parameters']['bg_port_start']), int(config['parameters']['bg_port_end'])))
+        else:
+            groups.append((name, 0, -1))
+    return groups
+
+# sum weights into acc by bucket, growing acc as needed
+def accumulate(acc, idx, weights=None):
+    counts = np.bincount(idx, weights=weights)
+    if len(counts) > len(acc):
+        acc = np.concatenate([acc, np.zeros(len(counts) - len(acc))])
+    acc[:len(counts)] += counts
+    return acc
+
+def read_chunks(path):
+    with open_log(path, 'rb') as f:
+        rest = b''
+        while True:
+            data = f.read(CHUNK_BYTES)
+            if not data:
+                if rest:
+                    yield rest
+                return
+            data = rest + data
+            cut = data.rfind(b'\n') + 1
+            rest = data[cut:]
+            yield data[:cut]
+
+def analyze_downlink(path, bin_ms, groups):
+    t0 = None
+    total = np.zeros(0)
+    delay_sum = np.zeros(0)
+    packets = np.zeros(0)
+    drops = np.zeros(0)
+    per_group = [np.zeros(0) for _ in groups]
+
+    for chunk in read_chunks(path):
+        if t0 is None:
+            m = base_rgx.search(chunk)
+            if m:
+                t0 = int(m.group(1))
+
+        deps = departure_rgx.findall(chunk)
+        if deps:
+            ts = np.array([d[0] for d in deps], dtype=np.int64)
+            if t0 is None:
+                t0 = int(ts[0])
+            size = np.array([d[1] for d in deps], dtype=np.float64)
+            delay = np.array([d[2] for d in deps], dtype=np.float64)
+            port = np.array([d[3] or -1 for d in deps], dtype=np.int64)
+            idx = np.maximum((ts - t0) // bin_ms, 0)
+
+            total = accumulate(total, idx, size)
+            delay_sum = accumulate(delay_sum, idx, delay)
+            packets = accumulate(packets, idx)
+            for (i, (_, lo, hi)) in enumerate(groups):
+                sel = (port >= lo) & (port <= hi)
+                per_group[i] = accumulate(per_group[i], idx[sel], size[sel])
+
+        ds = drop_rgx.findall(chunk)
+        if ds:
+            ts = np.array([d[0] for d in ds], dtype=np.int64)
+            if t0 is None:
+                t0 = int(ts[0])
+            idx = np.maximum((ts - t0) // bin_ms, 0)
+            drops = accumulate(drops, idx, np.array([d[1] for d in ds], dtype=np.float64))
+
+    n = max([len(total), len(drops)] + [len(g) for g in per_group])
+    def pad(a):
+        return np.concatenate([a, np.zeros(n - len(a))])
+
+    to_mbps = 8 / (bin_ms / 1000) / 1e6
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_delay = np.where(pad(packets) > 0, pad(delay_sum) / pad(packets), 0)
+    columns = [np.arange(n) * bin_ms / 1000, pad(total) * to_mbps, mean_delay]
+    columns += [pad(g) * to_mbps for g in per_group]
+    columns.append(pad(drops))
+    return columns
+
+# parse one iteration's downlink.log (run in a worker process), rtt in ms
+def parse_downlink_log(exp, out, rtt, groups):
+    print(exp)
+    columns = analyze_downlink(exp, max(int(rtt), 1), groups)
+    header = " ".join(["t", "total", "delay"] + [name for (name, _, _) in groups] + ["drops"])
+    tmp = out + ".tmp"
+    np.savetxt(tmp, np.column_stack(columns), fmt="%.6g", delimiter=" ", header=header, comments="")
+    os.replace(tmp, out)
@@ -8,11 +8,22 @@ import logging
 import io
 import subprocess
 import getpass
+import json
+import random
+import shutil
+import threading
 
 from cloudlab.cloudlab import make_cloudlab_topology
 from ccp import *
-from config import read_config, enumerate_experiments
+from config import read_config, split_testbeds, enumerate_experiments
 from parse_outputs import parse_outputs
+from pool import Testbed, run_on_pool
+from collect import ResultCollector
+from adaptive import adaptive_config, FctConvergenceMonitor
+from live import live_config, LiveMonitor
+from budget import CostModel, fit_budget, parse_duration, format_duration
+from planner import setup_key, order_experiments
+from journal import RunJournal, PLANNED, RUNNING, COLLECTED, PARSED, INCOMPLETE, ABORTED, DONE
 from traffic import *
 from topology import *
 from util import *
@@ -36,14 +47,32 @@ parser.add_argument('--headless', action='store_true', dest='headless',
 parser.add_argument('--overwrite-existing', action='store_true', dest='overwrite_existing',
         help="if supplied, if results already exist for a given experiment, the experiment will be re-run and results overwritten, be careful when supplying this!")
 parser.add_argument('--skip-existing', action='store_true', dest='skip_existing',
-        help="if supplied, if results already exist for a given experiment, that experiment will be skipped and results preserved, good for finishing an incomplete experiment")
+        help="if supplied, if results already exist for a given experiment, that experiment will be skipped and results preserved, good for finishing an incomplete experiment (experiments the run journal shows were interrupted are redone)")
 parser.add_argument('--tcpprobe', action='store_true', dest='tcpprobe',
         help="if supplied, run tcpprobe at the sender")
 parser.add_argument('--tcpdump', action='store_true', dest='tcpdump',
         help="if supplied, run tcpdump at the inbox and outbox")
+parser.add_argument('--agent', action='store_true', dest='agent',
+        help="if supplied, start a control agent on each node and send commands through it instead of starting a new remote shell for each one")
+parser.add_argument('--order', choices=['grouped', 'random'], default=None,
+        help="order to run experiments in: grouped runs experiments with the same inbox scheduler and ccp algorithm back to back (in a random but reproducible order), random shuffles everything (default: grouped with --reuse-setup, random otherwise)")
+parser.add_argument('--reuse-setup', action='store_true', dest='reuse_setup',
+        help="keep the inbox and ccp running between consecutive experiments that use the same scheduler and algorithm instead of restarting them (best with --order grouped)")
+parser.add_argument('--max-attempts', type=int, default=3, dest='max_attempts',
+        help="how many times to run an experiment whose results keep coming back incomplete before giving up on it (default 3)")
+parser.add_argument('--redo-aborted', action='store_true', dest='redo_aborted',
+        help="run the experiments that the live monitor stopped early again (by default they are skipped, see the run journal for why they were stopped)")
+parser.add_argument('--budget', type=parse_duration, default=None,
+        help="wall-clock time the run must finish in (e.g. 16h, 90m, 1h30m); if the predicted runtime is longer, only the experiments for as many seeds as fit are run")
+parser.add_argument('--live', action='store_true', dest='live',
+        help="follow the inbox, ccp and mahimahi logs while experiments run, writing rolling metrics to live.lp and stopping experiments that get stuck (see live.py; a [live] section in the config does the same)")
+parser.add_argument('--bulk', action='store_true', dest='bulk',
+        help="collect each machine's outputs of an iteration as one compressed archive (checked against sha256 sums) instead of file by file, keeping ccp.log and downlink.log gzipped (see collect.py)")
 parser.add_argument('--rows', type=str, help="rows to split graph upon", default='')
 parser.add_argument('--cols', type=str, help="cols to split graph upon", default='')
 parser.add_argument('--downsample', type=int, default=1, help="how much to downsample measurements")
+parser.add_argument('--report', choices=['html', 'rmd'], default='html',
+        help="write the report as static html (default), or as R Markdown rendered with R")
 parser.add_argument('--name', type=str, help="name of experiment directory", required=True)
 parser.add_argument('--details', type=str, help="extra information to include in experiment report", default="")
 ###################################################################################################
@@ -68,8 +97,8 @@ def check_receiver(config, receiver):
     if not receiver.prog_exists("mm-delay"):
         fatal_warn("Receiver does not have mahimahi installed.")
 
-def prepare_directories(config, conns):
-    agenda.task("Preparing result directories")
+def prepare_local_directories(config):
+    agenda.task("Preparing local result directory")
 
     local_experiment_dir = config['local_experiment_dir']
     if os.path.exists(local_experiment_dir):
@@ -87,42 +116,63 @@ def prepare_directories(config, conns):
 
     os.makedirs(local_experiment_dir, exist_ok=True)
 
+    # Keep a copy of the config in the experiment directory for future reference
+    subprocess.check_output(f"cp {config['args'].config} {local_experiment_dir}", shell=True)
+
+def prepare_directories(config, conns):
+    agenda.task("Preparing result directories")
+
     for (addr, conn) in conns.items():
         if config['args'].verbose:
             agenda.subtask(addr)
 
-        if config['args'].overwrite_existing:
-           expect(
-               conn.run("rm -rf {}".format(config['experiment_dir'])),
-               "Failed to remove existing experiment directory {}".format(config['experiment_dir'])
-           )
+        with conn.batch() as b:
+            if config['args'].overwrite_existing:
+                b.run("rm -rf {}".format(config['experiment_dir']),
+                    msg="Failed to remove existing experiment directory {}".format(config['experiment_dir']))
 
-        expect(
-            conn.run("mkdir -p {}".format(config['experiment_dir'])),
-            "Failed to create experiment directory {}".format(config['experiment_dir'])
-        )
-        expect(
-            conn.run("mkdir -p {}".format(config['ccp_dir'])),
-            "Failed to create experiment directory {}".format(config['experiment_dir'])
-        )
-
-    # Keep a copy of the config in the experiment directory for future reference
-    subprocess.check_output(f"cp {config['args'].config} {local_experiment_dir}", shell=True)
+            b.run("mkdir -p {}".format(config['experiment_dir']),
+                msg="Failed to create experiment directory {}".format(config['experiment_dir']))
+            b.run("mkdir -p {}".format(config['ccp_dir']),
+                msg="Failed to create experiment directory {}".format(config['experiment_dir']))
 
 iteration_dirs = set()
-def prepare_iteration_dir(config, conns):
-    if config['iteration_dir'] in iteration_dirs:
-        fatal_error("Iteration directory not reset! This must be a bug.")
-
-    iteration_dirs.add(config['iteration_dir'])
-    for (_addr, conn) in conns.items():
-        expect(
-            conn.run("mkdir -p {}".format(config['iteration_dir'])),
-            "Failed to create iteration directory {}".format(config['iteration_dir'])
-        )
+iteration_dirs_lock = threading.Lock()
+# clean: remove whatever a previous, interrupted attempt at this iteration left behind
+def prepare_iteration_dir(config, machines, clean=False):
+    with iteration_dirs_lock:
+        if config['iteration_dir'] in iteration_dirs:
+            fatal_error("Iteration directory not reset! This must be a bug.")
+        iteration_dirs.add(config['iteration_dir'])
+
+    def mkdir(_role, conn):
+        with conn.batch() as b:
+            if clean:
+                b.run("rm -rf {}".format(config['iteration_dir']),
+                    msg="Failed to remove iteration directory {}".format(config['iteration_dir']))
+            b.run("mkdir -p {}".format(config['iteration_dir']),
+                msg="Failed to create iteration directory {}".format(config['iteration_dir']))
+
+    for_each_host(machines, mkdir)
+
+    if clean:
+        shutil.rmtree(config['local_iteration_dir'], ignore_errors=True)
 
     subprocess.call(f"mkdir -p {config['local_iteration_dir']}", shell=True)
 
+# iteration.json in the local iteration directory records how the iteration was run
+def write_iteration_metadata(config, **fields):
+    if config['args'].dry_run:
+        return
+    path = os.path.join(config['local_iteration_dir'], 'iteration.json')
+    meta = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            meta = json.load(f)
+    meta.update(fields)
+    with open(path, 'w') as f:
+        json.dump(meta, f, indent=2)
+
 def start_interacting(machines):
     warn("Starting interactive mode", exit=False)
     for _name, m in machines.items():
@@ -134,12 +184,388 @@ def stop_interacting(machines):
         m.interact = False
         m.verbose = False
 
+###################################################################################################
+# Testbeds
+###################################################################################################
+
+def connect_testbed(config):
+    if 'cloudlab' in config['topology']:
+        config = make_cloudlab_topology(config, headless=config['args'].headless)
+
+    topo = MahimahiTopo(config)
+
+    topo.setup_routing(config)
+    disable_tcp_offloads(config, topo.machines)
+    update_sysctl(topo.machines, config)
+    return Testbed(config, topo)
+
+def prepare_testbed(testbed):
+    config = testbed.config
+    prepare_directories(config, testbed.conns)
+    agenda.task("Fetch build logs")
+    testbed.topo.fetch_build_logs(config)
+
+    agenda.section("Synchronizing code versions")
+    if not config['args'].skip_git:
+        check_inbox(config, testbed.machines['inbox'])
+        check_receiver(config, testbed.machines['receiver'])
+
+def get_iteration_name(exp, bundle_traffic, cross_traffic):
+    name = exp.alg['name']
+    exp_alg_iteration_name = name + "." + ".".join("{}={}".format(k,v) for k,v in exp.alg.items() if k != 'name')
+
+    return "{sch}_{rate}_{rtt}/{alg}/b={bundle}_c={cross}/{seed}".format(
+        sch=exp.sch,
+        alg=exp_alg_iteration_name,
+        rate=exp.rate,
+        rtt=exp.rtt,
+        seed=exp.seed,
+        bundle="+".join(str(b) for b in bundle_traffic),
+        cross="+".join(str(c) for c in cross_traffic)
+    )
+
+###################################################################################################
+# Shared setup (--reuse-setup)
+###################################################################################################
+
+"""
+An inbox and ccp kept running across consecutive experiments with the same setup key. When
+only the algorithm changes, ccp is restarted (with a fresh log) and the inbox is kept.
+
+They log into a shared directory; logs[i] was ready_offsets[i] bytes long once startup finished.
+Each iteration gets its own copy of every log: the startup part followed by what was written
+while the iteration ran, so the logs look as if the inbox and ccp had been started just for it.
+"""
+SharedSetup = namedtuple('SharedSetup', ['key', 'alg', 'logs', 'ready_offsets'])
+
+def log_sizes(conn, paths):
+    with conn.batch() as b:
+        res = [b.run("stat -c %s {}".format(p)) for p in paths]
+    return [int(r.stdout.strip()) if r.stdout.strip().isdigit() else 0 for r in res]
+
+def start_shared_setup(testbed, exp):
+    config = testbed.config
+    inbox = testbed.machines['inbox']
+    setup_dir = os.path.join(config['experiment_dir'], 'shared-setup')
+    expect(
+        inbox.run("rm -rf {d} && mkdir -p {d}".format(d=setup_dir)),
+        "Failed to create shared setup directory {}".format(setup_dir)
+    )
+    inbox_out = testbed.topo.start_inbox(exp.sch, config['parameters']['qdisc_buf_size'], out_dir=setup_dir)
+    ccp_out = start_ccp(config, inbox, exp.alg, out_dir=setup_dir)
+    inbox.check_file('Inbox ready', inbox_out, timeout=10)
+    agenda.subtask("Inbox ready")
+    logs = [inbox_out, ccp_out]
+    return SharedSetup(setup_key(exp), exp.alg['name'], logs, log_sizes(inbox, logs))
+
+def stop_shared_setup(testbed):
+    config = testbed.config
+    agenda.subtask("Stopping shared inbox and ccp")
+    kill_leftover_procs(config, testbed.machines)
+    testbed.machines['inbox'].run(
+            "tc qdisc del dev {iface} root".format(
+                iface=get_iface(config, 'inbox')['dev']
+            ), sudo=True
+    )
+    testbed.setup = None
+
+# switch the shared setup to exp's algorithm, keeping the inbox (which has the same scheduler)
+def restart_shared_ccp(testbed, exp):
+    config = testbed.config
+    inbox = testbed.machines['inbox']
+    setup = testbed.setup
+    agenda.subtask("Reusing inbox, restarting ccp")
+    inbox.kill(setup.alg, sudo=True)
+    if not inbox.wait_for_exit(setup.alg, timeout=5):
+        fatal_warn("Failed to stop {} on {}.".format(setup.alg, inbox.addr))
+    ccp_out = start_ccp(config, inbox, exp.alg, out_dir=os.path.dirname(setup.logs[1]))
+    testbed.setup = setup._replace(
+        key=setup_key(exp),
+        alg=exp.alg['name'],
+        ready_offsets=[setup.ready_offsets[0]] + log_sizes(inbox, [ccp_out]),
+    )
+
+# processes that must survive between experiments on this testbed
+def shared_procs(testbed):
+    return ("inbox", testbed.setup.alg) if testbed.setup else ()
+
+def slice_shared_logs(testbed, offsets):
+    config = testbed.config
+    inbox = testbed.machines['inbox']
+    setup = testbed.setup
+    with inbox.batch() as b:
+        for (log, ready, offset) in zip(setup.logs, setup.ready_offsets, offsets):
+            out = os.path.join(config['iteration_dir'], os.path.basename(log))
+            b.run(
+                "{{ head -c {ready} {log}; tail -c +{start} {log}; }} > {out}".format(
+                    ready=ready,
+                    start=offset+1,
+                    log=log,
+                    out=out,
+                ),
+                msg="Failed to copy {} for this iteration".format(os.path.basename(log))
+            )
+            config['iteration_outputs'].append((inbox, out))
+
+###################################################################################################
+# Plan
+###################################################################################################
+
+Iteration = namedtuple('Iteration', ['index', 'exp', 'name', 'redo'])
+
+"""
+Decide which experiments still need to run, without touching any testbed.
+
+The shuffle seed comes from the run journal if there is one, so a restarted run sees the same
+order. Iterations the journal records as collected (or parsed) are skipped; ones it records as
+running were interrupted (possibly halfway through collection) and are redone from scratch, as
+are incomplete ones, until they have been run --max-attempts times. Ones the live monitor
+aborted are only redone with --redo-aborted.
+With --budget, only as many experiments as are predicted to finish in time are kept.
+"""
+def plan_iterations(config, journal, num_testbeds=1):
+    seed = journal.plan['seed'] if journal.plan else random.randrange(2**32)
+    exps = order_experiments(enumerate_experiments(config, seed=seed), seed, config['args'].order)
+
+    names = []
+    for exp in exps:
+        bundle_traffic = list(create_traffic_config(exp.bundle_traffic, exp))
+        cross_traffic = list(create_traffic_config(exp.cross_traffic, exp))
+        names.append(get_iteration_name(exp, bundle_traffic, cross_traffic))
+
+    if journal.plan is None or journal.plan['order'] != names:
+        if journal.plan is not None:
+            warn("Experiment list differs from the one in the run journal, recording a new plan", exit=False)
+        journal.record_plan(seed, names)
+
+    todo = []
+    gave_up = []
+    aborted = []
+    finished = 0
+    nobundler = 0
+    for (i, (exp, name)) in enumerate(zip(exps, names)):
+        if exp.alg['name'] == "nobundler" and not exp.sch in ["fifo", "sfq"]:
+            nobundler += 1
+            continue
+
+        state = journal.state(name)
+        local_iteration_dir = os.path.join(config['local_experiment_dir'], name)
+        if state in DONE:
+            if not config['args'].overwrite_existing:
+                finished += 1
+                continue
+        elif state == RUNNING:
+            agenda.subtask("redoing interrupted experiment {}".format(name))
+            todo.append(Iteration(i, exp, name, True))
+            continue
+        elif state == INCOMPLETE:
+            attempts = journal.attempts(name)
+            if attempts >= config['args'].max_attempts:
+                gave_up.append(name)
+                continue
+            agenda.subtask("redoing incomplete experiment {} (attempt {} of {})".format(name, attempts + 1, config['args'].max_attempts))
+            todo.append(Iteration(i, exp, name, True))
+            continue
+        elif state == ABORTED:
+            if not config['args'].redo_aborted:
+                aborted.append(name)
+                continue
+            agenda.subtask("redoing aborted experiment {}".format(name))
+            todo.append(Iteration(i, exp, name, True))
+            continue
+        elif os.path.exists(local_iteration_dir):
+            # results from before there was a journal
+            if config['args'].skip_existing:
+                finished += 1
+                continue
+            elif not config['args'].overwrite_existing:
+                fatal_warn("Found existing results for this experiment, but unsure how to handle it. Please provide --skip-existing or --overwite-existing")
+
+        todo.append(Iteration(i, exp, name, False))
+
+    if gave_up:
+        warn("Giving up on {} experiment(s) whose results were still incomplete after {} attempts (missing files are listed in the run journal): {}".format(
+            len(gave_up), config['args'].max_attempts, ", ".join(gave_up)), exit=False)
+    if aborted:
+        warn("Skipping {} experiment(s) stopped early by the live monitor, pass --redo-aborted to run them again: {}".format(
+            len(aborted), ", ".join(aborted)), exit=False)
+    if finished:
+        agenda.subtask("skipping {} finished experiment(s)".format(finished))
+    if nobundler:
+        agenda.subtask("skipping {} nobundler experiment(s) with a scheduler other than fifo or sfq".format(nobundler))
+
+    model = CostModel(config, journal)
+    costs = [model.cost(it.exp) for it in todo]
+    predicted = sum(costs) / num_testbeds
+    agenda.subtask("{} experiment(s), predicted runtime {} on {} testbed(s)".format(
+        len(todo), format_duration(predicted), num_testbeds))
+
+    budget = config['args'].budget
+    if budget is not None and predicted > budget:
+        chosen = fit_budget([it.exp for it in todo], costs, budget, num_testbeds, config['experiment']['seed'])
+        warn("Predicted runtime exceeds the budget of {}, only running {} of {} experiment(s) (predicted runtime {})".format(
+            format_duration(budget),
+            len(chosen),
+            len(todo),
+            format_duration(sum(costs[j] for j in chosen) / num_testbeds),
+        ), exit=False)
+        todo = [todo[j] for j in chosen]
+
+    for it in todo:
+        if not it.redo:
+            journal.set_state(it.name, PLANNED, estimate=model.estimate(it.exp))
+
+    return todo, len(exps)
+
+###################################################################################################
+# Run one experiment
+###################################################################################################
+
+# returns the number of seconds the experiment ran for (0 if it was skipped)
+def run_iteration(testbed, iteration, total_exps, journal):
+    config = testbed.config
+    topo = testbed.topo
+    machines = testbed.machines
+    exp = iteration.exp
+    reuse = config['args'].reuse_setup and exp.alg['name'] != "nobundler"
+
+    max_digits = len(str(total_exps))
+    progress = "{}/{}".format(str(iteration.index+1).zfill(max_digits), total_exps)
+    if testbed.name:
+        progress = "[{}] {}".format(testbed.name, progress)
+    agenda.task("{} | {}".format(progress, exp))
+
+    # a different scheduler needs a new inbox; a different algorithm only a new ccp (see below)
+    if testbed.setup is not None and (not reuse or testbed.setup.key[0] != setup_key(exp)[0]):
+        stop_shared_setup(testbed)
+    else:
+        kill_leftover_procs(config, machines, keep=shared_procs(testbed))
+
+    #TODO get exact system time that each program starts
+
+    bundle_traffic = list(create_traffic_config(exp.bundle_traffic, exp))
+    cross_traffic = list(create_traffic_config(exp.cross_traffic, exp))
+
+    config['iteration_dir'] = os.path.join(config['experiment_dir'], iteration.name)
+    config['local_iteration_dir'] = os.path.join(config['local_experiment_dir'], iteration.name)
+    if os.path.exists(config['local_iteration_dir']) and not iteration.redo:
+        agenda.subtask("overwriting experiment")
+
+    config['iteration_outputs'] = []
+
+    prepare_iteration_dir(config, machines, clean=iteration.redo)
+    journal.set_state(iteration.name, RUNNING, testbed=testbed.name, attempts=journal.attempts(iteration.name) + 1, missing=[])
+
+    ##### RUN EXPERIMENT
+
+    start = time.time()
+
+    # starting inbox is topology-independent
+    # (name, node, path, offset) of the logs to follow with --live
+    live_logs = [('downlink', machines['receiver'], os.path.join(config['iteration_dir'], 'downlink.log'), 0)]
+    if reuse:
+        if testbed.setup is None:
+            testbed.setup = start_shared_setup(testbed, exp)
+        elif testbed.setup.key != setup_key(exp):
+            restart_shared_ccp(testbed, exp)
+        else:
+            agenda.subtask("Reusing inbox and ccp")
+        log_offsets = log_sizes(machines['inbox'], testbed.setup.logs)
+        live_logs += [(name, machines['inbox'], log, offset) for (name, log, offset) in zip(['inbox', 'ccp'], testbed.setup.logs, log_offsets)]
+    elif exp.alg['name'] != "nobundler":
+        inbox_out = topo.start_inbox(exp.sch, config['parameters']['qdisc_buf_size'])
+        ccp_out = start_ccp(config, machines['inbox'], exp.alg)
+        machines['inbox'].check_file('Inbox ready', inbox_out, timeout=10)
+        agenda.subtask("Inbox ready")
+        live_logs += [('inbox', machines['inbox'], inbox_out, 0), ('ccp', machines['inbox'], ccp_out, 0)]
+    else:
+        machines['inbox'].run(
+                "tc qdisc del dev {iface} root".format(
+                    iface=get_iface(config, 'inbox')['dev']
+                ), sudo=True
+        )
+        machines['inbox'].run(
+                "tc qdisc add dev {iface} root bfifo limit 15mbit".format(
+                    iface=get_iface(config, 'inbox')['dev']
+                ), sudo=True
+        )
+
+    if config['args'].tcpprobe:
+        #TODO figure out how to check for and kill dd, it's a substring in other process names
+        tcpprobe_out = start_tcpprobe(config, machines['sender'])
+
+    if config['args'].tcpdump:
+        config = start_tcpdump(config, machines)
+
+    monitor = None
+    adaptive = adaptive_config(config)
+    if adaptive and any(isinstance(t, PoissonTraffic) for t in bundle_traffic + cross_traffic):
+        monitor = FctConvergenceMonitor(config, machines['receiver'], exp, adaptive)
+        monitor.start()
+    live = None
+    live_cfg = live_config(config)
+    if live_cfg and not config['args'].dry_run:
+        live = LiveMonitor(config, iteration.name, machines['receiver'], live_logs, live_cfg)
+        live.start()
+
+    try:
+        c = topo.run_traffic(config, exp, bundle_traffic, cross_traffic)
+    finally:
+        stopped = monitor.finish() if monitor else None
+        aborted = live.finish() if live else None
+    if c is None:
+        return 0
+    else:
+        config = c
+
+    elapsed = time.time() - start
+    agenda.subtask("Ran for {} seconds".format(elapsed))
+    write_iteration_metadata(config,
+        name=iteration.name,
+        testbed=testbed.name,
+        elapsed=elapsed,
+        bundle_traffic=[dict(t.traffic._asdict(), name=str(t)) for t in bundle_traffic],
+        cross_traffic=[dict(t.traffic._asdict(), name=str(t)) for t in cross_traffic],
+        adaptive=stopped,
+        aborted=aborted,
+    )
+    kill_leftover_procs(config, machines, keep=shared_procs(testbed))
+    if testbed.setup is not None:
+        slice_shared_logs(testbed, log_offsets)
+    else:
+        agenda.subtask("Remove qdisc")
+        machines['inbox'].run(
+                "tc qdisc del dev {iface} root".format(
+                    iface=get_iface(config,'inbox')['dev']
+                ), sudo=True
+        )
+
+    # downloads while the next experiment on this testbed runs
+    agenda.subtask("collecting results")
+    def collected(failed):
+        if aborted:
+            # kept for a look at what went wrong; only redone with --redo-aborted
+            agenda.subfailure("{} was stopped early: {}".format(iteration.name, aborted['reason']))
+            journal.set_state(iteration.name, ABORTED, reason=aborted['reason'], missing=failed)
+        elif failed:
+            # redone by a restart, up to --max-attempts times
+            agenda.subfailure("incomplete results for {}".format(iteration.name))
+            journal.set_state(iteration.name, INCOMPLETE, missing=failed)
+        else:
+            journal.set_state(iteration.name, COLLECTED, elapsed=elapsed)
+    testbed.collector.submit(config['iteration_outputs'], config['local_iteration_dir'], on_done=collected)
+
+    return elapsed
+
 ###################################################################################################
 # Setup
 ###################################################################################################
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    if args.order is None:
+        # grouping only saves anything when the setup is reused
+        args.order = 'grouped' if args.reuse_setup else 'random'
 
     if args.interact:
         warn("Running in interactive mode. Each command is printed before it's run.\nPress any key to continue executing the command or control-c to stop.", exit=False)
@@ -150,24 +576,20 @@ if __name__ == "__main__":
     if config['args'].verbose and config['args'].verbose >= 2:
         logging.basicConfig(level=logging.DEBUG)
 
-    if 'cloudlab' in config['topology']:
-        config = make_cloudlab_topology(config, headless=args.headless)
-
-    topo = MahimahiTopo(config)
-
-    topo.setup_routing(config)
-    machines = topo.machines
-    conns = topo.conns
+    testbed_configs = split_testbeds(config)
+    if len(testbed_configs) > 1 and args.interact:
+        fatal_warn("--interact cannot be used with more than one testbed")
 
-    disable_tcp_offloads(config, machines)
-    update_sysctl(machines, config)
+    testbeds = []
+    for tb_config in testbed_configs:
+        if tb_config['testbed']:
+            agenda.section("Connect to testbed {}".format(tb_config['testbed']))
+        testbeds.append(connect_testbed(tb_config))
 
     agenda.section("Setup")
-    prepare_directories(config, conns)
+    prepare_local_directories(config)
     details_md = os.path.join(config['local_experiment_dir'], 'details.md')
     results_md = os.path.join(config['local_experiment_dir'], 'results.md')
-    agenda.task("Fetch build logs")
-    topo.fetch_build_logs(config)
 
     if not os.path.exists(details_md):
         with open(details_md, 'w') as f:
@@ -176,13 +598,17 @@ if __name__ == "__main__":
         with open(results_md, 'w') as f:
             f.write("TODO\n")
 
-    agenda.section("Synchronizing code versions")
-    if not args.skip_git:
-        check_inbox(config, machines['inbox'])
-        check_receiver(config, machines['receiver'])
+    # decided before any testbed setup, so a resumed run with nothing left to do is cheap
+    journal = RunJournal(config['local_experiment_dir'], dry=args.dry_run)
+    if args.overwrite_existing:
+        journal.reset()
+    iterations, total_exps = plan_iterations(config, journal, num_testbeds=len(testbeds))
 
-    exps = enumerate_experiments(config)
-    total_exps = len(exps)
+    for testbed in testbeds:
+        if testbed.name:
+            agenda.section("Setup testbed {}".format(testbed.name))
+        prepare_testbed(testbed)
+        testbed.collector = ResultCollector(testbed.config, background=not args.interact, bulk=args.bulk)
 
     try:
         with open('curr_url','r') as f:
@@ -191,7 +617,7 @@ if __name__ == "__main__":
         warn("Unable to find current seashells url: {}".format(e), exit=False)
         sea_url = ""
 
-    zulip_notify("""**{me}** started a new experiment: `{name}` ({total_exps} configs)
+    zulip_notify("""**{me}** started a new experiment: `{name}` ({total_exps} configs, {num_testbeds} testbed(s))
 ```quote
 {details}
 ```
@@ -201,110 +627,27 @@ if __name__ == "__main__":
         name=config['experiment_name'],
         details=args.details,
         total_exps=total_exps,
+        num_testbeds=len(testbeds),
         sea_url=sea_url
     ), dry=args.dry_run)
 
     total_elapsed = 0
+    total_elapsed_lock = threading.Lock()
 
-    for i,exp in enumerate(exps):
-        if exp.alg['name'] == "nobundler" and not exp.sch in ["fifo", "sfq"]:
-            agenda.subtask("skipping...")
-            continue
-
-        max_digits = len(str(total_exps))
-        progress = "{}/{}".format(str(i+1).zfill(max_digits), total_exps)
-        agenda.task("{} | {}".format(progress, exp))
+    def run_pool_iteration(testbed, _i, iteration):
+        global total_elapsed
+        elapsed = run_iteration(testbed, iteration, total_exps, journal)
+        with total_elapsed_lock:
+            total_elapsed += elapsed
 
-        kill_leftover_procs(config, machines)
-
-        #TODO get exact system time that each program starts
-
-        bundle_traffic = list(create_traffic_config(exp.bundle_traffic, exp))
-        cross_traffic = list(create_traffic_config(exp.cross_traffic, exp))
-
-        name = exp.alg['name']
-        exp_alg_iteration_name = name + "." + ".".join("{}={}".format(k,v) for k,v in exp.alg.items() if k != 'name')
-
-        iteration_name = "{sch}_{rate}_{rtt}/{alg}/b={bundle}_c={cross}/{seed}".format(
-            sch=exp.sch,
-            alg=exp_alg_iteration_name,
-            rate=exp.rate,
-            rtt=exp.rtt,
-            seed=exp.seed,
-            bundle="+".join(str(b) for b in bundle_traffic),
-            cross="+".join(str(c) for c in cross_traffic)
-        )
-
-        config['iteration_dir'] = os.path.join(config['experiment_dir'], iteration_name)
-        config['local_iteration_dir'] = os.path.join(config['local_experiment_dir'], iteration_name)
-        if os.path.exists(config['local_iteration_dir']):
-            if config['args'].skip_existing:
-                agenda.subtask("skipping experiment")
-                continue
-            elif config['args'].overwrite_existing:
-                agenda.subtask("overwriting experiment")
-            else:
-                fatal_warn("Found existing results for this experiment, but unsure how to handle it. Please provide --skip-existing or --overwite-existing")
-
-        config['iteration_outputs'] = []
-
-        prepare_iteration_dir(config, conns)
-
-        ##### RUN EXPERIMENT
-
-        start = time.time()
-
-        # starting inbox is topology-independent
-        if exp.alg['name'] != "nobundler":
-            inbox_out = topo.start_inbox(exp.sch, config['parameters']['qdisc_buf_size'])
-            ccp_out = start_ccp(config, machines['inbox'], exp.alg)
-            machines['inbox'].check_file('Inbox ready', inbox_out)
-            agenda.subtask("Inbox ready")
-        else:
-            machines['inbox'].run(
-                    "tc qdisc del dev {iface} root".format(
-                        iface=get_iface(config, 'inbox')['dev']
-                    ), sudo=True
-            )
-            machines['inbox'].run(
-                    "tc qdisc add dev {iface} root bfifo limit 15mbit".format(
-                        iface=get_iface(config, 'inbox')['dev']
-                    ), sudo=True
-            )
-
-        if config['args'].tcpprobe:
-            #TODO figure out how to check for and kill dd, it's a substring in other process names
-            tcpprobe_out = start_tcpprobe(config, machines['sender'])
-
-        if config['args'].tcpdump:
-            config = start_tcpdump(config, machines)
-
-        c = topo.run_traffic(config, exp, bundle_traffic, cross_traffic)
-        if c is None:
-            continue
-        else:
-            config = c
-
-        elapsed = time.time() - start
-        total_elapsed += elapsed
-        agenda.subtask("Ran for {} seconds".format(elapsed))
-        kill_leftover_procs(config, machines)
-        agenda.subtask("Remove qdisc")
-        machines['inbox'].run(
-                "tc qdisc del dev {iface} root".format(
-                    iface=get_iface(config,'inbox')['dev']
-                ), sudo=True
-        )
-
-        agenda.subtask("collecting results")
-        for (m, fname) in config['iteration_outputs']:
-            if 'self' not in config or m != config['self']:
-                try:
-                    if fname.startswith("~/"):
-                        fname = fname[2:]
-                    m.get(fname, local=os.path.join(config['local_iteration_dir'], os.path.basename(fname)))
-                except Exception as e:
-                    warn("could not get file {}: {}".format(fname, e), exit=False)
+    try:
+        run_on_pool(testbeds, iterations, run_pool_iteration, affinity=lambda it: setup_key(it.exp))
+    finally:
+        agenda.task("Waiting for result collection to finish")
+        for testbed in testbeds:
+            testbed.collector.close()
+            if testbed.setup is not None:
+                stop_shared_setup(testbed)
 
     zulip_notify("{total_exps} experiment(s) finished in **{elapsed}** seconds.".format(
         total_exps=total_exps,
@@ -319,4 +662,7 @@ if __name__ == "__main__":
         if config['args'].cols:
             parse_args['cols'] = config['args'].cols
         config['structure']['bundler_root'] = '.'
-        parse_outputs(config, parse_args)
+        parse_outputs(config, graph_kwargs=parse_args, report=config['args'].report)
+        for rec in journal.finished():
+            if rec['state'] != PARSED:
+                journal.set_state(rec['iteration'], PARSED)
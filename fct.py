@@ -0,0 +1,181 @@
+import json
+import os
+import re
+import numpy as np
+
+from columnar import read_columnar
+
+"""
+Flow completion times from etg request logs (the *_reqs.out files), parsed in-process.
+
+Each line of a reqs file is a request, as "key:value," tokens:
+
+    Size:3174, Duration(usec):10207, StartTime(ms):1010, ...
+
+read_reqs turns a file into one typed array per key. Every request is then labeled with when it
+ran relative to the first one (start and finish, in ms), which cross traffic was active for all
+of it (during), a size category (Category, as categorize.py) and its normalized FCT (NormFct):
+the FCT divided by the best possible one, size / rate + rtt, at the iteration's rate and rtt.
+
+summarize_fcts then reduces fcts.data to a few hundred lines per scheme (sch and alg), size
+category and cross traffic window: percentiles of NormFct (fcts.summary) and a histogram over
+fixed log-spaced buckets (fcts.hist), from which the report draws CDFs.
+"""
+
+field_rgx = re.compile(r"([^\s:]+):([^\s,:]*)\S*")
+
+# the fixed cross traffic schedule parse_outputs used before iterations recorded their traffic
+LEGACY_WINDOWS = [(0, 60000, "empty1"), (60000, 120000, "iperfc1"), (120000, 150000, "empty2"), (150000, 210000, "cbr32"), (210000, 250000, "empty3")]
+
+DEFAULT_SIZE_BUCKETS = [10000, 100000, 1000000]
+
+PERCENTILES = [50, 90, 95, 99, 99.9]
+# 20 buckets per decade from 0.1 to 10^4, plus one below and one above
+HIST_EDGES = np.concatenate([[0], np.logspace(-1, 4, 101), [np.inf]])
+SUMMARY_KEYS = ['sch', 'alg', 'Category', 'during']
+
+# rate in Mbps, rtt in ms
+def normalized_fct(size, duration_usec, rate, rtt):
+    ideal = size / (float(rate) * 1e6 / 8) + float(rtt) / 1000
+    return (duration_usec / 1e6) / ideal
+
+def to_array(values):
+    for dtype in (np.int64, np.float64):
+        try:
+            return np.array(values, dtype=dtype)
+        except ValueError:
+            pass
+    return np.array(values, dtype=object)
+
+"""
+Parse a reqs file into (names, {name: array}), with the keys in the order of the first line.
+Lines with different keys are skipped; returns their number as well.
+"""
+def read_reqs(path):
+    names = None
+    rows = []
+    skipped = 0
+    with open(path) as f:
+        for line in f:
+            pairs = field_rgx.findall(line)
+            if not pairs:
+                continue
+            keys = tuple(k for (k, _) in pairs)
+            if names is None:
+                names = keys
+            elif keys != names:
+                skipped += 1
+                continue
+            rows.append([v for (_, v) in pairs])
+    if names is None:
+        return [], {}, skipped
+    return list(names), {name: to_array(vals) for (name, vals) in zip(names, zip(*rows))}, skipped
+
+"""
+The cross traffic windows [(start ms, end ms, name)] of an iteration, from its iteration.json:
+each cross traffic source is active from its start_delay for its length (until the end of the
+experiment for poisson traffic, which has no fixed length).
+"""
+def cross_traffic_windows(iteration_dir):
+    path = os.path.join(iteration_dir, 'iteration.json')
+    if not os.path.exists(path):
+        return LEGACY_WINDOWS
+    with open(path) as f:
+        meta = json.load(f)
+    windows = []
+    for t in meta.get('cross_traffic', []):
+        start = float(t['start_delay']) * 1000
+        end = start + float(t['length']) * 1000 if 'length' in t else np.inf
+        windows.append((start, end, t['name']))
+    return windows
+
+# name of the first window that contains all of [start, finish], "none" if there is none
+def label_windows(start, finish, windows):
+    during = np.full(len(start), "none", dtype=object)
+    for (lo, hi, name) in reversed(windows):
+        during[(start >= lo) & (finish <= hi)] = name
+    return during
+
+# like categorize.py: "<t" for the smallest threshold t the size is below, ">last" otherwise
+def size_category(size, thresholds):
+    thresholds = sorted(float(t) for t in thresholds)
+    labels = np.array(["<{}".format(int(t)) for t in thresholds] + [">{}".format(int(thresholds[-1]))], dtype=object)
+    return labels[np.searchsorted(thresholds, size, side='right')]
+
+"""
+Parse one reqs file and label its requests. Returns (names, {name: array}) with the columns of
+fcts.data: the given labels (constant per file), the fields of the reqs file, then start,
+finish, during, Category and NormFct (rate in Mbps and rtt in ms are those of the iteration).
+"""
+def parse_reqs(path, labels, windows, rate, rtt, size_buckets=DEFAULT_SIZE_BUCKETS):
+    (names, cols, skipped) = read_reqs(path)
+    if skipped:
+        print(f"{path}: skipped {skipped} malformed line(s)")
+    n = len(cols[names[0]]) if names else 0
+
+    out = {k: np.full(n, v, dtype=object) for (k, v) in labels.items()}
+    out.update(cols)
+    if n:
+        start_time = cols['StartTime(ms)']
+        start = start_time - start_time[0]
+        finish = start + cols['Duration(usec)'] // 1000
+        out['start'] = start
+        out['finish'] = finish
+        out['during'] = label_windows(start, finish, windows)
+        out['Category'] = size_category(cols['Size'], size_buckets)
+        out['NormFct'] = np.round(normalized_fct(cols['Size'], cols['Duration(usec)'], rate, rtt), 4)
+    return list(out), out
+
+# write columns as a text table; a table without rows is left empty (not even a header)
+def write_table(path, names, cols, sep=" "):
+    n = len(cols[names[0]]) if names else 0
+    with open(path, 'w') as f:
+        if n == 0:
+            return
+        f.write(sep.join(names) + "\n")
+        strs = [cols[name].astype(str) for name in names]
+        f.writelines(sep.join(row) + "\n" for row in zip(*strs))
+
+"""
+Write fcts.summary and fcts.hist (see above) for the columnar copy of fcts.data at table. Besides
+every (sch, alg, Category, during) there is an overall group per scheme, with Category and
+during "all". Returns False, without writing anything, if the table has no numeric NormFct column.
+"""
+def summarize_fcts(table, summary_path, hist_path):
+    cols, categories = read_columnar(table)
+    if 'NormFct' not in cols or 'NormFct' in categories:
+        return False
+    norm = np.asarray(cols['NormFct'])
+    valid = ~np.isnan(norm)
+    codes = np.stack([np.asarray(cols[k]) for k in SUMMARY_KEYS], axis=1)[valid]
+    norm = norm[valid]
+
+    groups = []
+    for by_category in [True, False]:
+        keys = codes if by_category else codes[:, :2]
+        if len(keys) == 0:
+            break
+        (uniq, inv) = np.unique(keys, axis=0, return_inverse=True)
+        inv = inv.reshape(-1)
+        order = np.argsort(inv, kind='stable')
+        bounds = np.cumsum(np.bincount(inv, minlength=len(uniq)))[:-1]
+        for (key, idx) in zip(uniq, np.split(order, bounds)):
+            names = [categories[k][c] for (k, c) in zip(SUMMARY_KEYS, key)]
+            if not by_category:
+                names += ["all", "all"]
+            groups.append((names, norm[idx]))
+    groups.sort(key=lambda g: g[0])
+
+    with open(summary_path + ".tmp", 'w') as summary, open(hist_path + ".tmp", 'w') as hist:
+        summary.write(" ".join(SUMMARY_KEYS + ["n", "mean"] + ["p{}".format(p) for p in PERCENTILES]) + "\n")
+        hist.write(" ".join(SUMMARY_KEYS + ["lo", "hi", "count"]) + "\n")
+        for (names, vals) in groups:
+            pcts = np.percentile(vals, PERCENTILES)
+            summary.write(" ".join(names + [str(len(vals)), "{:.4f}".format(vals.mean())] + ["{:.4f}".format(p) for p in pcts]) + "\n")
+            (counts, _) = np.histogram(vals, bins=HIST_EDGES)
+            for (lo, hi, count) in zip(HIST_EDGES[:-1], HIST_EDGES[1:], counts):
+                if count:
+                    hist.write(" ".join(names + ["{:.6g}".format(lo), "{:.6g}".format(hi), str(count)]) + "\n")
+    os.replace(summary_path + ".tmp", summary_path)
+    os.replace(hist_path + ".tmp", hist_path)
+    return True
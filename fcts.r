@@ -1,17 +1,26 @@
 #!/usr/local/bin/Rscript
 
+# usage: fcts.r <fcts.hist> <plot>
+# the CDF of normalized FCTs per size category, from the histogram parse_outputs writes
+
+suppressWarnings(suppressMessages(library(dplyr)))
 library(ggplot2)
 
 args <- commandArgs(trailingOnly=TRUE)
-df <- read.csv(args[1], sep=" ")
-df$Duration <- df$Duration.usec. / 1e6
-bw <- 12e6
-df$ofct <- (df$Size / bw) + 0.05
-df$NormFct <- df$Duration / df$ofct
+df <- read.csv(args[1], sep=" ", check.names=FALSE)
+df <- df %>%
+    filter(Category != "all") %>%
+    group_by(sch, alg, Category, hi) %>%
+    summarise(count=sum(count), .groups="drop") %>%
+    group_by(sch, alg, Category) %>%
+    arrange(hi, .by_group=TRUE) %>%
+    mutate(cdf = cumsum(count) / sum(count), Alg = paste(sch, alg, sep="_")) %>%
+    filter(is.finite(hi))
 
-ggplot(df, aes(x=Duration, colour=Alg)) + 
-    stat_ecdf() + 
+ggplot(df, aes(x=hi, y=cdf, colour=Alg)) +
+    geom_step() +
     facet_wrap(~Category) +
-    scale_x_log10()
+    scale_x_log10() +
+    xlab("NormFct")
 
 ggsave(args[2], width=15, height=3)
@@ -1,8 +1,31 @@
 import glob
+import json
 import os
 import subprocess
 import agenda
 
+from report import input_key, CACHE_DIR
+
+"""
+Whether index.html was rendered from the same Rmd and data files (key) and is unchanged since,
+according to .report/rmd.json.
+"""
+def rendered(experiment_root, key):
+    html = os.path.join(experiment_root, 'index.html')
+    try:
+        with open(os.path.join(experiment_root, CACHE_DIR, 'rmd.json')) as f:
+            last = json.load(f)
+        st = os.stat(html)
+    except (FileNotFoundError, ValueError):
+        return False
+    return last == {'key': key, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def record_rendered(experiment_root, key):
+    st = os.stat(os.path.join(experiment_root, 'index.html'))
+    os.makedirs(os.path.join(experiment_root, CACHE_DIR), exist_ok=True)
+    with open(os.path.join(experiment_root, CACHE_DIR, 'rmd.json'), 'w') as f:
+        json.dump({'key': key, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}, f)
+
 def write_rmd(experiment_root, csv_name, num_ccp, downsample=None, interact=False, fields="zt, rout, rin, curr_rate, curr_q, elasticity2", rows=None, cols=None, **kwargs):
     experiment_root = os.path.abspath(os.path.expanduser(experiment_root))
     experiment_name = os.path.basename(experiment_root)
@@ -115,22 +138,30 @@ plt <- ggplot(df, aes(x=elapsed, y=value, color=measurement)) +
         )
 
 
-    fct_path = os.path.join(experiment_root, 'fcts.data')
-    if os.path.isfile(fct_path):
+    hist_path = os.path.join(experiment_root, 'fcts.hist')
+    summary_path = os.path.join(experiment_root, 'fcts.summary')
+    if os.path.isfile(hist_path) and os.path.isfile(summary_path):
         fct_plots = """
 #### Flow Completion Times
 
 ```{{r fcts, fig.width=15, fig.height=6, fig.align='center', echo=FALSE}}
-df_fct <- read.csv("{csv}", sep=" ")
-df_fct$Duration <- df_fct$Duration.usec. / 1e6
-bw <- 12e6 # TODO make this configurable
-df_fct$ofct <- (df_fct$Size / bw) + 0.05
-df_fct$NormFct <- df_fct$Duration / df_fct$ofct
-df_fct$scheme <- paste(df_fct$sch, "_", df_fct$alg, sep="")
-fct_plt <- ggplot(df_fct, aes(x=NormFct, colour=scheme)) + stat_ecdf() + scale_x_log10()
+df_fct <- read.csv("{hist}", sep=" ", check.names=FALSE)
+df_fct <- df_fct %>%
+    filter(Category == "all") %>%
+    mutate(scheme = paste(sch, "_", alg, sep="")) %>%
+    group_by(scheme) %>%
+    arrange(hi, .by_group=TRUE) %>%
+    mutate(cdf = cumsum(count) / sum(count)) %>%
+    filter(is.finite(hi))
+fct_plt <- ggplot(df_fct, aes(x=hi, y=cdf, colour=scheme)) + geom_step() + scale_x_log10() + xlab("NormFct")
 fct_plt
+```
+
+```{{r fct_summary, echo=FALSE}}
+knitr::kable(read.csv("{summary}", sep=" ", check.names=FALSE))
 ```""".format(
-            csv = fct_path,
+            hist = hist_path,
+            summary = summary_path,
         )
     else:
         fct_plots = ""
@@ -184,12 +215,21 @@ suppressWarnings(suppressMessages(library(tidyr)))
     with open(rmd, 'w') as f:
         f.write(contents)
 
+    # the document only reads these, so if neither they nor the document changed, neither did the report
+    inputs = [os.path.join(experiment_root, csv_name), hist_path, summary_path] + sorted(g)
+    inputs += sorted("/".join(path.split("/")[:-1])+"/ccp_switch.parsed" for path in g)
+    key = input_key('rmd', inputs, contents)
+    if rendered(experiment_root, key):
+        agenda.task("Report unchanged, not rendering Rmd")
+        return
+
     agenda.task("Rendering Rmd as HTML...")
     try:
         out = subprocess.check_output("R -e rmarkdown::render\"('{}', output_file='{}')\"".format(
             rmd,
             html
         ), shell=True)
+        record_rendered(experiment_root, key)
     except subprocess.CalledProcessError as e:
         agenda.failure("Failed to render Rmd as HTML:")
         print(e.output.decode())
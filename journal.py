@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+import time
+
+PLANNED = 'planned'
+RUNNING = 'running'
+COLLECTED = 'collected'
+PARSED = 'parsed'
+# ran, but some of its outputs could not be collected
+INCOMPLETE = 'incomplete'
+# stopped early by the live monitor (see live.py)
+ABORTED = 'aborted'
+
+# iterations in these states have all of their results locally and never need to run again
+DONE = (COLLECTED, PARSED)
+
+"""
+Append-only record of an experiment run, kept in the local experiment directory.
+
+The first line of a run records the plan: the seed used to shuffle the experiments and the
+resulting order of iteration names. Every state change of an iteration
+(planned -> running -> collected -> parsed) is appended as its own line and fsync'd, so after a
+crash the journal says exactly which iterations finished, and which were still running and must
+be redone. Iterations whose outputs could not all be collected are recorded as incomplete, with
+the number of times they were run (attempts), so they are retried only a limited number of times.
+Iterations the live monitor stopped are recorded as aborted, with the reason, and are only run
+again when asked to.
+A torn last line from a crash is ignored when reading, and the next record starts on a line of
+its own.
+"""
+class RunJournal(object):
+    def __init__(self, local_experiment_dir, dry=False):
+        self.path = os.path.join(local_experiment_dir, 'journal.jsonl')
+        self.dry = dry
+        self.lock = threading.Lock()
+        self.plan = None
+        self.states = {}
+        # the file does not end in a newline (a crash tore its last line)
+        self.torn = False
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            line = "\n"
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec['event'] == 'plan':
+                    self.plan = rec
+                elif rec['event'] == 'state':
+                    self.states[rec['iteration']] = rec
+            self.torn = not line.endswith("\n")
+
+    def append(self, rec):
+        rec['time'] = time.time()
+        with self.lock:
+            if self.dry:
+                return
+            with open(self.path, 'a') as f:
+                f.write(("\n" if self.torn else "") + json.dumps(rec) + "\n")
+                self.torn = False
+                f.flush()
+                os.fsync(f.fileno())
+
+    def reset(self):
+        with self.lock:
+            self.plan = None
+            self.states = {}
+            self.torn = False
+            if not self.dry and os.path.exists(self.path):
+                os.remove(self.path)
+
+    def record_plan(self, seed, order):
+        self.plan = {'event': 'plan', 'seed': seed, 'order': order}
+        self.append(dict(self.plan))
+
+    # fields recorded with earlier states (e.g. elapsed) are carried over unless overridden
+    def set_state(self, iteration, state, **extra):
+        with self.lock:
+            rec = dict(self.states.get(iteration, {}))
+            rec.update(extra)
+            rec.update(event='state', iteration=iteration, state=state)
+            self.states[iteration] = rec
+        self.append(dict(rec))
+
+    def state(self, iteration):
+        rec = self.states.get(iteration)
+        return rec['state'] if rec else None
+
+    # how many times iteration was started
+    def attempts(self, iteration):
+        return self.states.get(iteration, {}).get('attempts', 0)
+
+    # past records (e.g. with measured elapsed times) of iterations that finished
+    def finished(self):
+        return [rec for rec in self.states.values() if rec['state'] in DONE]
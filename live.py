@@ -0,0 +1,231 @@
+import collections
+import os
+import threading
+import time
+
+import agenda
+
+from util import *
+from downlink import departure_rgx, drop_rgx
+from parse_outputs import ccp_fields, ccp_log_header
+
+"""
+Live metrics while an experiment runs, enabled with --live or a [live] section in the config:
+
+    [live]
+    interval = 2        # seconds between polls of the logs
+    window = 10         # seconds of samples in the rolling aggregates
+    out = "live.lp"     # line protocol file, in the local experiment directory
+    stall = 30          # stop the traffic if ccp.log or downlink.log stop growing for this long once they have data (0: never)
+    max_delay = 0       # stop the traffic if the mean queueing delay stays above this many ms for stall seconds (0: never)
+
+While the traffic runs, LiveMonitor follows ccp.log and inbox.log on the inbox and downlink.log
+on the receiver, parsing only what was appended since the last poll. Every interval it appends
+rolling aggregates over the last window seconds to the line protocol file, one line per log:
+
+    ccp,iteration=<name> rin=...,rout=...,curr_rate=...,curr_q=...,elasticity=... <ns>
+    downlink,iteration=<name> throughput=...,delay=...,drops=... <ns>
+    inbox,iteration=<name> lines=... <ns>
+
+which can be followed with tail -f or fed to a dashboard (e.g. telegraf's tail input into
+influxdb). If ccp or the inbox panics, a log stops growing, or the queue is stuck, the traffic
+is stopped right away; the iteration is recorded as aborted in the run journal, and only redone
+by a run with --redo-aborted.
+"""
+
+DEFAULTS = {
+    'interval': 2,
+    'window': 10,
+    'out': 'live.lp',
+    'stall': 30,
+    'max_delay': 0,
+}
+
+# logs that always grow while traffic runs (the inbox only logs now and then)
+GROWING = ('ccp', 'downlink')
+# consecutive failed polls after which the monitor stops
+MAX_FAILURES = 3
+
+# the live.lp file is shared by the testbeds
+out_lock = threading.Lock()
+
+def live_config(config):
+    if 'live' not in config and not config['args'].live:
+        return None
+    cfg = dict(DEFAULTS)
+    cfg.update(config.get('live', {}))
+    return cfg
+
+# a line protocol line: measurement,tags fields timestamp
+def line_protocol(measurement, tags, fields, ns):
+    tags = ",".join("{}={}".format(k, str(v).replace(" ", "\\ ").replace(",", "\\,")) for (k, v) in tags.items())
+    fields = ",".join("{}={:g}".format(k, v) for (k, v) in fields.items())
+    return "{},{} {} {}\n".format(measurement, tags, fields, ns)
+
+# a remote log and what was parsed of it so far
+class FollowedLog:
+    def __init__(self, node, path, offset=0):
+        self.node = node
+        self.path = path
+        self.offset = offset
+        self.partial = ''
+        # when the log last grew: None until it has data, so the stall clock only starts with the traffic
+        self.grew = None
+
+    # the complete lines appended since the last call
+    def new_lines(self):
+        (data, offset) = self.node.read_from(self.path, self.offset)
+        if offset > self.offset:
+            self.grew = time.time()
+        self.offset = offset
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        return lines
+
+"""
+Follows the logs of iteration name: logs is a list of (log, node, path, offset), with log one of
+ccp, inbox and downlink, and offset where the iteration starts in the file (for logs shared
+between iterations). Traffic is stopped on receiver, which runs mahimahi.
+"""
+class LiveMonitor(threading.Thread):
+    def __init__(self, config, name, receiver, logs, cfg):
+        super().__init__(name="live", daemon=True)
+        self.iteration = name
+        self.receiver = receiver
+        self.cfg = cfg
+        self.logs = {log: FollowedLog(node, path, offset) for (log, node, path, offset) in logs}
+        self.out = os.path.join(config['local_experiment_dir'], cfg['out'])
+        self.ccp_idxs = [ccp_log_header.split(",").index(f) for f in ['elapsed', 'rin', 'rout', 'curr_rate', 'curr_q']]
+        self.ccp = collections.deque()        # (elapsed s, rin, rout, curr_rate, curr_q)
+        self.elasticity = None
+        self.downlink = collections.deque()   # (ms, bytes, delay ms)
+        self.drops = collections.deque()      # (ms, packets)
+        self.inbox_lines = 0
+        self.panicked = None
+        self.high_delay_since = None
+        self.start_time = None
+        self.stop_event = threading.Event()
+        self.aborted = None
+
+    def run(self):
+        self.start_time = time.time()
+        failures = 0
+        while not self.stop_event.wait(self.cfg['interval']):
+            try:
+                self.poll()
+                self.write()
+                reason = self.check()
+                failures = 0
+            except Exception as e:
+                # a poll can fail now and then (e.g. a connection hiccup), so only give up if they keep failing
+                failures += 1
+                if failures >= MAX_FAILURES:
+                    warn("live metrics disabled for this experiment: {}".format(e), exit=False)
+                    return
+                continue
+            if reason:
+                self.abort(reason)
+                return
+
+    # stop following the logs, returns why the traffic was stopped, if it was
+    def finish(self):
+        self.stop_event.set()
+        self.join()
+        return self.aborted
+
+    def poll(self):
+        for (name, log) in self.logs.items():
+            lines = log.new_lines()
+            getattr(self, "parse_" + name)(lines)
+            for l in lines:
+                if 'panicked' in l:
+                    self.panicked = "{} panicked: {}".format(name, l.strip())
+        self.trim()
+
+    def parse_ccp(self, lines):
+        idxs = [field-1 for field in ccp_fields]
+        for l in lines:
+            if 'elasticity_inf' in l:
+                try:
+                    self.elasticity = float(l.strip().split(" ")[13].replace(",", ""))
+                except (IndexError, ValueError):
+                    pass
+            elif 'rin' in l:
+                sp = l.strip().replace(",", "").split(" ")
+                try:
+                    vals = [float(sp[j]) for j in idxs]
+                except (IndexError, ValueError):
+                    continue
+                self.ccp.append(tuple(vals[i] for i in self.ccp_idxs))
+
+    def parse_inbox(self, lines):
+        self.inbox_lines += len(lines)
+
+    def parse_downlink(self, lines):
+        data = "\n".join(lines).encode()
+        for (ts, size, delay, _) in departure_rgx.findall(data):
+            self.downlink.append((int(ts), int(size), int(delay)))
+        for (ts, packets) in drop_rgx.findall(data):
+            self.drops.append((int(ts), int(packets)))
+
+    # keep only the last window seconds of samples (in each log's own clock)
+    def trim(self):
+        window = self.cfg['window']
+        for (q, scale) in [(self.ccp, 1), (self.downlink, 1000), (self.drops, 1000)]:
+            while q and q[0][0] < q[-1][0] - window * scale:
+                q.popleft()
+
+    def aggregates(self):
+        out = {}
+        if self.ccp:
+            fields = {k: sum(s[i] for s in self.ccp) / len(self.ccp) for (i, k) in enumerate(['rin', 'rout', 'curr_rate', 'curr_q'], start=1)}
+            if self.elasticity is not None:
+                fields['elasticity'] = self.elasticity
+            out['ccp'] = fields
+        if 'downlink' in self.logs:
+            secs = self.cfg['window']
+            if self.downlink:
+                secs = max((self.downlink[-1][0] - self.downlink[0][0]) / 1000, 1e-3)
+            out['downlink'] = {
+                'throughput': sum(s[1] for s in self.downlink) * 8 / secs / 1e6,
+                'delay': sum(s[2] for s in self.downlink) / len(self.downlink) if self.downlink else 0,
+                'drops': sum(d[1] for d in self.drops),
+            }
+        if 'inbox' in self.logs:
+            out['inbox'] = {'lines': self.inbox_lines}
+        return out
+
+    def write(self):
+        ns = time.time_ns()
+        lines = [line_protocol(m, {'iteration': self.iteration}, fields, ns) for (m, fields) in self.aggregates().items() if fields]
+        with out_lock, open(self.out, 'a') as f:
+            f.writelines(lines)
+
+    # why the traffic should be stopped, if it should
+    def check(self):
+        if self.panicked:
+            return self.panicked
+        now = time.time()
+        stall = self.cfg['stall']
+        if stall:
+            for name in GROWING:
+                grew = self.logs[name].grew if name in self.logs else None
+                if grew is not None and now - grew > stall:
+                    return "{} stopped growing {:.0f} seconds ago".format(os.path.basename(self.logs[name].path), now - grew)
+        max_delay = self.cfg['max_delay']
+        delay = self.aggregates().get('downlink', {}).get('delay', 0)
+        if max_delay and delay > max_delay:
+            if self.high_delay_since is None:
+                self.high_delay_since = now
+            elif now - self.high_delay_since > stall:
+                return "queueing delay above {} ms for {:.0f} seconds".format(max_delay, now - self.high_delay_since)
+        else:
+            self.high_delay_since = None
+        return None
+
+    def abort(self, reason):
+        elapsed = time.time() - self.start_time
+        agenda.subfailure("stopping traffic after {:.1f} seconds: {}".format(elapsed, reason))
+        self.aborted = {'reason': reason, 'elapsed': elapsed, 'time': time.time()}
+        # ends the mahimahi shell, and with it every traffic client
+        self.receiver.kill("mm-link", signal="TERM", sudo=True)
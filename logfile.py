@@ -0,0 +1,32 @@
+import glob
+import gzip
+import os
+
+"""
+Reading iteration logs that may be stored compressed: bulk collection (see collect.py) keeps the
+large text logs gzipped as e.g. ccp.log.gz, and the parsers read either form through these.
+"""
+
+COMPRESSED_EXT = '.gz'
+
+# open a log, or its compressed version if only that exists
+def open_log(path, mode='r'):
+    if not os.path.exists(path) and os.path.exists(path + COMPRESSED_EXT):
+        path = path + COMPRESSED_EXT
+    if path.endswith(COMPRESSED_EXT):
+        return gzip.open(path, mode + 't' if 'b' not in mode else mode)
+    return open(path, mode)
+
+# the log path a (possibly compressed) log file was stored as
+def log_name(path):
+    return path[:-len(COMPRESSED_EXT)] if path.endswith(COMPRESSED_EXT) else path
+
+"""
+The logs matching pattern (e.g. "**/ccp.log") under dirname, compressed or not, sorted. A log
+present in both forms is returned once, uncompressed.
+"""
+def find_logs(dirname, pattern):
+    plain = glob.glob(os.path.join(dirname, pattern), recursive=True)
+    compressed = glob.glob(os.path.join(dirname, pattern + COMPRESSED_EXT), recursive=True)
+    found = set(plain)
+    return sorted(plain + [p for p in compressed if log_name(p) not in found])
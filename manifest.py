@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# params as they compare after a round trip through the manifest (e.g. tuples become lists)
+def as_json(params):
+    return json.loads(json.dumps(params))
+
+"""
+Which parse inputs (ccp.log, downlink.log, etg reqs files, ...) have been parsed, and into what.
+
+Stored as parse_manifest.json in the experiment directory. For every input it records the size,
+mtime and sha256 when it was parsed, the outputs it was parsed into and the parameters used
+(e.g. the sample rate). An input needs parsing again if any of its outputs are missing, the
+parameters differ, or its contents changed: size and mtime are checked first, and the hash only
+when they differ, so a touched but identical file is not parsed again.
+"""
+class ParseManifest:
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, 'parse_manifest.json')
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                self.entries = {}
+
+    def key(self, path):
+        return os.path.relpath(path, self.root)
+
+    def changed(self, path, outputs=(), params=None):
+        params = as_json(params)
+        if not all(os.path.exists(o) for o in outputs):
+            return True
+        st = os.stat(path)
+        entry = self.entries.get(self.key(path))
+        if entry is None:
+            # parsed before there was a manifest: trust outputs that are newer than the input
+            if outputs and all(os.stat(o).st_mtime >= st.st_mtime for o in outputs):
+                self.update(path, outputs, params)
+                return False
+            return True
+        if entry['params'] != params or sorted(entry['outputs']) != sorted(self.key(o) for o in outputs):
+            return True
+        if entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+            return False
+        if entry['size'] == st.st_size and entry['sha256'] == file_hash(path):
+            entry['mtime'] = st.st_mtime
+            return False
+        return True
+
+    def update(self, path, outputs=(), params=None):
+        params = as_json(params)
+        st = os.stat(path)
+        self.entries[self.key(path)] = {
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'sha256': file_hash(path),
+            'outputs': [self.key(o) for o in outputs],
+            'params': params,
+        }
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -0,0 +1,153 @@
+"""
+Control agent that runs on an experiment node (see ConnectionWrapper.start_agent).
+
+It is started once per node over the existing ssh connection and then serves requests on
+stdin/stdout, one JSON object per line in each direction:
+
+    -> {"id": 3, "op": "stat", "path": "~/bundler-script/experiments"}
+    <- {"id": 3, "ok": true, "exists": true, "size": 4096, "mtime": 1611700000.0}
+
+so every request costs a single round trip instead of a new remote shell. Requests are served
+concurrently, so responses can come back in a different order (the client matches them by id).
+This file is sent to the node as the agent's source, so it must only use the standard library.
+"""
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+def op_run(req):
+    out = subprocess.PIPE if req.get('capture', True) else subprocess.DEVNULL
+    p = subprocess.run(req['cmd'], shell=True, executable='/bin/bash', stdin=subprocess.DEVNULL, stdout=out, stderr=out)
+    return {
+        'exited': p.returncode,
+        'stdout': p.stdout.decode(errors='replace') if p.stdout else '',
+        'stderr': p.stderr.decode(errors='replace') if p.stderr else '',
+    }
+
+def op_spawn(req):
+    def redirect(path):
+        if not path:
+            return subprocess.DEVNULL
+        return open(os.path.expanduser(path), 'ab')
+    p = subprocess.Popen(
+        req['cmd'],
+        shell=True,
+        executable='/bin/bash',
+        cwd=os.path.expanduser(req['wd']) if req.get('wd') else None,
+        stdin=subprocess.DEVNULL,
+        stdout=redirect(req.get('stdout')),
+        stderr=redirect(req.get('stderr')),
+        start_new_session=True,
+    )
+    return {'exited': 0, 'pid': p.pid}
+
+def op_pgrep(req):
+    p = subprocess.run(['pgrep', '-c', req['pattern']], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    count = int(p.stdout.strip() or 0)
+    return {'exited': 0 if count else 1, 'count': count}
+
+def op_kill(req):
+    cmd = ['pkill', '-{}'.format(req.get('signal', 9)), req['pattern']]
+    if req.get('sudo'):
+        cmd = ['sudo'] + cmd
+    p = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return {'exited': p.returncode}
+
+def op_stat(req):
+    try:
+        st = os.stat(os.path.expanduser(req['path']))
+    except OSError:
+        return {'exited': 1, 'exists': False}
+    return {'exited': 0, 'exists': True, 'size': st.st_size, 'mtime': st.st_mtime}
+
+def op_which(req):
+    path = shutil.which(req['prog'])
+    return {'exited': 0 if path else 1, 'path': path}
+
+def op_glob(req):
+    return {'exited': 0, 'paths': sorted(glob.glob(os.path.expanduser(req['path'])))}
+
+# a file that does not exist (yet) reads as empty, like tail -c in read_from's fallback
+def op_read(req):
+    try:
+        f = open(os.path.expanduser(req['path']), 'rb')
+    except FileNotFoundError:
+        return {'exited': 1, 'data': '', 'offset': req.get('offset', 0)}
+    with f:
+        f.seek(req.get('offset', 0))
+        data = f.read(req['length']) if req.get('length') else f.read()
+    return {'exited': 0, 'data': data.decode(errors='replace'), 'offset': req.get('offset', 0) + len(data)}
+
+def op_tail(req):
+    with open(os.path.expanduser(req['path']), 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - req.get('bytes', 8192)))
+        lines = f.read().decode(errors='replace').splitlines()
+    return {'exited': 0, 'data': "\n".join(lines[-req.get('lines', 10):])}
+
+# wait for a line matching pattern (a regex) to show up in path, reading only what is new each time
+def op_wait(req):
+    path = os.path.expanduser(req['path'])
+    pattern = re.compile(req['pattern'])
+    end = time.time() + req.get('timeout', 30)
+    offset = 0
+    partial = ''
+    delay = 0.05
+    while True:
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            offset += len(data)
+            lines = (partial + data.decode(errors='replace')).split("\n")
+            partial = lines.pop()
+            if any(pattern.search(l) for l in lines) or pattern.search(partial):
+                return {'exited': 0}
+        except OSError:
+            pass
+        if time.time() >= end:
+            return {'exited': 1}
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+OPS = {
+    'run': op_run,
+    'spawn': op_spawn,
+    'pgrep': op_pgrep,
+    'kill': op_kill,
+    'stat': op_stat,
+    'which': op_which,
+    'glob': op_glob,
+    'read': op_read,
+    'tail': op_tail,
+    'wait': op_wait,
+}
+
+def handle(req, out, lock):
+    try:
+        resp = OPS[req['op']](req)
+        resp['ok'] = True
+    except Exception as e:
+        resp = {'ok': False, 'error': "{}: {}".format(type(e).__name__, e)}
+    resp['id'] = req.get('id')
+    with lock:
+        out.write(json.dumps(resp) + "\n")
+        out.flush()
+
+# every request is served in a thread of its own, so a long run doesn't hold up the others
+def serve(inp, out):
+    lock = threading.Lock()
+    for line in inp:
+        if not line.strip():
+            continue
+        req = json.loads(line)
+        threading.Thread(target=handle, args=(req, out, lock), daemon=True).start()
+
+if __name__ == "__main__":
+    serve(sys.stdin, sys.stdout)
@@ -1,11 +1,47 @@
 from graph import write_rmd
+from report import write_html
+from manifest import ParseManifest
+from columnar import update_columnar
+from downlink import parse_downlink_log, port_groups
+from fct import parse_reqs, cross_traffic_windows, write_table, summarize_fcts
+from logfile import open_log, find_logs
+from concurrent.futures import ProcessPoolExecutor
 import agenda
 import glob
 import os
 import re
-import subprocess
+import shutil
 import sys
 
+flow_mode_rgx = re.compile("flow_mode: ([^,]+)")
+
+"""
+A pattern matching the first tokens of a line split on single spaces (as str.split(" ") would),
+with the tokens at the 0-based idxs as groups named t<idx>, in the order of tokens_names(idxs).
+"""
+def tokens_rgx(idxs, optional=()):
+    parts = []
+    for i in range(max(idxs) + 1):
+        tok = "(?P<t{}>[^ ]*)".format(i) if i in idxs else "[^ ]*"
+        parts.append("(?: {})?".format(tok) if i in optional else (" " if i else "") + tok)
+    return re.compile("".join(parts))
+
+def tokens_names(idxs):
+    return ["t{}".format(i) for i in idxs]
+
+# the elasticity estimate of an elasticity_inf record, and the fields of a mode switch
+elasticity_rgx = tokens_rgx([13])
+switch_rgx = tokens_rgx([7, 11, 13], optional=[12, 13])
+
+"""
+Parse a nimbus ccp.log in one pass.
+
+Every sample_rate'th "rin" report becomes a row of ccp.parsed (prepend, then the given 1-based
+fields of the report, then the latest elasticity estimate), and the periods spent in XTCP mode
+are written to ccp_switch.parsed. Each record type has its own precompiled pattern that picks
+out only the fields it needs, and rows are written in batches. Returns the number of lines that
+looked like a record but could not be parsed, which are skipped.
+"""
 def parse_nimbus_log(f, out, out_switch, header, prepend, fields, sample_rate):
     i=0
     e2 = None
@@ -14,56 +50,76 @@ def parse_nimbus_log(f, out, out_switch, header, prepend, fields, sample_rate):
     last_switch = 0
     xmax = 0
     starting_mode = None
+    skipped = 0
+
+    idxs = [field-1 for field in fields]
+    rin_rgx = tokens_rgx(idxs + [8])
+    rin_names = tokens_names(idxs)
+    row_prefix = prepend + ","
+    rows = []
+    # logged values repeat a lot (rtts, rates, queue lengths), so remember how they are formatted
+    formatted = {}
+    def fmt(v):
+        s = formatted.get(v)
+        if s is None:
+            if len(formatted) >= 1<<16:
+                formatted.clear()
+            s = formatted[v] = str(round(float(v.replace(",", "")),3))
+        return s
     for l in f:
         if '[nimbus] starting' in l:
-            mode_expr = re.compile("flow_mode: ([^,]+)")
-            res = mode_expr.search(l)
-            starting_mode = res.groups()[0]
-        if 'elasticity_inf' in l:
+            res = flow_mode_rgx.search(l)
+            if res is not None:
+                starting_mode = res.group(1)
+            else:
+                skipped += 1
+        if 'elasticity_inf' in l and i % sample_rate == 0:
+            m = elasticity_rgx.match(l.strip())
+            try:
+                e2 = round(float(m.group('t13').replace(",", "")),3)
+            except (AttributeError, ValueError):
+                skipped += 1
+        if 'rin' in l:
             if i % sample_rate == 0:
+                m = rin_rgx.match(l.strip())
                 try:
-                    sp = l.strip().split(" ")
-                    e2 = round(float(sp[13].replace(",", "")),3)
-                except:
-                    pass
-        if 'rin' in l:
-            try:
-                if i % sample_rate == 0:
-                    sp = l.strip().replace(",", "").split(" ")
-                    xmax = float(sp[8])
-                    out.write(
-                        prepend + "," +
-                        ','.join([str(round(float(sp[field-1]),3)) for field in fields]) +
+                    x = float(m.group('t8').replace(",", ""))
+                    rows.append(
+                        row_prefix +
+                        ','.join([fmt(v) for v in m.group(*rin_names)]) +
                         ',' + (str(e2) if e2 else '') +
                         "\n"
                     )
-                e2=None
-                i+=1
-            except:
-                continue
+                except (AttributeError, ValueError):
+                    # a malformed report does not count towards sampling, and e2 carries over
+                    skipped += 1
+                    continue
+                # only a report that made it into a row moves the end of the last XTCP period
+                xmax = x
+                if len(rows) >= 4096:
+                    out.writelines(rows)
+                    rows = []
+            e2=None
+            i+=1
         if 'switched mode' in l:
-            sp = l.strip().split(" ")
-
-            if sp[7] == 'XTCP,':
-                elapsed = float(sp[11].replace(",", ""))
-                from_mode = 'delay'
-                to_mode = 'xtcp'
-                #delay_threshold = ''
-            else:
-                elapsed = float(sp[13].replace(",", ""))
-                from_mode = 'xtcp'
-                to_mode = 'delay'
-                #delay_threshold = float(sp[7].replace(",", ""))
+            m = switch_rgx.match(l.strip())
+            try:
+                if m.group('t7') == 'XTCP,':
+                    elapsed = float(m.group('t11').replace(",", ""))
+                    from_mode = 'delay'
+                    to_mode = 'xtcp'
+                else:
+                    elapsed = float(m.group('t13').replace(",", ""))
+                    from_mode = 'xtcp'
+                    to_mode = 'delay'
+            except (AttributeError, TypeError, ValueError):
+                skipped += 1
+                continue
 
             if from_mode == 'xtcp':
                 xtcp_regions.append((last_switch, elapsed))
             last_switch = elapsed
-            #out_switch.write("{elapsed},{from_mode},{to_mode},{thresh}\n".format(
-            #    elapsed=elapsed,
-            #    from_mode=from_mode,
-            #    to_mode=to_mode,
-            #    thresh=delay_threshold,
-            #))
+    out.writelines(rows)
     if to_mode == 'xtcp':
         xtcp_regions.append((last_switch, 'Inf'))
 
@@ -73,116 +129,201 @@ def parse_nimbus_log(f, out, out_switch, header, prepend, fields, sample_rate):
     if not xtcp_regions and starting_mode == "XTCP":
         out_switch.write("{},{},-Inf,Inf\n".format(0, xmax))
 
-def parse_ccp_logs(dirname, sample_rate, replot):
-    agenda.subtask("ccp logs")
-    fields = [9,17,19,27,29,35,13]
-    log_header = "elapsed,rtt,zt,rout,rin,curr_rate,curr_q,elasticity2"
-    pattern = re.compile(r'(?P<sch>[a-z]+)_(?P<bw>[\d]+)_(?P<delay>[\d]+)/(?P<alg>[a-z_]+).(?P<args>[a-z_]+=[a-zA-Z_0-9].+)?/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/ccp.log')
+    return skipped
 
-    g = glob.glob(dirname + "/**/ccp.log", recursive=True)
+ccp_fields = [9,17,19,27,29,35,13]
+ccp_log_header = "elapsed,rtt,zt,rout,rin,curr_rate,curr_q,elasticity2"
+ccp_log_pattern = re.compile(r'(?P<sch>[a-z]+)_(?P<bw>[\d]+)_(?P<delay>[\d]+)/(?P<alg>[a-z_]+).(?P<args>[a-z_]+=[a-zA-Z_0-9].+)?/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/ccp.log')
 
-    global_out_fname = os.path.join(dirname, 'ccp.parsed')
-    if not replot and os.path.isfile(global_out_fname):
-        return global_out_fname, len(g)
+# the files parse_ccp_log writes for exp, nothing for logs it skips
+def ccp_log_outputs(exp):
+    if ccp_log_pattern.search(exp) is None or 'nimbus' not in exp:
+        return []
+    exp_root = os.path.dirname(exp)
+    return [os.path.join(exp_root, "ccp.parsed"), os.path.join(exp_root, "ccp_switch.parsed")]
+
+# parse one iteration's ccp.log (run in a worker process)
+def parse_ccp_log(exp, sample_rate):
+    exp_root = os.path.dirname(exp)
+    matches = ccp_log_pattern.search(exp)
+    if matches is None or 'nimbus' not in exp:
+        print(f"skipping {exp}, no regex match")
+        return
 
-    for exp in g:
-        exp_root = "/".join(exp.split("/")[:-1])
-        old_header = None
-        matches = pattern.search(exp)
-        if matches is not None and 'nimbus' in exp:
-            print(exp)
-            with open(exp) as f, open(os.path.join(exp_root, "ccp.parsed"), 'w') as out, open(os.path.join(exp_root, "ccp_switch.parsed"), 'w') as out_switch:
-                sch, bw, delay, args, bg, cross, seed, alg = matches.group('sch', 'bw', 'delay', 'args', 'bg', 'cross', 'seed', 'alg')
-                args = [a.split("=") for a in args.split(".")] if args else []
-                exp_header = f"sch,alg,rate,rtt,{','.join(a[0] for a in args)},bundle,cross,seed"
-                header = exp_header + "," + log_header
-                if old_header and old_header != header:
-                    exit("headers do not align")
-                old_header = header
-                out.write(header + "\n")
-                bg = bg if bg != '' else 'None'
-                cross = cross if cross != '' else 'None'
-                prepend = f"{sch},{alg},{bw},{delay},{','.join(a[1] for a in args)},{bg},{cross},{seed}"
-                parse_nimbus_log(f, out, out_switch, header, prepend, fields, sample_rate)
+    print(exp)
+    with open_log(exp) as f, open(os.path.join(exp_root, "ccp.parsed"), 'w', buffering=1<<20) as out, open(os.path.join(exp_root, "ccp_switch.parsed"), 'w') as out_switch:
+        sch, bw, delay, args, bg, cross, seed, alg = matches.group('sch', 'bw', 'delay', 'args', 'bg', 'cross', 'seed', 'alg')
+        args = [a.split("=") for a in args.split(".")] if args else []
+        exp_header = f"sch,alg,rate,rtt,{','.join(a[0] for a in args)},bundle,cross,seed"
+        header = exp_header + "," + ccp_log_header
+        out.write(header + "\n")
+        bg = bg if bg != '' else 'None'
+        cross = cross if cross != '' else 'None'
+        prepend = f"{sch},{alg},{bw},{delay},{','.join(a[1] for a in args)},{bg},{cross},{seed}"
+        skipped = parse_nimbus_log(f, out, out_switch, header, prepend, ccp_fields, sample_rate)
+    if skipped:
+        print(f"{exp}: skipped {skipped} malformed line(s)")
+
+"""
+Parse the inputs (of one kind) that changed since they were last parsed, according to the
+manifest, in parallel on pool. outputs(exp) are the files parse(exp, *args) writes for exp.
+Returns whether anything was parsed.
+"""
+def parse_changed(pool, manifest, replot, inputs, outputs, parse, *args):
+    params = list(args) if args else None
+    todo = [exp for exp in inputs if replot or manifest.changed(exp, outputs(exp), params)]
+    if not todo:
+        return False
+
+    futures = [pool.submit(parse, exp, *args) for exp in todo]
+    for (exp, fut) in zip(todo, futures):
+        fut.result()
+        manifest.update(exp, outputs(exp), params)
+    return True
+
+"""
+Concatenate files with the same header into out, in the (sorted, so deterministic) given order.
+
+Streams everything through one buffered copy into a temporary file which then replaces out, so
+readers never see a half-written table. Exits if a file's header differs from the first one.
+"""
+def merge_parsed(parts, out):
+    tmp = out + ".tmp"
+    header = None
+    with open(tmp, 'wb') as dst:
+        for part in parts:
+            with open(part, 'rb') as src:
+                part_header = src.readline()
+                if not part_header:
+                    continue
+                if header is None:
+                    header = part_header
+                    dst.write(header)
+                elif part_header != header:
+                    os.remove(tmp)
+                    sys.exit(f"headers do not align: {part}\n  {part_header.decode().strip()}\n  expected {header.decode().strip()}")
+                shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(tmp, out)
+
+def parse_ccp_logs(dirname, sample_rate, replot, pool, manifest):
+    agenda.subtask("ccp logs")
+    g = []
+    for exp in find_logs(dirname, "**/ccp.log"):
+        # skipped logs have no outputs, so the manifest would always count them as changed
+        if ccp_log_outputs(exp):
+            g.append(exp)
         else:
             print(f"skipping {exp}, no regex match")
 
     global_out_fname = os.path.join(dirname, 'ccp.parsed')
-    subprocess.call(f"rm -f {global_out_fname}", shell=True)
-    g = glob.glob(dirname + "/**/ccp.parsed", recursive=True)
-    tail = 1
-    for exp in g:
-        if exp != global_out_fname:
-            subprocess.call(f"tail -n +{tail} {exp} >> {global_out_fname}", shell=True)
-            if tail == 1:
-                tail = 2
+    parsed = parse_changed(pool, manifest, replot, g, ccp_log_outputs, parse_ccp_log, sample_rate)
+    if not parsed and os.path.isfile(global_out_fname):
+        return global_out_fname, len(g)
+
+    g = sorted(p for p in glob.glob(dirname + "/**/ccp.parsed", recursive=True) if p != global_out_fname)
+    merge_parsed(g, global_out_fname)
 
     return global_out_fname, len(g)
 
-def parse_mahimahi_logs(dirname, sample_rate, replot, bundler_root):
+mahimahi_log_pattern = re.compile(r'(?P<sch>[a-z]+)_(?P<bw>[\d]+)_(?P<delay>[\d]+)/(?P<alg>[a-zA-Z]+).(?P<args>[a-z_]+=[a-zA-Z_0-9].+)?/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/downlink.log')
+
+def mahimahi_log_outputs(exp):
+    return [os.path.join(os.path.dirname(exp), 'mm-graph.tmp')]
+
+# parse one iteration's downlink.log (run in a worker process), in buckets of one rtt
+def parse_mahimahi_log(exp, groups):
+    delay = int(mahimahi_log_pattern.search(exp).group('delay'))
+    parse_downlink_log(exp, mahimahi_log_outputs(exp)[0], delay*2, groups)
+
+def parse_mahimahi_logs(dirname, replot, pool, manifest):
     agenda.subtask("mahimahi logs")
-    pattern = re.compile(r'(?P<sch>[a-z]+)_(?P<bw>[\d]+)_(?P<delay>[\d]+)/(?P<alg>[a-zA-Z]+).(?P<args>[a-z_]+=[a-zA-Z_0-9].+)?/b=(?P<bg>[^_]*)_c=(?P<cross>[^/]*)/(?P<seed>[\d]+)/downlink.log')
-    g = glob.glob(dirname + "/**/downlink.log", recursive=True)
-    for exp in g:
-        matches = pattern.search(exp)
-        if matches is not None:
-            delay = int(matches.group('delay'))
-            rtt = int(delay*2)
-            print(rtt,exp)
-            exp_root = "/".join(exp.split("/")[:-1])
-            exp_root = os.path.dirname(exp)
-            if not replot and os.path.isfile(os.path.join(exp_root, 'mm-graph.tmp')):
-                continue
-            subprocess.check_output(f"{bundler_root}/mahimahi/scripts/mm-graph {exp} {rtt} --fake --plot-direction ingress --agg \"5000:6000=bundle,8000:9000=cross\"", shell=True, executable="/bin/bash")
-            subprocess.check_output("mv /tmp/mm-graph.tmp {}".format(exp_root), shell=True)
+    g = []
+    for exp in find_logs(dirname, "**/downlink.log"):
+        if mahimahi_log_pattern.search(exp) is not None:
+            g.append(exp)
         else:
             print(f"skipping {exp}, no regex match")
+    groups = port_groups(dirname)
+    agenda.subtask("port groups: {}".format(", ".join(f"{name}={lo}:{hi}" for (name, lo, hi) in groups)))
+    if groups[0][1] <= groups[1][2] and groups[1][1] <= groups[0][2]:
+        print("bundle and cross traffic use overlapping ports, so their throughput is counted in both")
+    parse_changed(pool, manifest, replot, g, mahimahi_log_outputs, parse_mahimahi_log, groups)
+
+def etg_log_outputs(exp):
+    return [os.path.splitext(exp)[0] + ".fcts"]
+
+# parse one etg reqs file (run in a worker process), relative to the experiment directory dirname
+def parse_etg_log(exp, dirname):
+    print(exp)
+    exp_root = os.path.dirname(exp)
+    labels = exp_root.split(dirname)[-1].split("/")
+    try:
+        _, setup, alg, traffic, seed = labels
+    except Exception as e:
+        print(labels)
+        raise e
+    sch, bw, rtt = setup.split("_")
+    labels = {'sch': sch, 'bw': bw, 'rtt': rtt, 'alg': alg, 'traffic': traffic, 'seed': seed}
+    (names, cols) = parse_reqs(exp, labels, cross_traffic_windows(exp_root), rate=bw, rtt=rtt)
+    write_table(etg_log_outputs(exp)[0], names, cols)
 
-def parse_etg_logs(dirname, replot):
+def parse_etg_logs(dirname, replot, pool, manifest):
     agenda.subtask("etg logs")
     outf = os.path.join(dirname, "fcts.data")
-    if not replot and os.path.isfile(outf):
-        return
-    if replot and os.path.isfile(outf):
-        os.remove(outf)
-    g = glob.glob(dirname + "/**/*reqs.out", recursive=True)
-    some = None
-    cross_traffic_pattern = "0:60=empty1,60:120=iperfc1,120:150=empty2,150:210=cbr32,210:250=empty3"
-    print_head = True
-    for exp in g:
-        print(exp)
-        some = True
-        exp_root = "/".join(exp.split("/")[:-1])
-        exp_root = os.path.dirname(exp)
-        exp_root = exp_root.split(dirname)[-1].split("/")
-        try:
-            _, setup, alg, traffic, seed = exp_root
-        except Exception as e:
-            print(exp_root)
-            raise e
-        alg_sp = alg.split(".")
-        if not alg_sp:
-            alg = alg_sp[0]
-        sch, bw, rtt = setup.split("_")
-        subprocess.check_output(f"awk '{{print \"sch:{sch}, bw:{bw}, rtt:{rtt}, alg:{alg}, traffic:{traffic}, seed:{seed} \"$0}}' {exp} | python3 columnize.py \"{cross_traffic_pattern}\" {print_head}>> tmp", shell=True)
-        print_head = False
-    if some:
-        subprocess.call(f"mv tmp {outf}", shell=True)
-
-def parse_outputs(config, replot=False, interact=False, graph_kwargs={}):
+    g = sorted(glob.glob(dirname + "/**/*reqs.out", recursive=True))
+    parsed = parse_changed(pool, manifest, replot, g, etg_log_outputs, parse_etg_log, dirname)
+    if g and (parsed or not os.path.isfile(outf)):
+        merge_parsed([etg_log_outputs(exp)[0] for exp in g], outf)
+        parsed = True
+
+    summary = os.path.join(dirname, "fcts.summary")
+    hist = os.path.join(dirname, "fcts.hist")
+    if os.path.isfile(outf) and os.path.getsize(outf) > 0 and (parsed or not os.path.isfile(summary)):
+        update_columnar(outf, " ")
+        if not summarize_fcts(outf, summary, hist):
+            print("fcts.data has no numeric NormFct column (parsed by an older version?), rerun with --replot to summarize it")
+
+"""
+Parse every iteration's logs and write the report.
+
+Iterations are parsed in parallel (jobs worker processes, one per core by default), and only
+the inputs that changed since the last run are parsed again (see ParseManifest), unless replot
+is given. The per-iteration results are then merged in a deterministic (sorted) order, and
+every table also gets a columnar copy (see columnar.py).
+
+The report is static HTML written in Python (report="html", see report.py), or R Markdown
+rendered with R (report="rmd", see graph.py). The html report downsamples every plot on its
+own, so the ccp logs are only thinned out while parsing (downsample) for the rmd one.
+"""
+def parse_outputs(config, replot=False, interact=False, graph_kwargs={}, jobs=None, report="html"):
     experiment_root = os.path.abspath(os.path.expanduser(config['local_experiment_dir']))
     agenda.task(f'parsing experiment_root: {experiment_root}')
 
-    if 'downsample' in graph_kwargs:
+    if 'downsample' in graph_kwargs and report == "rmd":
         sample_rate = graph_kwargs['downsample']
     else:
         sample_rate = 1
 
-    global_out_fname, num_ccp = parse_ccp_logs(experiment_root, sample_rate, replot)
-    parse_mahimahi_logs(experiment_root, sample_rate, replot, config['structure']['bundler_root'])
-    parse_etg_logs(experiment_root, replot)
+    manifest = ParseManifest(experiment_root)
+    try:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            global_out_fname, num_ccp = parse_ccp_logs(experiment_root, sample_rate, replot, pool, manifest)
+            parse_mahimahi_logs(experiment_root, replot, pool, manifest)
+            parse_etg_logs(experiment_root, replot, pool, manifest)
 
-    write_rmd(experiment_root, global_out_fname, num_ccp, **graph_kwargs)
+            agenda.subtask("columnar tables")
+            tables = [(global_out_fname, ","), (os.path.join(experiment_root, "fcts.data"), " ")]
+            tables += [(p, " ") for p in sorted(glob.glob(experiment_root + "/**/mm-graph.tmp", recursive=True))]
+            tables += [(p, ",") for p in sorted(glob.glob(experiment_root + "/*/**/ccp.parsed", recursive=True))]
+            for fut in [pool.submit(update_columnar, path, sep) for (path, sep) in tables]:
+                fut.result()
+    finally:
+        manifest.save()
+
+    if report == "html":
+        write_html(experiment_root, jobs=jobs, **graph_kwargs)
+    else:
+        write_rmd(experiment_root, global_out_fname, num_ccp, **graph_kwargs)
 
 if __name__ == "__main__":
     import argparse
@@ -190,16 +331,19 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Parse bundler experiment logs and graph results")
     parser.add_argument("root", help="Root directory containing all experiments to be plotted")
     parser.add_argument("--bundler_root", type=str, help="Bundler root directory", default="~/bundler-scripts")
-    parser.add_argument("--downsample", type=int, help="Downsamples to 1/N of all log lines for faster plotting")
+    parser.add_argument("--downsample", type=int, help="Plot 1/N as many points (with --report rmd: downsamples to 1/N of all log lines)")
     parser.add_argument("--fields", help="Which fields to plot")
     parser.add_argument("--rows", help="(Column name) by which to split into a grid vertically")
     parser.add_argument("--cols", help="(Column name) by which to split into a grid horizontally")
-    parser.add_argument('--replot', help="Force replot",action="store_true")
-    parser.add_argument("--interact", help="enable interactive mode for graphs",action="store_true")
+    parser.add_argument('--replot', help="Force replot (by default, only iterations whose logs changed are parsed again)",action="store_true")
+    parser.add_argument("--jobs", "-j", type=int, help="Number of iterations to parse in parallel (default: number of cores)")
+    parser.add_argument("--interact", help="enable interactive mode for graphs (rmd report only)",action="store_true")
+    parser.add_argument("--report", choices=["html", "rmd"], help="Write a static HTML report (default), or render R Markdown (default with --interact)")
     args = parser.parse_args()
-    graph_kwargs = dict((k,v) for k,v in vars(args).items() if (v and not k=='root' and not k=='replot'))
+    graph_kwargs = dict((k,v) for k,v in vars(args).items() if (v and not k in ['root', 'replot', 'jobs', 'report']))
+    report = args.report or ("rmd" if args.interact else "html")
 
     config = {}
     config['local_experiment_dir'] = args.root
     config['structure'] = {'bundler_root': args.bundler_root}
-    parse_outputs(config, replot=args.replot, interact=args.interact, graph_kwargs=graph_kwargs)
+    parse_outputs(config, replot=args.replot, interact=args.interact, graph_kwargs=graph_kwargs, jobs=args.jobs, report=report)
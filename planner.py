@@ -0,0 +1,52 @@
+import random
+
+"""
+Ordering of experiments to avoid needless testbed reconfiguration.
+
+The expensive part of switching between experiments is restarting the inbox (whose qdisc
+depends on the scheduler) and ccp (whose binary and arguments depend on the algorithm).
+Experiments that share both have the same setup key and can run back to back; see --reuse-setup.
+Between experiments that only differ in the algorithm, only ccp has to be restarted.
+"""
+
+# what the inbox's setup depends on: the scheduler
+def inbox_key(exp):
+    return exp.sch
+
+# what ccp's setup depends on: the algorithm and its arguments
+def ccp_key(exp):
+    return (exp.alg['name'], tuple(sorted((k, str(v)) for k, v in exp.alg.items())))
+
+# experiments with equal keys can share a running inbox and ccp: (inbox key, ccp key)
+def setup_key(exp):
+    if exp.alg['name'] == "nobundler":
+        return ("nobundler", exp.sch)
+    return (inbox_key(exp), ccp_key(exp))
+
+"""
+Order exps (already shuffled by enumerate_experiments) for running.
+
+random: keep the shuffled order.
+grouped: run all experiments with the same setup key together, and the groups with the same
+    scheduler one after the other. The order of the groups is shuffled with the same seed, and
+    the shuffled order within each group is kept, so the order is still randomized (and
+    reproducible) but setup changes only between groups, and the inbox only between schedulers.
+"""
+def order_experiments(exps, seed, order='grouped'):
+    if order == 'random':
+        return list(exps)
+    elif order != 'grouped':
+        raise ValueError("unknown experiment order: {}".format(order))
+
+    keys = []
+    for exp in exps:
+        if setup_key(exp) not in keys:
+            keys.append(setup_key(exp))
+    random.Random(seed).shuffle(keys)
+    # the groups of each scheduler together, in the order the scheduler first comes up
+    first = {}
+    for k in keys:
+        first.setdefault(k[0], len(first))
+    keys.sort(key=lambda k: first[k[0]])
+    rank = {k: i for (i, k) in enumerate(keys)}
+    return sorted(exps, key=lambda exp: rank[setup_key(exp)])
@@ -0,0 +1,73 @@
+import agenda
+import threading
+
+class Testbed:
+    def __init__(self, config, topo):
+        self.config = config
+        self.topo = topo
+        self.name = config['testbed']
+        self.machines = topo.machines
+        self.conns = topo.conns
+        # inbox and ccp kept running between experiments, see --reuse-setup
+        self.setup = None
+
+    def __str__(self):
+        return self.name if self.name else "testbed"
+
+"""
+Run fn(testbed, i, item) for every item, handing each item to whichever testbed is free.
+
+With a single testbed everything runs on the calling thread (so --interact still works).
+Otherwise there is one worker thread per testbed. If affinity(item) is given, a free testbed
+takes the first remaining item with the same affinity as the last item it ran (e.g. one that can
+reuse its setup), and otherwise the first remaining item. If an item fails on any testbed
+(including via fatal_warn, which raises SystemExit), the other testbeds finish their current item
+and stop, and the error is re-raised here.
+"""
+def run_on_pool(testbeds, items, fn, affinity=None):
+    if len(testbeds) == 1:
+        for (i, item) in enumerate(items):
+            fn(testbeds[0], i, item)
+        return
+
+    work = list(enumerate(items))
+    work_lock = threading.Lock()
+
+    def next_item(last):
+        with work_lock:
+            if not work:
+                return None
+            if affinity is not None and last is not None:
+                for (j, (_, item)) in enumerate(work):
+                    if affinity(item) == last:
+                        return work.pop(j)
+            return work.pop(0)
+
+    stop = threading.Event()
+    errors = []
+
+    def worker(testbed):
+        last = None
+        while not stop.is_set():
+            nxt = next_item(last)
+            if nxt is None:
+                return
+            (i, item) = nxt
+            if affinity is not None:
+                last = affinity(item)
+            try:
+                fn(testbed, i, item)
+            except BaseException as e:
+                agenda.failure(f"[{testbed}] failed: {e}")
+                errors.append(e)
+                stop.set()
+                return
+
+    threads = [threading.Thread(target=worker, args=(tb,), name=str(tb), daemon=True) for tb in testbeds]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,323 @@
+import glob
+import hashlib
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import agenda
+import numpy as np
+
+from columnar import read_columnar, update_columnar
+
+"""
+A static HTML report of an experiment, written without R: the alternative to graph.write_rmd.
+
+Every plot is an inline SVG, so index.html is a single file that only needs a browser. Time
+series are downsampled before they are drawn, with LTTB (largest triangle three buckets): each
+bucket of samples is represented by the one that spans the largest triangle with its neighbors,
+which keeps the spikes and dips that a plain 1-in-N sample loses. A plot then costs the same
+however long the experiment ran, and downsample only trades detail for report size.
+
+The report has the FCT CDF and summary (from fcts.hist and fcts.summary), then for every
+iteration its nimbus (ccp.parsed) and mahimahi (mm-graph.tmp) plots, rendered in parallel, and
+the config.
+
+Each section is cached as an HTML fragment in .report/ in the experiment directory, keyed by its
+inputs (see input_key), so regenerating the report after a few more iterations only renders
+those and reassembles the page from the rest.
+"""
+
+WIDTH = 1400
+HEIGHT = 300
+# left, right (for the legend), top, bottom
+MARGIN = (60, 170, 10, 40)
+# points kept per series, divided by downsample
+POINTS = 800
+COLORS = ["#F8766D", "#B79F00", "#00BA38", "#00BFC4", "#619CFF", "#F564E3", "#999999", "#000000"]
+DEFAULT_FIELDS = "zt, rout, rin, curr_rate, curr_q, elasticity2"
+# part of every fragment's key: bump when rendering changes, to invalidate cached fragments
+VERSION = 1
+CACHE_DIR = '.report'
+
+"""
+A key for something rendered from the files inputs with params: a hash of the params and of
+every input's path, size and modification time (or that it is missing), like ParseManifest's
+quick check.
+"""
+def input_key(kind, inputs, params):
+    h = hashlib.sha256(json.dumps([kind, VERSION, params]).encode())
+    for path in inputs:
+        if os.path.exists(path):
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        else:
+            h.update(f"{path}:missing\n".encode())
+    return h.hexdigest()
+
+# rendered fragments by key, one file each in .report/
+class FragmentCache:
+    def __init__(self, experiment_root):
+        self.dir = os.path.join(experiment_root, CACHE_DIR)
+        os.makedirs(self.dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.dir, key + ".html")
+
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, fragment):
+        with open(self.path(key) + ".tmp", 'w') as f:
+            f.write(fragment)
+        os.replace(self.path(key) + ".tmp", self.path(key))
+
+    # remove the fragments not in keys (e.g. of iterations whose logs changed since)
+    def prune(self, keys):
+        keep = {k + ".html" for k in keys}
+        for name in os.listdir(self.dir):
+            if name.endswith(".html") and name not in keep:
+                os.remove(os.path.join(self.dir, name))
+
+"""
+Downsample (x, y) to n points with largest triangle three buckets. The first and last points
+are kept, and the rest are split into n - 2 buckets of (about) equal size.
+"""
+def lttb(x, y, n):
+    if n < 3 or len(x) <= n:
+        return x, y
+    edges = np.linspace(1, len(x) - 1, n - 1).astype(np.int64)
+    keep = np.empty(n, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = len(x) - 1
+    a = 0
+    for i in range(n - 2):
+        (lo, hi) = (edges[i], edges[i + 1])
+        # the third corner is the mean of the next bucket (the last point, for the last bucket)
+        (nlo, nhi) = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (len(x) - 1, len(x))
+        (cx, cy) = (x[nlo:nhi].mean(), y[nlo:nhi].mean())
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return x[keep], y[keep]
+
+def downsampled(name, x, y, n):
+    (x, y) = (np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    ok = np.isfinite(x) & np.isfinite(y)
+    return (name,) + lttb(x[ok], y[ok], n)
+
+# about n round tick positions covering [lo, hi] (powers of 10, as exponents, with log)
+def ticks(lo, hi, n=6, log=False):
+    if log:
+        return np.arange(np.floor(lo), np.ceil(hi) + 1)
+    step = 10 ** np.floor(np.log10((hi - lo) / n))
+    for m in [1, 2, 5, 10]:
+        if (hi - lo) / (step * m) <= n:
+            break
+    step *= m
+    return np.arange(np.ceil(lo / step) * step, hi + step * 1e-9, step)
+
+"""
+An SVG line plot of series [(name, x, y)], sharing both axes. shade is a list of (xmin, xmax)
+ranges drawn as grey bands (e.g. when nimbus was in xtcp mode); with step, lines are drawn as
+steps (for CDFs).
+"""
+def svg_plot(series, xlabel="", ylabel="", shade=(), logx=False, step=False):
+    if logx:
+        series = [(name, np.log10(x[x > 0]), y[x > 0]) for (name, x, y) in series]
+    series = [(name, x, y) for (name, x, y) in series if len(x) > 0]
+    if not series:
+        return "<p>no data</p>"
+    (left, right, top, bottom) = MARGIN
+    (w, h) = (WIDTH - left - right, HEIGHT - top - bottom)
+    (x0, x1) = (min(x.min() for (_, x, _) in series), max(x.max() for (_, x, _) in series))
+    (y0, y1) = (min(0, min(y.min() for (_, _, y) in series)), max(y.max() for (_, _, y) in series))
+    (x1, y1) = (x1 if x1 > x0 else x0 + 1, y1 if y1 > y0 else y0 + 1)
+
+    def px(x):
+        return left + (x - x0) / (x1 - x0) * w
+    def py(y):
+        return top + (1 - (y - y0) / (y1 - y0)) * h
+
+    out = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{HEIGHT}" font-family="sans-serif" font-size="11">']
+    for (xmin, xmax) in shade:
+        (xmin, xmax) = (max(xmin, x0), min(xmax, x1))
+        if xmax > xmin:
+            out.append(f'<rect x="{px(xmin):.0f}" y="{top}" width="{max(px(xmax) - px(xmin), 1):.0f}" height="{h}" fill="black" fill-opacity="0.1"/>')
+    for t in ticks(x0, x1, log=logx):
+        if x0 <= t <= x1:
+            label = "{:g}".format(10 ** t if logx else t)
+            out.append(f'<line x1="{px(t):.0f}" x2="{px(t):.0f}" y1="{top}" y2="{top + h}" stroke="#e5e5e5"/>')
+            out.append(f'<text x="{px(t):.0f}" y="{top + h + 14}" text-anchor="middle">{label}</text>')
+    for t in ticks(y0, y1):
+        out.append(f'<line x1="{left}" x2="{left + w}" y1="{py(t):.0f}" y2="{py(t):.0f}" stroke="#e5e5e5"/>')
+        out.append(f'<text x="{left - 4}" y="{py(t) + 4:.0f}" text-anchor="end">{t:g}</text>')
+    out.append(f'<rect x="{left}" y="{top}" width="{w}" height="{h}" fill="none" stroke="#888"/>')
+
+    for (i, (name, x, y)) in enumerate(series):
+        color = COLORS[i % len(COLORS)]
+        if step:
+            (x, y) = (np.repeat(x, 2)[1:], np.repeat(y, 2)[:-1])
+        points = " ".join("{:.0f},{:.0f}".format(a, b) for (a, b) in zip(px(x), py(y)))
+        out.append(f'<polyline fill="none" stroke="{color}" stroke-width="1" points="{points}"/>')
+        ly = top + 14 * (i + 1)
+        out.append(f'<line x1="{left + w + 10}" x2="{left + w + 30}" y1="{ly - 4}" y2="{ly - 4}" stroke="{color}" stroke-width="2"/>')
+        out.append(f'<text x="{left + w + 35}" y="{ly}">{html.escape(name)}</text>')
+
+    out.append(f'<text x="{left + w / 2:.0f}" y="{HEIGHT - 5}" text-anchor="middle">{html.escape(xlabel)}</text>')
+    out.append(f'<text transform="translate(14,{top + h / 2:.0f}) rotate(-90)" text-anchor="middle">{html.escape(ylabel)}</text>')
+    out.append('</svg>')
+    return "\n".join(out)
+
+# a space separated text table with a header, as {name: [str]}
+def read_text_table(path):
+    with open(path) as f:
+        names = f.readline().split()
+        rows = [line.split() for line in f if line.strip()]
+    return {name: [r[i] for r in rows] for (i, name) in enumerate(names)}
+
+def html_table(path):
+    table = read_text_table(path)
+    names = list(table)
+    head = "".join(f"<th>{html.escape(n)}</th>" for n in names)
+    rows = ["".join(f"<td>{html.escape(v)}</td>" for v in row) for row in zip(*table.values())]
+    return "<table>\n<tr>{}</tr>\n{}\n</table>".format(head, "\n".join(f"<tr>{r}</tr>" for r in rows))
+
+def fct_inputs(experiment_root):
+    return [os.path.join(experiment_root, 'fcts.hist'), os.path.join(experiment_root, 'fcts.summary')]
+
+# the normalized FCT CDF of every scheme, from the histogram in fcts.hist
+def fct_section(experiment_root):
+    (hist_path, summary_path) = fct_inputs(experiment_root)
+    if not (os.path.isfile(hist_path) and os.path.isfile(summary_path)):
+        return ""
+    hist = read_text_table(hist_path)
+    series = []
+    schemes = sorted({(s, a) for (s, a, c) in zip(hist['sch'], hist['alg'], hist['Category']) if c == "all"})
+    for (sch, alg) in schemes:
+        rows = [i for i in range(len(hist['sch'])) if (hist['sch'][i], hist['alg'][i], hist['Category'][i]) == (sch, alg, "all")]
+        hi = np.array([float(hist['hi'][i]) for i in rows])
+        count = np.array([float(hist['count'][i]) for i in rows])
+        order = np.argsort(hi)
+        (hi, cdf) = (hi[order], np.cumsum(count[order]) / count.sum())
+        finite = np.isfinite(hi)
+        series.append((f"{sch}_{alg}", hi[finite], cdf[finite]))
+    return "<h4>Flow Completion Times</h4>\n{}\n{}".format(
+        svg_plot(series, xlabel="NormFct", ylabel="CDF", logx=True, step=True),
+        html_table(summary_path),
+    )
+
+def read_switches(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        next(f, None)
+        return [tuple(float(v) for v in line.split(",")[:2]) for line in f if line.strip()]
+
+def iteration_inputs(iteration_dir):
+    return [os.path.join(iteration_dir, name) for name in ['ccp.parsed', 'mm-graph.tmp', 'ccp_switch.parsed']]
+
+"""
+The plots of one iteration (run in a worker process): its nimbus log fields over time and the
+mahimahi throughput and delay, both with the time spent in xtcp mode shaded.
+"""
+def render_iteration(iteration_dir, experiment_root, fields, points):
+    shade = read_switches(os.path.join(iteration_dir, 'ccp_switch.parsed'))
+    out = ["<h4>{}</h4>".format(html.escape(os.path.relpath(iteration_dir, experiment_root)))]
+
+    ccp = os.path.join(iteration_dir, 'ccp.parsed')
+    if os.path.isfile(ccp) and os.path.getsize(ccp) > 0:
+        update_columnar(ccp, ",")
+        (cols, categories) = read_columnar(ccp)
+        series = [downsampled(f, cols['elapsed'], cols[f], points) for f in fields if f in cols and f not in categories]
+        out.append(svg_plot(series, xlabel="elapsed (s)", shade=shade))
+
+    mm = os.path.join(iteration_dir, 'mm-graph.tmp')
+    if os.path.isfile(mm) and os.path.getsize(mm) > 0:
+        update_columnar(mm, " ")
+        (cols, categories) = read_columnar(mm)
+        series = [downsampled(f, cols['t'], cols[f], points) for f in cols if f not in ('t', 'drops') and f not in categories]
+        out.append(svg_plot(series, xlabel="t (s)", ylabel="Mbps / ms", shade=shade))
+    return "\n".join(out)
+
+STYLE = """
+body { font-family: sans-serif; max-width: 1400px; margin-left: auto; margin-right: auto; }
+table { border-collapse: collapse; font-size: 12px; }
+td, th { border: 1px solid #ccc; padding: 2px 6px; text-align: right; }
+"""
+
+"""
+Write the report to index.html in the experiment directory. Iterations are the directories with
+a ccp.parsed or mm-graph.tmp; jobs is the number of worker processes rendering them (one per
+core by default); only those whose fragment is not cached are rendered. Takes the same options
+as write_rmd, of which downsample and fields apply.
+"""
+def write_html(experiment_root, downsample=None, fields=DEFAULT_FIELDS, jobs=None, **kwargs):
+    experiment_root = os.path.abspath(os.path.expanduser(experiment_root))
+    experiment_name = os.path.basename(experiment_root)
+    tomls = glob.glob(os.path.join(experiment_root, '*.toml'))
+    assert len(tomls) == 1, f"there should be exactly 1 .toml (config) in the experiment directory: {experiment_root} -> {tomls}"
+    with open(tomls[0]) as f:
+        config = f.read()
+
+    fields = [f.strip() for f in fields.split(",") if f.strip()]
+    points = max(POINTS // max(downsample or 1, 1), 3)
+    iterations = sorted({
+        os.path.dirname(p)
+        for name in ['ccp.parsed', 'mm-graph.tmp']
+        for p in glob.glob(experiment_root + '/**/' + name, recursive=True)
+        if os.path.dirname(p) != experiment_root
+    })
+
+    cache = FragmentCache(experiment_root)
+    keys = [input_key('iteration', iteration_inputs(d), [fields, points]) for d in iterations]
+    todo = [(d, k) for (d, k) in zip(iterations, keys) if cache.get(k) is None]
+    agenda.task(f"Rendering {len(todo)} of {len(iterations)} iteration(s) as HTML...")
+    if todo:
+        render = partial(render_iteration, experiment_root=experiment_root, fields=fields, points=points)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for ((_, key), fragment) in zip(todo, pool.map(render, [d for (d, _) in todo])):
+                cache.put(key, fragment)
+    sections = [cache.get(k) for k in keys]
+
+    fct_key = input_key('fct', fct_inputs(experiment_root), [])
+    fct = cache.get(fct_key)
+    if fct is None:
+        fct = fct_section(experiment_root)
+        cache.put(fct_key, fct)
+    cache.prune(keys + [fct_key])
+
+    contents = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>{style}</style>
+</head>
+<body>
+<h1>{title}</h1>
+<h3>Overall</h3>
+{fct}
+<h3>Per-Experiment</h3>
+{iterations}
+<h3>Config</h3>
+<pre>{config}</pre>
+</body>
+</html>
+""".format(
+        title = html.escape(experiment_name),
+        style = STYLE,
+        fct = fct,
+        iterations = "\n".join(sections),
+        config = html.escape(config),
+    )
+
+    out = os.path.join(experiment_root, 'index.html')
+    with open(out + ".tmp", 'w') as f:
+        f.write(contents)
+    os.replace(out + ".tmp", out)
@@ -9,12 +9,14 @@ def create_ssh_connections(config):
     conns = {}
     machines = {}
     args = config['args']
+    testbed = config.get('testbed')
     for (role, details) in [(r, d) for r, d in config['topology'].items() if r in ("sender", "inbox", "outbox", "receiver")]:
         hostname = details['name']
+        nickname = f"{testbed}/{role}" if testbed else role
         is_self = 'self' in details and details['self']
         if is_self:
             agenda.subtask(hostname)
-            conns[hostname] = ConnectionWrapper('localhost', nickname=role, dry=args.dry_run, verbose=args.verbose, interact=args.interact)
+            conns[hostname] = ConnectionWrapper('localhost', nickname=nickname, dry=args.dry_run, verbose=args.verbose, interact=args.interact, agent=args.agent)
             config['self'] = conns[hostname]
         elif not hostname in conns:
             agenda.subtask(hostname)
@@ -24,7 +26,7 @@ def create_ssh_connections(config):
                 user = details['user']
             if 'port' in details:
                 port = details['port']
-            conns[hostname] = ConnectionWrapper(hostname, nickname=role, user=user, port=port, dry=args.dry_run, verbose=args.verbose, interact=args.interact)
+            conns[hostname] = ConnectionWrapper(hostname, nickname=nickname, user=user, port=port, dry=args.dry_run, verbose=args.verbose, interact=args.interact, agent=args.agent)
         machines[role] = conns[hostname]
 
     return (conns, machines)
@@ -49,20 +51,20 @@ ip_addr_rgx = re.compile(r"\w+:\W*(?P<dev>\w+).*inet (?P<addr>[0-9]+\.[0-9]+\.[0
 # populate interface names and ips
 def get_interfaces(config, machines):
     agenda.section("Get node interfaces")
-    for m in machines:
+    def get(m, conn):
         if m == 'self' or 'ifaces' in config['topology'][m]:
-            agenda.subtask(f"{machines[m].addr}: {config['topology'][m]['ifaces']}")
-            continue
-        agenda.task(machines[m].addr)
-        conn = machines[m]
+            agenda.subtask(f"{conn.addr}: {config['topology'][m]['ifaces']}")
+            return
+        agenda.task(conn.addr)
         ifaces_raw = conn.run("ip -4 -o addr").stdout.strip().split("\n")
         ifaces = [ip_addr_rgx.match(i) for i in ifaces_raw]
         ifaces = [i.groupdict() for i in ifaces if i is not None and i["dev"] != "lo"]
         if len(ifaces) == 0:
             raise Exception(f"Could not find ifaces on {conn.addr}: {ifaces_raw}")
         config['topology'][m]['ifaces'] = ifaces
-        agenda.subtask(f"{machines[m].addr}: {config['topology'][m]['ifaces']}")
+        agenda.subtask(f"{conn.addr}: {config['topology'][m]['ifaces']}")
 
+    for_each_host(machines, get, roles=list(machines))
     return config
 
 # clone the bundler repository
@@ -71,22 +73,25 @@ def init_repo(config, machines):
     root = config['structure']['bundler_root']
     clone = f'git clone --recurse-submodules https://github.com/bundler-project/evaluation {root}'
 
-    for m in machines:
+    # the clone and build take a while, so all hosts do it at the same time
+    def init(m, conn):
         if m == 'self':
-            continue
-        agenda.task(f"init {m}: {machines[m].addr}")
+            return
+        agenda.task(f"init {m}: {conn.addr}")
         agenda.subtask("cloning eval repo")
-        if not machines[m].file_exists(root):
-            res = machines[m].run(clone)
+        if not conn.file_exists(root):
+            res = conn.run(clone)
         else:
             # previously cloned, update to latest commit
-            machines[m].run(f"cd {root} && git pull origin cloudlab")
-            machines[m].run(f"cd {root} && git submodule update --init --recursive")
+            conn.run(f"cd {root} && git pull origin cloudlab")
+            conn.run(f"cd {root} && git submodule update --init --recursive")
         agenda.subtask("compiling experiment tools")
-        machines[m].run(f"make -C {root}",
+        conn.run(f"make -C {root}",
             stdout=f"{config['structure']['bundler_root']}/{m}.out.mk",
             stderr=f"{config['structure']['bundler_root']}/{m}.err.mk")
 
+    for_each_host(machines, init, roles=list(machines))
+
 def bootstrap_topology(config, machines):
     config = get_interfaces(config, machines)
     init_repo(config, machines)
@@ -106,6 +111,8 @@ class MahimahiTopo:
         if self.machines is None or 'local_experiment_dir' not in config:
             raise Exception("Tried to fetch build logs without connecting")
 
+        # each testbed in a pool builds separately, so keep their logs apart
+        prefix = f"{config['testbed']}." if config.get('testbed') else ""
         for m in self.machines:
             agenda.subtask(f"fetch from {m}")
             root = config['structure']['bundler_root']
@@ -113,10 +120,10 @@ class MahimahiTopo:
                 root = root[2:]
             self.machines[m].get(
                 f"{root}/{m}.out.mk",
-                f"{config['local_experiment_dir']}/{m}.out.mk")
+                f"{config['local_experiment_dir']}/{prefix}{m}.out.mk")
             self.machines[m].get(
                 f"{root}/{m}.err.mk",
-                f"{config['local_experiment_dir']}/{m}.err.mk")
+                f"{config['local_experiment_dir']}/{prefix}{m}.err.mk")
 
     def setup_routing(self, config):
         """
@@ -132,66 +139,57 @@ class MahimahiTopo:
             initcwnd = config['topology']['sender']['initcwnd']
 
         agenda.subtask("sender")
-        expect(
-            machines['sender'].run(
+        with machines['sender'].batch() as b:
+            b.run(
                 "ip route del {receiver}; ip route add {receiver} via {inbox} src {sender} initcwnd {initcwnd}".format(
                     sender   = get_iface(config, 'sender')['addr'],
                     receiver = get_iface(config, 'receiver')['addr'],
                     inbox    = get_iface(config, 'inbox')['addr'],
                     initcwnd = initcwnd
                 ),
-                sudo=True
-            ),
-            "Failed to set routing tables at sender"
-        )
+                sudo=True,
+                msg="Failed to set routing tables at sender"
+            )
 
         agenda.subtask("inbox")
-        expect(
-            machines['inbox'].run(
+        with machines['inbox'].batch() as b:
+            b.run(
                 "sysctl net.ipv4.ip_forward=1",
-                sudo=True
-            ),
-            "Failed to set IP forwarding at inbox"
-        )
-        expect(
-            machines['inbox'].run(
+                sudo=True,
+                msg="Failed to set IP forwarding at inbox"
+            )
+            b.run(
                 "ip route del {receiver}; ip route add {receiver} dev {inbox_send_iface}".format(
                     receiver = get_iface(config, 'receiver')['addr'],
                     inbox_send_iface = get_iface(config, 'inbox')['dev']
                 ),
-                sudo=True
-            ),
-            "Failed to set forward route at inbox"
-        )
-        expect(
-            machines['inbox'].run(
+                sudo=True,
+                msg="Failed to set forward route at inbox"
+            )
+            b.run(
                 "ip route del {sender}; ip route add {sender} dev {inbox_recv_iface}".format(
                     sender = get_iface(config, 'sender')['addr'],
                     inbox_recv_iface = get_iface(config, 'inbox')['dev']
                 ),
-                sudo=True
-            ),
-            "Failed to set reverse route at inbox"
-        )
+                sudo=True,
+                msg="Failed to set reverse route at inbox"
+            )
 
         agenda.subtask("outbox")
-        expect(
-            machines['outbox'].run(
+        with machines['outbox'].batch() as b:
+            b.run(
                 "ip route del {sender_addr}; ip route add {sender_addr} via {inbox_addr}".format(
                     sender_addr = get_iface(config, 'sender')['addr'],
                     inbox_addr = get_iface(config, 'inbox')['addr']
-                ), sudo=True
-            ),
-            "Failed to set routing tables at outbox"
-        )
-
-        expect(
-            machines['outbox'].run(
+                ),
+                sudo=True,
+                msg="Failed to set routing tables at outbox"
+            )
+            b.run(
                 "sysctl net.ipv4.ip_forward=1",
-                sudo=True
-            ),
-            "Failed to set IP forwarding at outbox"
-        )
+                sudo=True,
+                msg="Failed to set IP forwarding at outbox"
+            )
 
     def run_traffic(self, config, exp, bundle_traffic, cross_traffic):
         machines = self.machines
@@ -229,13 +227,15 @@ class MahimahiTopo:
             nobundler = (exp.alg['name'] == "nobundler"),
         )
 
-    def start_inbox(self, qtype, q_buffer_size):
+    # out_dir: where to log instead of the iteration directory, for an inbox shared by several
+    # iterations (the log is then not one of this iteration's outputs)
+    def start_inbox(self, qtype, q_buffer_size, out_dir=None):
         config = self.config
         inbox = self.machines['inbox']
 
         agenda.subtask("Starting inbox")
 
-        inbox_out = os.path.join(config['iteration_dir'], "inbox.log")
+        inbox_out = os.path.join(out_dir or config['iteration_dir'], "inbox.log")
         res = inbox.run(
             "{path} --iface={iface} --port={port} --sample_rate={sample} --qtype={qtype} --buffer={buf}".format(
                 path=get_inbox_binary(config),
@@ -251,12 +251,11 @@ class MahimahiTopo:
             stderr=inbox_out,
         )
 
-        if not config['args'].dry_run:
-            time.sleep(10)
+        inbox.check_file('Wait for CCP to install datapath program', inbox_out, timeout=30)
         inbox.check_proc('inbox', inbox_out)
-        inbox.check_file('Wait for CCP to install datapath program', inbox_out)
 
-        config['iteration_outputs'].append((inbox, inbox_out))
+        if out_dir is None:
+            config['iteration_outputs'].append((inbox, inbox_out))
         return inbox_out
 
     def start_outbox(self, config):
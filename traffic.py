@@ -2,7 +2,6 @@ import sys
 import agenda
 from collections import namedtuple
 import os
-import time
 import io
 
 from util import *
@@ -76,10 +75,7 @@ class IperfTraffic(Traffic):
             "Failed to start iperf server on {}".format(node.addr)
         )
 
-        if not config['args'].dry_run:
-            time.sleep(1)
-
-        node.check_file('Server listening on TCP port', iperf_out)
+        node.check_file('Server listening on TCP port', iperf_out, timeout=10)
         config['iteration_outputs'].append((node, iperf_out))
         return iperf_out
 
@@ -156,12 +152,9 @@ class CBRTraffic(Traffic):
             "Failed to start iperf server on {}".format(node.addr)
         )
 
-        if not config['args'].dry_run:
-            time.sleep(2)
-
-        node.check_file('Server listening on TCP port', iperf_out)
+        node.check_file('Server listening on TCP port', iperf_out, timeout=10)
+        node.check_file('starting CCP', ccp_out, timeout=10)
         node.check_proc("ccp_const", ccp_out)
-        node.check_file('starting CCP', ccp_out)
         config['iteration_outputs'].append((node, iperf_out))
         config['iteration_outputs'].append((node, ccp_out))
         return iperf_out
@@ -259,8 +252,8 @@ class PoissonTraffic(Traffic):
         )
 
         if not config['args'].dry_run:
-            time.sleep(1)
-            num_servers_running = int(node.run("pgrep -c etgServer").stdout.strip())
+            node.wait_for_proc("etgServer", count=self.num_conns, timeout=10)
+            num_servers_running = node.proc_count("etgServer")
         else:
             num_servers_running = self.num_conns
         if num_servers_running != self.num_conns:
@@ -269,6 +262,9 @@ class PoissonTraffic(Traffic):
                 node.get(node.local_path(etg_out), local=f)
                 print(f.getvalue().decode("utf-8"))
             sys.exit(1)
+        # a running server is not necessarily listening yet, and the clients connect right away
+        if not config['args'].dry_run and not node.wait_for_port(self.start_port, timeout=10, count=self.num_conns):
+            fatal_warn("Poisson servers on {} are not listening on ports {}-{}".format(node.addr, self.start_port, self.start_port + self.num_conns - 1))
 
         config['iteration_outputs'].append((node, etg_out))
         return etg_out
@@ -2,7 +2,19 @@ import sys
 import agenda
 from fabric import Connection, Result
 from termcolor import colored
+import base64
+import inspect
+import io
+import json
 import os
+import re
+import shlex
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import node_agent
 
 ###################################################################################################
 # Helpers
@@ -12,8 +24,194 @@ class FakeResult(object):
         self.exited = 0
         self.stdout = '(dryrun)'
 
+class BatchResult(object):
+    def __init__(self, command):
+        self.command = command
+        self.exited = None
+        self.stdout = ''
+        self.stderr = ''
+
+"""
+A list of commands sent to one machine as a single remote script (one ssh round trip).
+
+Use as a context manager; the commands run when the block exits:
+
+    with conn.batch() as b:
+        b.run("mkdir -p {}".format(d), msg="Failed to create {}".format(d))
+        r = b.run("sysctl -w {}={}".format(k, v), sudo=True)
+
+Each command runs in its own bash -c, in order, regardless of whether earlier ones failed.
+run() returns a result (.exited, .stdout, .stderr, .command) that is filled in once the batch
+has executed, and commands given a msg are passed through expect().
+"""
+class CommandBatch(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.commands = []
+
+    def run(self, cmd, sudo=False, msg=None):
+        res = BatchResult(cmd)
+        self.commands.append((cmd, sudo, msg, res))
+        return res
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def script(self, token):
+        lines = ["d=$(mktemp -d)"]
+        for (i, (cmd, sudo, _msg, _res)) in enumerate(self.commands):
+            lines.append("{sudo}bash -c {cmd} > $d/out 2> $d/err < /dev/null; rc=$?".format(
+                sudo="sudo " if sudo else "",
+                cmd=shlex.quote(cmd),
+            ))
+            lines.append("echo \"{token} {i} $rc $(base64 -w0 < $d/out) $(base64 -w0 < $d/err)\"".format(token=token, i=i))
+        lines.append("rm -rf $d")
+        return "\n".join(lines) + "\n"
+
+    def execute(self):
+        if not self.commands:
+            return []
+        conn = self.conn
+
+        if conn.dry or conn.verbose:
+            for (cmd, sudo, _msg, _res) in self.commands:
+                print("[{}] (batch) {}{}".format(conn.nickname.ljust(10), "sudo " if sudo else "", cmd))
+
+        if conn.interact:
+            input("")
+
+        results = [res for (_cmd, _sudo, _msg, res) in self.commands]
+        if conn.dry:
+            for res in results:
+                res.exited = 0
+                res.stdout = '(dryrun)'
+            return results
+
+        token = "@@batch-{}".format(uuid.uuid4().hex)
+        encoded = base64.b64encode(self.script(token).encode()).decode()
+        batch_cmd = "echo {} | base64 -d | bash".format(encoded)
+        out = conn.agent_request('run', cmd=batch_cmd)
+        if out is not None:
+            out = AgentResult(batch_cmd, out['exited'], out['stdout'], out['stderr'])
+        else:
+            out = Connection.run(conn, batch_cmd, hide=True, warn=True, pty=False)
+
+        for line in out.stdout.splitlines():
+            sp = line.rstrip("\r\n").split(" ")
+            if len(sp) != 5 or sp[0] != token:
+                continue
+            res = results[int(sp[1])]
+            res.exited = int(sp[2])
+            res.stdout = base64.b64decode(sp[3]).decode(errors='replace')
+            res.stderr = base64.b64decode(sp[4]).decode(errors='replace')
+
+        for res in results:
+            if res.exited is None:
+                res.exited = out.exited if out.exited else -1
+                res.stderr = "batch script did not report a result for this command\n{}".format(out.stderr)
+            if conn.verbose and (res.stdout or res.stderr):
+                print(res.stdout + res.stderr, end='')
+
+        for (_cmd, _sudo, msg, res) in self.commands:
+            if msg:
+                expect(res, msg)
+        return results
+
+class AgentResult(object):
+    def __init__(self, command, exited, stdout='', stderr=''):
+        self.command = command
+        self.exited = exited
+        self.stdout = stdout
+        self.stderr = stderr
+
+"""
+Client side of node_agent.py: a single long-lived channel on an existing connection, over which
+requests are sent one JSON line at a time. Each request carries an id and the agent serves them
+concurrently, so a long-running command (e.g. the mahimahi shell that runs the traffic) doesn't
+hold up requests from other threads; a reader thread hands each response to the request waiting
+for it. request() returns None if the agent has gone away, so callers can fall back to plain ssh.
+"""
+class NodeAgent(object):
+    def __init__(self, conn):
+        source = base64.b64encode(inspect.getsource(node_agent).encode()).decode()
+        self.chan = conn.client.get_transport().open_session()
+        self.chan.exec_command("python3 -u -c \"import base64; exec(base64.b64decode('{}'))\"".format(source))
+        self.inp = self.chan.makefile('wb')
+        self.out = self.chan.makefile('rb')
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.pending = {}   # id: [event set once answered, response]
+        self.closing = False
+        self.reader = threading.Thread(target=self.read_responses, name="agent", daemon=True)
+        self.reader.start()
+
+    def read_responses(self):
+        error = "agent exited"
+        try:
+            for line in self.out:
+                resp = json.loads(line)
+                with self.lock:
+                    slot = self.pending.pop(resp['id'], None)
+                if slot is not None:
+                    slot[1] = resp
+                    slot[0].set()
+        except Exception as e:
+            error = e
+        self.lost(error)
+
+    # stop using the agent; requests still waiting for a response get None
+    def lost(self, error):
+        with self.lock:
+            if self.chan is None:
+                return
+            if not self.closing:
+                warn("lost control agent ({}), falling back to ssh".format(error), exit=False)
+            self.chan = None
+            pending = list(self.pending.values())
+            self.pending = {}
+        for slot in pending:
+            slot[0].set()
+
+    def request(self, op, **kwargs):
+        slot = [threading.Event(), None]
+        with self.lock:
+            if self.chan is None:
+                return None
+            self.next_id += 1
+            req = dict(kwargs, op=op, id=self.next_id)
+            self.pending[self.next_id] = slot
+            try:
+                self.inp.write((json.dumps(req) + "\n").encode())
+                self.inp.flush()
+                error = None
+            except Exception as e:
+                error = e
+        if error is not None:
+            self.lost(error)
+            return None
+
+        slot[0].wait()
+        resp = slot[1]
+        if resp is None:
+            return None
+        if not resp['ok']:
+            raise Exception("agent {} failed: {}".format(op, resp['error']))
+        return resp
+
+    def close(self):
+        with self.lock:
+            self.closing = True
+            chan = self.chan
+        if chan is not None:
+            chan.close()
+        self.lost("closed")
+
 class ConnectionWrapper(Connection):
-    def __init__(self, addr, nickname, user=None, port=None, verbose=True, dry=False, interact=False):
+    def __init__(self, addr, nickname, user=None, port=None, verbose=True, dry=False, interact=False, agent=False):
         super().__init__(
             addr,
             forward_agent=True,
@@ -29,6 +227,25 @@ class ConnectionWrapper(Connection):
         # Start the ssh connection
         super().open()
 
+        self.agent = None
+        if agent and not dry:
+            self.start_agent()
+
+    """
+    Start a control agent (node_agent.py) on the remote machine. From then on, commands and
+    file/process checks go through it over one channel instead of starting a new remote shell
+    each time.
+    """
+    def start_agent(self):
+        self.agent = NodeAgent(self)
+        if self.agent.request('stat', path='~') is None:
+            self.agent = None
+
+    def agent_request(self, op, **kwargs):
+        if self.agent is None or self.dry:
+            return None
+        return self.agent.request(op, **kwargs)
+
     """
     Run a command on the remote machine
 
@@ -51,11 +268,10 @@ class ConnectionWrapper(Connection):
     """
     def run(self, cmd, *args, stdin="/dev/stdin", stdout="/dev/stdout", stderr="/dev/stderr", ignore_out=False, wd=None, sudo=False, background=False, pty=True, **kwargs):
         # Prepare command string
-        pre = ""
+        cd = ""
         if wd:
-            pre += "cd {} && ".format(wd)
-        if background:
-            pre += "screen -d -m "
+            cd = "cd {} && ".format(wd)
+        pre = ""
         #escape the strings
         cmd = cmd.replace("\"", "\\\"")
         if sudo:
@@ -76,6 +292,9 @@ class ConnectionWrapper(Connection):
         )
 
         full_cmd += "\""
+        # the agent starts background commands in a session of their own, without screen
+        spawn_cmd = cd + full_cmd
+        full_cmd = cd + ("screen -d -m " if background else "") + full_cmd
 
         # Prepare arguments for invoke/fabric
         if background:
@@ -89,44 +308,199 @@ class ConnectionWrapper(Connection):
         if self.interact:
             input("")
 
-        if not self.dry:
-            return super().run(full_cmd, *args, hide=(not self.verbose), warn=True, pty=pty, **kwargs)
-        else:
+        if self.dry:
             return FakeResult()
 
+        if background:
+            resp = self.agent_request('spawn', cmd=spawn_cmd)
+            if resp is not None:
+                return AgentResult(full_cmd, resp['exited'])
+        else:
+            resp = self.agent_request('run', cmd=full_cmd)
+            if resp is not None:
+                if self.verbose and (resp['stdout'] or resp['stderr']):
+                    print(resp['stdout'] + resp['stderr'], end='')
+                return AgentResult(full_cmd, resp['exited'], resp['stdout'], resp['stderr'])
+
+        return super().run(full_cmd, *args, hide=(not self.verbose), warn=True, pty=pty, **kwargs)
+
+    def batch(self):
+        return CommandBatch(self)
+
     def file_exists(self, fname):
+        resp = self.agent_request('glob', path=fname)
+        if resp is not None:
+            return len(resp['paths']) > 0
         res = self.run("ls {}".format(fname))
         return res.exited == 0
 
+    def glob(self, path):
+        resp = self.agent_request('glob', path=path)
+        if resp is not None:
+            return resp['paths']
+        if self.dry:
+            return []
+        res = Connection.run(self, "ls -1d {}".format(path), hide=True, warn=True, pty=False)
+        return res.stdout.split() if res.exited == 0 else []
+
+    # the contents of a (growing) remote file from byte offset on, and the offset to read from next
+    def read_from(self, path, offset=0):
+        resp = self.agent_request('read', path=path, offset=offset)
+        if resp is not None:
+            return resp['data'], resp['offset']
+        if self.dry:
+            return '', offset
+        # stdout is decoded (undecodable bytes replaced), so read up to the size stat reports and
+        # take the offset from that, rather than from the length of the output
+        res = Connection.run(self, "size=$(stat -c %s {path} 2>/dev/null || echo {offset}); echo $size; [ $size -gt {offset} ] && tail -c +{start} {path} | head -c $((size - {offset}))".format(
+            path=path,
+            offset=offset,
+            start=offset+1,
+        ), hide=True, warn=True, pty=False)
+        (size, _, data) = res.stdout.partition("\n")
+        try:
+            return data, max(int(size), offset)
+        except ValueError:
+            return '', offset
+
     def prog_exists(self, prog):
+        resp = self.agent_request('which', prog=prog)
+        if resp is not None:
+            return resp['exited'] == 0
         res = self.run("which {}".format(prog))
         return res.exited == 0
 
-    def check_proc(self, proc_name, proc_out):
-        res = self.run("pgrep {}".format(proc_name))
-        if res.exited != 0:
+    """
+    Wait until cond (a shell test) holds on the remote machine.
+
+    This is a single remote command that polls cond with exponential backoff (50ms up to 500ms)
+    and returns as soon as it holds, rather than sleeping for a fixed amount of time.
+    Returns True if cond held within timeout seconds.
+    """
+    def wait_until(self, cond, timeout=30):
+        script = "end=$((SECONDS+{timeout})); d=0.05; until {cond}; do [ $SECONDS -ge $end ] && exit 1; sleep $d; case $d in 0.05) d=0.1;; 0.1) d=0.2;; 0.2) d=0.5;; esac; done".format(
+            timeout=timeout,
+            cond=cond,
+        )
+        # run() wraps the command in double quotes, so keep the outer shell from expanding these
+        res = self.run(script.replace("$", "\\$"))
+        return res.exited == 0
+
+    def wait_for_line(self, grep, where, timeout=30):
+        resp = self.agent_request('wait', path=where, pattern=re.escape(grep), timeout=timeout)
+        if resp is not None:
+            return resp['exited'] == 0
+        return self.wait_until("grep -q \"{}\" {}".format(grep, where), timeout=timeout)
+
+    # wait until something listens on each of the count tcp ports from port on
+    def wait_for_port(self, port, timeout=30, count=1):
+        return self.wait_until("[ $(ss -ltnH 'sport >= :{lo} and sport <= :{hi}' | awk '{{print $4}}' | sed 's/.*://' | sort -u | wc -l) -ge {count} ]".format(
+            lo=port,
+            hi=port + count - 1,
+            count=count,
+        ), timeout=timeout)
+
+    """
+    Poll the agent with op(**kwargs) until done(response) holds, with the same backoff as
+    wait_until. Returns whether it did within timeout seconds, or None without an agent.
+    """
+    def agent_poll(self, op, done, timeout, **kwargs):
+        end = time.time() + timeout
+        delay = 0.05
+        while True:
+            resp = self.agent_request(op, **kwargs)
+            if resp is None:
+                return None
+            if done(resp):
+                return True
+            if time.time() >= end:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    # proc_name is a pgrep pattern
+    def wait_for_proc(self, proc_name, count=1, timeout=30):
+        found = self.agent_poll('pgrep', lambda r: r['count'] >= count, timeout, pattern=proc_name)
+        if found is not None:
+            return found
+        return self.wait_until("[ $(pgrep -c \"{}\") -ge {} ]".format(proc_name, count), timeout=timeout)
+
+    # wait until no process matches proc_name (e.g. after killing them)
+    def wait_for_exit(self, proc_name, timeout=30):
+        gone = self.agent_poll('pgrep', lambda r: r['count'] == 0, timeout, pattern=proc_name)
+        if gone is not None:
+            return gone
+        return self.wait_until("! pgrep \"{}\" > /dev/null".format(proc_name), timeout=timeout)
+
+    # the number of processes whose name matches pattern (a pgrep regex)
+    def proc_count(self, pattern):
+        resp = self.agent_request('pgrep', pattern=pattern)
+        if resp is not None:
+            return resp['count']
+        res = self.run("pgrep -c \"{}\"".format(pattern))
+        return int(res.stdout.strip()) if res.stdout.strip().isdigit() else 0
+
+    # send signal to the processes whose name matches pattern (a pkill regex)
+    def kill(self, pattern, signal=9, sudo=False):
+        cmd = "pkill -{} \"{}\"".format(signal, pattern)
+        if self.verbose and self.agent is not None and not self.dry:
+            print("[{}]       {}{}".format(self.nickname.ljust(10), "sudo " if sudo else "", cmd))
+        resp = self.agent_request('kill', pattern=pattern, signal=signal, sudo=sudo)
+        if resp is not None:
+            return AgentResult(cmd, resp['exited'])
+        return self.run(cmd, sudo=sudo)
+
+    # the last lines of a remote file, as a result with .command, .exited and .stdout
+    def tail(self, path, lines=10):
+        try:
+            resp = self.agent_request('tail', path=path, lines=lines)
+        except Exception as e:
+            return AgentResult("tail {}".format(path), 1, '', str(e))
+        if resp is not None:
+            return AgentResult("tail {}".format(path), resp['exited'], resp['data'] + "\n")
+        return self.run("tail -n {} {}".format(lines, path))
+
+    """
+    check_proc and check_file exit if the process / line is not there. If a timeout is given,
+    they first wait up to that many seconds for it to show up.
+    """
+    def check_proc(self, proc_name, proc_out, timeout=None):
+        if timeout:
+            self.wait_for_proc(proc_name, timeout=timeout)
+        resp = self.agent_request('pgrep', pattern=proc_name)
+        if resp is not None:
+            running = resp['count'] > 0
+        else:
+            running = self.run("pgrep {}".format(proc_name)).exited == 0
+        if not running:
             fatal_warn('failed to find running process with name \"{}\" on {}'.format(proc_name, self.addr), exit=False)
-            res = self.run('tail {}'.format(proc_out))
+            res = self.tail(proc_out)
             if not self.verbose and res.exited == 0:
                 print(res.command)
                 print(res.stdout)
             sys.exit(1)
 
 
-    def check_file(self, grep, where):
-        res = self.run("grep \"{}\" {}".format(grep, where))
-        if res.exited != 0:
+    def check_file(self, grep, where, timeout=None):
+        if timeout:
+            found = self.wait_for_line(grep, where, timeout=timeout)
+        else:
+            found = self.run("grep \"{}\" {}".format(grep, where)).exited == 0
+        if not found:
             fatal_warn("Unable to find search string (\"{}\") in process output file {}".format(
                 grep,
                 where
             ), exit=False)
-            res = self.run('tail {}'.format(where))
+            res = self.tail(where)
             if not self.verbose and res.exited == 0:
                 print(res.command)
                 print(res.stdout)
             sys.exit(1)
 
     def local_path(self, path):
+        resp = self.agent_request('glob', path=path)
+        if resp is not None and resp['paths']:
+            return resp['paths'][0]
         r = self.run(f"ls {path}")
         return r.stdout.strip().replace("'", "")
 
@@ -149,7 +523,11 @@ class ConnectionWrapper(Connection):
         else:
             return FakeResult()
 
-    def get(self, remote_file, local=None, preserve_mode=True):
+    """
+    sftp : optional separate SFTP session (from open_sftp) to transfer with, so that a
+           background thread can download files while this connection keeps being used
+    """
+    def get(self, remote_file, local=None, preserve_mode=True, sftp=None):
         if self.dry or self.verbose:
             print("[{}] scp {}:{} -> localhost:{}".format(
                 self.addr,
@@ -161,39 +539,160 @@ class ConnectionWrapper(Connection):
         if self.interact:
             input("")
 
-        if not self.dry:
-            return super().get(remote_file, local=local, preserve_mode=preserve_mode)
-        else:
+        if self.dry:
             return FakeResult()
+        elif sftp is not None:
+            return sftp.get(remote_file, local)
+        else:
+            return super().get(remote_file, local=local, preserve_mode=preserve_mode)
+
+    """
+    Run cmd and copy its (binary) stdout into the file object out as it arrives, instead of
+    capturing it as text like run. Runs on a channel of its own, so it can be used from a
+    background thread. Returns (exit code, stderr).
+    """
+    def stream(self, cmd, out, chunk=1 << 20):
+        if self.dry or self.verbose:
+            print("[{}] {} > localhost:{}".format(self.addr, cmd, getattr(out, 'name', '(stream)')))
+
+        if self.interact:
+            input("")
+
+        if self.dry:
+            return 0, ''
+        self.open()
+        chan = self.client.get_transport().open_session()
+        try:
+            chan.exec_command(cmd)
+            for data in iter(lambda: chan.recv(chunk), b''):
+                out.write(data)
+            stderr = chan.makefile_stderr('rb').read().decode(errors='replace')
+            return chan.recv_exit_status(), stderr
+        finally:
+            chan.close()
+
+    def open_sftp(self):
+        return self.client.open_sftp()
+
+###################################################################################################
+# Per-host operations
+###################################################################################################
+ROLES = ("sender", "inbox", "outbox", "receiver")
+
+# Sends a thread's output to its own buffer while it has one, so that output from hosts being
+# set up in parallel is printed host by host instead of interleaved.
+class HostOutput(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, s):
+        buf = getattr(self.local, 'buf', None)
+        return (buf if buf is not None else self.stream).write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, attr):
+        return getattr(self.stream, attr)
+
+host_output_lock = threading.Lock()
+# number of for_each_host fan-outs in progress (testbeds run theirs in parallel)
+host_output_users = 0
+
+"""
+Run fn(role, conn) for every role in roles that is in machines, with different hosts in parallel.
+
+Roles that share a host (e.g. outbox and receiver) run one after the other, in the order given,
+on that host's worker. Each host's output is printed in one piece once the host is done, and
+errors are reported per host once every host has finished; the first one is then re-raised
+(including the SystemExit from fatal_warn). In interactive mode everything runs sequentially.
+
+Returns {role: fn(role, conn)}.
+"""
+def for_each_host(machines, fn, roles=ROLES):
+    roles = [r for r in roles if r in machines]
+    hosts = {}
+    for r in roles:
+        hosts.setdefault(id(machines[r]), []).append(r)
+    hosts = list(hosts.values())
+
+    results = {}
+    if len(hosts) < 2 or any(machines[r].interact for r in roles):
+        for r in roles:
+            results[r] = fn(r, machines[r])
+        return results
+
+    # installed only while hosts run in parallel, and put back once the last fan-out is done
+    global host_output_users
+    with host_output_lock:
+        if host_output_users == 0:
+            sys.stdout = HostOutput(sys.stdout)
+        host_output_users += 1
+        out = sys.stdout
+
+    def run_host(host_roles):
+        out.local.buf = io.StringIO()
+        try:
+            for r in host_roles:
+                results[r] = fn(r, machines[r])
+            return None
+        except BaseException as e:
+            return e
+        finally:
+            buf = out.local.buf
+            out.local.buf = None
+            with host_output_lock:
+                out.stream.write(buf.getvalue())
+                out.stream.flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            errors = list(executor.map(run_host, hosts))
+    finally:
+        with host_output_lock:
+            host_output_users -= 1
+            if host_output_users == 0:
+                sys.stdout = out.stream
+
+    failed = [(host_roles, e) for (host_roles, e) in zip(hosts, errors) if e is not None]
+    for (host_roles, e) in failed:
+        conn = machines[host_roles[0]]
+        agenda.subfailure("{} ({}) failed: {}".format(conn.addr, ",".join(host_roles), e if not isinstance(e, SystemExit) else "exited"))
+    if failed:
+        raise failed[0][1]
+
+    return results
 
 def update_sysctl(machines, config):
     if 'sysctl' in config:
         agenda.task("Updating sysctl")
 
-        for (name, conn) in set((m, machines[m]) for m in machines if m in ("sender", "inbox", "outbox", "receiver")):
+        def update(name, conn):
             agenda.subtask(f"{name}")
 
-            for k in config['sysctl']:
-                v = config['sysctl'][k]
-                expect(
-                    conn.run(f"sysctl -w {k}=\"{v}\"", sudo=True),
-                    f"Failed to set {k} on {conn.addr}"
-                )
+            with conn.batch() as b:
+                for k in config['sysctl']:
+                    v = config['sysctl'][k]
+                    b.run(f"sysctl -w {k}=\"{v}\"", sudo=True, msg=f"Failed to set {k} on {conn.addr}")
+
+        for_each_host(machines, update)
 
 def disable_tcp_offloads(config, machines):
     agenda.task("Turn off TSO, GSO, and GRO")
-    for (name, conn) in set((m, machines[m]) for m in machines if m in ("sender", "inbox", "outbox", "receiver")):
+    def disable(name, conn):
         agenda.subtask(name)
-        for iface in config['topology'][name]['ifaces']:
-            expect(
-                conn.run(
+        with conn.batch() as b:
+            for iface in config['topology'][name]['ifaces']:
+                b.run(
                     "ethtool -K {} tso off gso off gro off".format(
                         iface['dev']
                     ),
-                    sudo=True
-                ),
-                "Failed to turn off optimizations"
-            )
+                    sudo=True,
+                    msg="Failed to turn off optimizations"
+                )
+
+    for_each_host(machines, disable)
 
 def start_tcpprobe(config, sender):
     if config['args'].verbose:
@@ -234,27 +733,24 @@ def start_tcpdump(config, machines):
 
     return config
 
-def kill_leftover_procs(config, machines, verbose=False):
+# keep: names of processes to leave running (e.g. an inbox and ccp reused by the next experiment)
+def kill_leftover_procs(config, machines, verbose=False, keep=()):
     agenda.subtask("Kill leftover experiment processes")
-    for (_name, conn) in set((m, machines[m]) for m in machines if m in ("sender", "inbox", "outbox", "receiver")):
-        proc_regex = "|".join(["inbox", "outbox", *config['ccp'].keys(), "iperf", "tcpdump", "etgClient", "etgServer", "ccp_const"])
-        conn.run(
-            "pkill -9 \"({search})\"".format(
-                search=proc_regex
-            ),
-            sudo=True
-        )
-        res = conn.run(
-            "pgrep -c \"({search})\"".format(
-                search=proc_regex
-            ),
-            sudo=True
-        )
-        if not res.exited and not config['args'].dry_run:
+    procs = ["inbox", "outbox", *config['ccp'].keys(), "iperf", "tcpdump", "etgClient", "etgServer", "ccp_const"]
+    proc_regex = "|".join(p for p in procs if p not in keep)
+
+    def kill(_name, conn):
+        conn.kill("({})".format(proc_regex), sudo=True)
+        # killed processes take a moment to go away, so wait for them before checking
+        gone = conn.wait_for_exit("({})".format(proc_regex), timeout=5)
+        if not gone and not config['args'].dry_run:
             fatal_warn("Failed to kill all procs on {}.".format(conn.addr))
+        return gone
+
+    results = for_each_host(machines, kill)
 
-    # True = some processes remain, therefore there *are* zombies, so we return false
-    return (not res.exited)
+    # some processes remain, therefore there *are* zombies, so we return true
+    return any(not gone for gone in results.values())
 
 def expect(res, msg):
     if res and res.exited: